@@ -40,7 +40,7 @@ class RegisteredMatchActions(object):
         self._registered_matches[attribute] = handler
 
     def lookup(self, attribute):
-        if attribute not in self._registered_matches.keys():
+        if attribute not in self._registered_matches:
             # This is normal. Everything that returns this should be handled by 
             # the Match class
             # FIXME - Is this always true?
@@ -49,6 +49,6 @@ class RegisteredMatchActions(object):
         return self._registered_matches[attribute]
 
     def exists(self, attribute):
-        return (attribute in self._registered_matches.keys())
+        return (attribute in self._registered_matches)
 
 
@@ -0,0 +1,93 @@
+#########################
+# NetAssay Project
+#########################
+
+# Copyright 2015 - Sean Donovan
+
+# Definition of the FlowShadow.
+# The MCM keeps one per switch, holding the rules NAMAs have asked for:
+#    cookie -> (table_id, priority, match, instructions)
+# It's kept up to date by the switch's FlowModBatcher as flow-mods are queued,
+# so it's what the switch should have, whether or not it has been sent yet.
+#
+# When a switch reconnects, its flow table is pulled with an
+# OFPFlowStatsRequest and compared with the shadow by diff(). Only the rules
+# that are missing or stale are sent, rather than replaying everything.
+#
+# Every NAMA rule has a cookie of its own, and a cookie's rule never changes.
+# So rules are compared on cookie, table, priority and match, and instructions
+# are left out to keep the diff cheap on big tables.
+#
+# Two NAMAs can shadow rules with the same table, priority and match under
+# different cookies. The switch only keeps one of them, as adding the second
+# replaces the first. diff() treats such rules as a group: if any of them is
+# on the switch, the group is, and if none is, only the most recently
+# recorded one is added. Otherwise every reconnect would add the rest, each
+# replacing the last.
+
+
+class FlowShadow(object):
+    def __init__(self):
+        self.entries = {}
+        self.recorded = {}     # cookie -> sequence number of its record()
+        self.sequence = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def record(self, mod):
+        self.entries[mod.cookie] = (mod.table_id, mod.priority, mod.match,
+                                    mod.instructions)
+        self.sequence += 1
+        self.recorded[mod.cookie] = self.sequence
+
+    def forget(self, cookie):
+        self.entries.pop(cookie, None)
+        self.recorded.pop(cookie, None)
+
+    def forget_cookies(self, cookie, cookie_mask):
+        for key in self.entries.keys():
+            if key & cookie_mask == cookie:
+                del self.entries[key]
+                del self.recorded[key]
+
+    def diff(self, flow_stats, owned):
+        """
+        flow_stats is the body of the switch's flow stats replies, owned(cookie)
+        says whether a rule on the switch is one of ours. Returns the cookies
+        to delete from the switch, and the cookies of the shadow's rules to
+        add to it.
+        """
+        # (table, priority, match) of each shadowed rule, and the most
+        # recently recorded cookie with each of them.
+        rule_keys = {}
+        newest = {}
+        for (cookie, entry) in self.entries.iteritems():
+            rule_key = (entry[0], entry[1], _match_key(entry[2]))
+            rule_keys[cookie] = rule_key
+            other = newest.get(rule_key)
+            if other is None or self.recorded[cookie] > self.recorded[other]:
+                newest[rule_key] = cookie
+
+        deletes = []
+        present = set()
+        for stat in flow_stats:
+            cookie = stat.cookie
+            rule_key = rule_keys.get(cookie)
+            if rule_key is None:
+                if owned(cookie):
+                    deletes.append(cookie)
+                continue
+            if (stat.table_id == rule_key[0] and
+                stat.priority == rule_key[1] and
+                _match_key(stat.match) == rule_key[2]):
+                present.add(rule_key)
+            else:
+                deletes.append(cookie)
+        adds = [cookie for (rule_key, cookie) in newest.iteritems()
+                if rule_key not in present]
+        return (deletes, adds)
+
+
+def _match_key(match):
+    return tuple(sorted(match.items()))
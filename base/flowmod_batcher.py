@@ -0,0 +1,258 @@
+#########################
+# NetAssay Project
+#########################
+
+# Copyright 2015 - Sean Donovan
+
+# Definition of the FlowModBatcher.
+# The MCM keeps one per datapath. NAMAs hand their flow-mods to it rather than
+# sending them one at a time, as every DNS answer becomes a src and a dst rule
+# on each NAMA that's interested.
+#
+# Flow-mods are held for up to window seconds, or until max_messages are
+# pending, whichever comes first. Then they're serialized into one buffer, with
+# an OFPBarrierRequest on the end, and written to the switch in a single send.
+#
+# Each flow-mod is given with a key for the rule it changes, its cookie. If a
+# rule is added and deleted again within the window, say for a short TTL,
+# neither is sent. delete_cookies() takes a flow-mod that deletes by cookie
+# mask, and drops the pending adds it covers.
+#
+# If given a FlowShadow (see flow_shadow.py), the batcher keeps it up to date
+# as flow-mods are queued. Flow-mods from push() are sent as they are, without
+# touching the shadow. reconcile() diffs a switch's flow table against the
+# shadow and queues the flow-mods that fix it up, all under the lock, so that
+# NAMAs changing rules at the same time can't slip in between.
+#
+# When the switch answers the barrier, every flow-mod in the batch has been
+# applied. Pass each EventOFPBarrierReply to NetAssayMCM.barrier_reply_handler()
+# so that the batch's latency is recorded. See stats().
+#
+# The window is armed with the timer executor's call_later() rather than a
+# py_timer, as windows shorter than py_timer's slack would expire immediately.
+# Under Ryu, create the MCM with green=True: the executor is then the green
+# executor, so windows expire, and batches are sent, on Ryu's hub rather than
+# on an OS thread.
+#
+# Batches are built under the lock, but sent after it's released, as
+# datapath.send() can block on a full send queue. They're queued in order on
+# an outbox and sent by whoever holds the send lock, so they still reach the
+# switch in the order they were built.
+
+import logging
+from threading import Lock
+
+from base.lib.py_timer import py_timer_manager
+from base.lib.py_clock import monotonic
+
+DEFAULT_WINDOW = 0.01
+DEFAULT_MAX_MESSAGES = 256
+
+
+class FlowModBatcher(object):
+    def __init__(self, datapath, shadow=None, window=DEFAULT_WINDOW,
+                 max_messages=DEFAULT_MAX_MESSAGES):
+        self.logger = logging.getLogger('netassay.FlowModBatcher')
+        self.datapath = datapath
+        self.shadow = shadow
+        self.window = window
+        self.max_messages = max_messages
+
+        self.lock = Lock()
+        self.pending = []          # [key, flow-mod], flow-mod None if cancelled
+        self.pending_adds = {}     # key -> pending entry of an add
+        self.live = 0
+        self.timer = None
+        self.barriers = {}         # barrier xid -> (sent at, flow-mods)
+        self.outbox = []           # (datapath, data) of built batches
+        self.send_lock = Lock()
+
+        self.batches = 0
+        self.messages = 0
+        self.cancelled = 0
+        self.acked = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_latency = None
+
+    def add(self, key, mod):
+        with self.lock:
+            if self.shadow is not None:
+                self.shadow.record(mod)
+            entry = [key, mod]
+            self.pending.append(entry)
+            self.pending_adds[key] = entry
+            self.live += 1
+            self._pending_changed()
+        self._send_outbox()
+
+    def delete(self, key, mod):
+        with self.lock:
+            if self.shadow is not None:
+                self.shadow.forget(key)
+            entry = self.pending_adds.pop(key, None)
+            if entry is not None:
+                # The rule was never sent, so there's nothing to delete.
+                entry[1] = None
+                self.live -= 1
+                self.cancelled += 2
+                return
+            self.pending.append([key, mod])
+            self.live += 1
+            self._pending_changed()
+        self._send_outbox()
+
+    def delete_cookies(self, cookie, cookie_mask, mod):
+        with self.lock:
+            if self.shadow is not None:
+                self.shadow.forget_cookies(cookie, cookie_mask)
+            for key in self.pending_adds.keys():
+                if key & cookie_mask == cookie:
+                    self.pending_adds.pop(key)[1] = None
+                    self.live -= 1
+                    self.cancelled += 1
+            # Still sent, as earlier batches may have added rules it covers.
+            self.pending.append([None, mod])
+            self.live += 1
+            self._pending_changed()
+        self._send_outbox()
+
+    def push(self, mods):
+        with self.lock:
+            self._push(mods)
+        self._send_outbox()
+
+    def reconcile(self, flow_stats, owned, build_mods):
+        """
+        flow_stats and owned are as for FlowShadow.diff().
+        build_mods(shadow, deletes, adds) returns the flow-mods for the diff,
+        and is called with the lock held. Returns the number of deletes and
+        adds.
+        """
+        with self.lock:
+            (deletes, adds) = self.shadow.diff(flow_stats, owned)
+            self._push(build_mods(self.shadow, deletes, adds))
+        self._send_outbox()
+        return (len(deletes), len(adds))
+
+    def rebind(self, datapath):
+        # The switch has reconnected. Whatever hadn't been sent to the old
+        # connection is dropped: the shadow already has it, and the switch
+        # is reconciled with the shadow.
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            self.datapath = datapath
+            self.pending = []
+            self.pending_adds = {}
+            self.live = 0
+            self.barriers = {}
+            self.outbox = []
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+        self._send_outbox()
+
+    def barrier_reply(self, msg):
+        # Returns True if the barrier was one of ours.
+        with self.lock:
+            sent = self.barriers.pop(msg.xid, None)
+            if sent is None:
+                return False
+            (sent_at, count) = sent
+            latency = monotonic() - sent_at
+            self.acked += 1
+            self.total_latency += latency
+            self.last_latency = latency
+            if latency > self.max_latency:
+                self.max_latency = latency
+        self.logger.debug("Switch " + str(self.datapath.id) + ": batch of " +
+                          str(count) + " flow-mods applied in " +
+                          str(latency * 1000) + "ms")
+        return True
+
+    def stats(self):
+        with self.lock:
+            mean = None
+            if self.acked != 0:
+                mean = self.total_latency / self.acked
+            return {'batches'      : self.batches,
+                    'messages'     : self.messages,
+                    'cancelled'    : self.cancelled,
+                    'pending'      : self.live,
+                    'unacked'      : len(self.barriers),
+                    'mean_latency' : mean,
+                    'max_latency'  : self.max_latency,
+                    'last_latency' : self.last_latency}
+
+    def _push(self, mods):
+        # Called with the lock held.
+        for mod in mods:
+            self.pending.append([None, mod])
+            self.live += 1
+            if self.live >= self.max_messages:
+                self._flush()
+        self._pending_changed()
+
+    def _pending_changed(self):
+        # Called with the lock held.
+        if self.live >= self.max_messages:
+            self._flush()
+        elif self.live != 0 and self.timer is None:
+            executor = py_timer_manager.get_instance().executor
+            self.timer = executor.call_later(self.window,
+                                             self._window_expired)
+
+    def _window_expired(self):
+        with self.lock:
+            # Lost a race with a flush that cancelled this window.
+            if self.timer is None:
+                return
+            self.timer = None
+            self._flush()
+        self._send_outbox()
+
+    def _send_outbox(self):
+        # Called without the lock held. Whoever queues a batch calls this
+        # afterwards, so an empty outbox can be checked without the lock.
+        if len(self.outbox) == 0:
+            return
+        with self.send_lock:
+            with self.lock:
+                outbox = self.outbox
+                self.outbox = []
+            for (datapath, data) in outbox:
+                datapath.send(data)
+
+    def _flush(self):
+        # Called with the lock held.
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        pending = self.pending
+        self.pending = []
+        self.pending_adds = {}
+        self.live = 0
+
+        datapath = self.datapath
+        bufs = []
+        for (key, mod) in pending:
+            if mod is None:
+                continue
+            datapath.set_xid(mod)
+            mod.serialize()
+            bufs.append(mod.buf)
+        if len(bufs) == 0:
+            return
+
+        barrier = datapath.ofproto_parser.OFPBarrierRequest(datapath)
+        datapath.set_xid(barrier)
+        barrier.serialize()
+        bufs.append(barrier.buf)
+
+        self.barriers[barrier.xid] = (monotonic(), len(bufs) - 1)
+        self.batches += 1
+        self.messages += len(bufs) - 1
+        self.outbox.append((datapath, ''.join([str(buf) for buf in bufs])))
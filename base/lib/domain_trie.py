@@ -0,0 +1,106 @@
+# Copyright 2015 Sean Donovan
+# Reversed-label trie for matching DNS names against domain patterns.
+#
+# Patterns are either exact names, such as 'example.com', or wildcards, such as
+# '*.example.com'. A wildcard matches every name below the domain (e.g.
+# 'www.example.com' or 'a.b.example.com') but not the domain itself.
+#
+# Each pattern has any number of values attached to it. lookup() walks the
+# labels of a name from the right, so it costs O(labels in the name) no matter
+# how many patterns there are.
+
+
+class _trie_node(object):
+    __slots__ = ['children', 'exact', 'wildcard']
+
+    def __init__(self):
+        self.children = {}
+        self.exact = None
+        self.wildcard = None
+
+
+class domain_trie(object):
+    def __init__(self):
+        self.root = _trie_node()
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    @staticmethod
+    def _split(pattern):
+        # Returns (wildcard?, reversed list of labels)
+        pattern = pattern.rstrip('.').lower()
+        wildcard = pattern.startswith('*.')
+        if wildcard:
+            pattern = pattern[2:]
+        labels = pattern.split('.')
+        labels.reverse()
+        return (wildcard, labels)
+
+    def insert(self, pattern, value):
+        (wildcard, labels) = self._split(pattern)
+        node = self.root
+        for label in labels:
+            child = node.children.get(label)
+            if child is None:
+                child = _trie_node()
+                node.children[label] = child
+            node = child
+
+        if wildcard:
+            if node.wildcard is None:
+                node.wildcard = []
+            node.wildcard.append(value)
+        else:
+            if node.exact is None:
+                node.exact = []
+            node.exact.append(value)
+        self.count += 1
+
+    def remove(self, pattern, value):
+        ''' Removes one instance of value from pattern. Prunes empty nodes. '''
+        (wildcard, labels) = self._split(pattern)
+        path = []
+        node = self.root
+        for label in labels:
+            path.append((node, label))
+            node = node.children.get(label)
+            if node is None:
+                return
+
+        values = node.wildcard if wildcard else node.exact
+        if values is None or value not in values:
+            return
+        values.remove(value)
+        self.count -= 1
+        if len(values) == 0:
+            if wildcard:
+                node.wildcard = None
+            else:
+                node.exact = None
+
+        # Prune nodes that no longer lead anywhere.
+        while len(path) != 0:
+            if (node.exact is not None or node.wildcard is not None or
+                len(node.children) != 0):
+                break
+            (parent, label) = path.pop()
+            del parent.children[label]
+            node = parent
+
+    def lookup(self, name):
+        ''' Returns a list of values for every pattern that matches name. '''
+        labels = name.rstrip('.').lower().split('.')
+        found = []
+        node = self.root
+        for index in xrange(len(labels) - 1, -1, -1):
+            node = node.children.get(labels[index])
+            if node is None:
+                return found
+            # Wildcards only match if there are labels left below this node
+            if node.wildcard is not None and index != 0:
+                found.extend(node.wildcard)
+        if node.exact is not None:
+            found.extend(node.exact)
+        return found
@@ -0,0 +1,83 @@
+# Copyright 2015 Sean Donovan
+# Time-bucketed expiry index. Rather than a timer per item, items are placed
+# into buckets keyed on their expiry time, rounded up to the granularity (one
+# second by default). Whoever owns the index sweeps it periodically with
+# pop_expired().
+#
+# add(), move() and remove() are O(1) (plus O(log n) when a new bucket is
+# created), so refreshing an item's expiry costs no timer churn.
+
+import heapq
+
+
+class expiry_index(object):
+    def __init__(self, granularity=1.0):
+        self.granularity = granularity
+        self.buckets = {}       # bucket number -> set of keys
+        self.key_bucket = {}    # key -> bucket number
+        self.bucket_heap = []   # bucket numbers, may contain stale entries
+
+    def __len__(self):
+        return len(self.key_bucket)
+
+    def __contains__(self, key):
+        return key in self.key_bucket
+
+    def _bucket_for(self, expiry):
+        # Round up, so that everything in a bucket has expired once the bucket
+        # time has passed.
+        return int(expiry // self.granularity) + 1
+
+    def add(self, key, expiry):
+        ''' Adds key, or moves it if it's already in the index. '''
+        bucket = self._bucket_for(expiry)
+        old_bucket = self.key_bucket.get(key)
+        if old_bucket == bucket:
+            return
+        if old_bucket is not None:
+            self._discard(key, old_bucket)
+
+        self.key_bucket[key] = bucket
+        keys = self.buckets.get(bucket)
+        if keys is None:
+            keys = set()
+            self.buckets[bucket] = keys
+            heapq.heappush(self.bucket_heap, bucket)
+        keys.add(key)
+
+    move = add
+
+    def remove(self, key):
+        bucket = self.key_bucket.pop(key, None)
+        if bucket is not None:
+            self._discard(key, bucket)
+
+    def _discard(self, key, bucket):
+        keys = self.buckets[bucket]
+        keys.discard(key)
+        if len(keys) == 0:
+            # The heap entry goes stale and is skipped by pop_expired()
+            del self.buckets[bucket]
+
+    def next_expiry(self):
+        ''' Returns the time the earliest bucket expires, or None. '''
+        heap = self.bucket_heap
+        while len(heap) != 0 and heap[0] not in self.buckets:
+            heapq.heappop(heap)
+        if len(heap) == 0:
+            return None
+        return heap[0] * self.granularity
+
+    def pop_expired(self, now):
+        ''' Removes and returns a list of every key that expired by now. '''
+        expired = []
+        heap = self.bucket_heap
+        while len(heap) != 0 and heap[0] * self.granularity <= now:
+            bucket = heapq.heappop(heap)
+            keys = self.buckets.pop(bucket, None)
+            if keys is None:
+                continue
+            for key in keys:
+                del self.key_bucket[key]
+            expired.extend(keys)
+        return expired
@@ -0,0 +1,20 @@
+# Copyright 2015 Sean Donovan
+# Conversions between packed and text IP addresses.
+#
+# Packed addresses are the raw 4 (IPv4) or 16 (IPv6) bytes, in network byte
+# order, as they appear in A and AAAA records. The DNS cache is keyed on them,
+# and they're only converted to text at the edges: logging and building
+# OpenFlow matches.
+
+import socket
+
+
+def packed_to_text(packed):
+    if len(packed) == 4:
+        return socket.inet_ntoa(packed)
+    return socket.inet_ntop(socket.AF_INET6, packed)
+
+def text_to_packed(text):
+    if ':' in text:
+        return socket.inet_pton(socket.AF_INET6, text)
+    return socket.inet_pton(socket.AF_INET, text)
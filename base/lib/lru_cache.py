@@ -0,0 +1,81 @@
+# Copyright 2015 Sean Donovan
+# Bounded least-recently-used cache.
+#
+# A dictionary of links in a circular doubly linked list, kept in order of
+# use. get() and put() are O(1). Hits, misses and evictions are counted.
+
+
+_PREV = 0
+_NEXT = 1
+_KEY = 2
+_VALUE = 3
+
+
+class lru_cache(object):
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.clear()
+
+    def __len__(self):
+        return len(self.links)
+
+    def __contains__(self, key):
+        return key in self.links
+
+    def clear(self):
+        ''' Empties the cache. The counters are kept. '''
+        self.links = {}
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None]
+
+    def get(self, key, default=None):
+        link = self.links.get(key)
+        if link is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._move_to_front(link)
+        return link[_VALUE]
+
+    def put(self, key, value):
+        link = self.links.get(key)
+        if link is not None:
+            link[_VALUE] = value
+            self._move_to_front(link)
+            return
+
+        if len(self.links) >= self.maxsize:
+            # Evict the least recently used, at the back of the list.
+            oldest = self.root[_PREV]
+            oldest[_PREV][_NEXT] = self.root
+            self.root[_PREV] = oldest[_PREV]
+            del self.links[oldest[_KEY]]
+            self.evictions += 1
+
+        first = self.root[_NEXT]
+        link = [self.root, first, key, value]
+        first[_PREV] = link
+        self.root[_NEXT] = link
+        self.links[key] = link
+
+    def _move_to_front(self, link):
+        root = self.root
+        if root[_NEXT] is link:
+            return
+        link[_PREV][_NEXT] = link[_NEXT]
+        link[_NEXT][_PREV] = link[_PREV]
+        first = root[_NEXT]
+        link[_PREV] = root
+        link[_NEXT] = first
+        first[_PREV] = link
+        root[_NEXT] = link
+
+    def stats(self):
+        return {'size'      : len(self.links),
+                'maxsize'   : self.maxsize,
+                'hits'      : self.hits,
+                'misses'    : self.misses,
+                'evictions' : self.evictions}
@@ -0,0 +1,51 @@
+# Copyright 2015 Sean Donovan
+# Monotonic time base used by py_timer and the DNS cache.
+#
+# Times are float seconds from an arbitrary starting point that never jumps
+# when the wall clock is changed. Use datetime only at the edges (printing,
+# serializing), through to_datetime() and from_datetime().
+#
+# This should be used by using the following import statement:
+#     from base.lib.py_clock import monotonic
+
+from datetime import datetime, timedelta
+import time
+
+try:
+    # Python 3.3+
+    from time import monotonic
+except ImportError:
+    try:
+        import ctypes
+        import ctypes.util
+        import os
+
+        CLOCK_MONOTONIC = 1 # Linux, from <linux/time.h>
+
+        class _timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long),
+                        ('tv_nsec', ctypes.c_long)]
+
+        _librt = ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1',
+                             use_errno=True)
+        _clock_gettime = _librt.clock_gettime
+        _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+
+        def monotonic():
+            ts = _timespec()
+            if _clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)) != 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno))
+            return ts.tv_sec + ts.tv_nsec * 1e-9
+    except (OSError, AttributeError):
+        # No clock_gettime(). Fall back to the wall clock.
+        monotonic = time.time
+
+
+def to_datetime(mono):
+    ''' Converts a monotonic time to a wall clock datetime. '''
+    return datetime.now() + timedelta(seconds=(mono - monotonic()))
+
+def from_datetime(dt):
+    ''' Converts a wall clock datetime to a monotonic time. '''
+    return monotonic() + (dt - datetime.now()).total_seconds()
@@ -0,0 +1,335 @@
+# Copyright 2015 Sean Donovan
+# Executors used by py_timer_manager to run timer callbacks. Rather than
+# starting a new thread for every expired timer, callbacks are handed to an
+# executor:
+#   inline_executor      - Runs callbacks immediately in the timer thread. Only
+#                          for cheap callbacks.
+#   thread_pool_executor - A fixed number of worker threads draining a bounded
+#                          queue. When the queue is full, submit() blocks, which
+#                          applies backpressure to the timer thread. A callback
+#                          that submits from one of the workers (say, by
+#                          starting a timer) never blocks: with the queue full,
+#                          its function is run inline instead, as blocking every
+#                          worker would deadlock the pool.
+#   green_executor       - Same as the thread pool, but with green threads from
+#                          Ryu's hub, for use when callbacks run on Ryu's event
+#                          loop. Select it with py_timer.use_green_executor().
+#
+# Each executor also arms the single wakeup timer used by py_timer_manager via
+# call_later(), so the green executor never mixes OS threads with the hub. The
+# other executors run every call_later() on one scheduler thread, rather than
+# a threading.Timer thread per call.
+#
+# Threads are only started when they're first needed, so an executor that's
+# replaced at startup by py_timer_manager.set_executor() costs nothing.
+# set_executor() calls shutdown() on the executor it replaces: work that's
+# already queued or scheduled still runs, then its threads exit.
+#
+# All executors keep metrics on queue depth and callback latency, available
+# through stats().
+
+import logging
+import heapq
+import time
+from threading import Thread, Lock, Condition, current_thread
+from Queue import Queue, Full
+
+from py_clock import monotonic
+
+# Queued in place of a callback to stop a worker.
+_STOP = None
+
+
+class _executor_base(object):
+    def __init__(self):
+        self.logger = logging.getLogger("netassay." + self.__class__.__name__)
+        self.stats_lock = Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.errors = 0
+        self.max_queue_depth = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.inline_runs = 0
+
+    def submit(self, function, *args, **kwargs):
+        raise NotImplementedError
+
+    def call_later(self, delay, function):
+        ''' Returns an object with a cancel() method. '''
+        raise NotImplementedError
+
+    def shutdown(self):
+        ''' Lets queued and scheduled work finish, then stops the threads. '''
+        pass
+
+    def queue_depth(self):
+        return 0
+
+    def stats(self):
+        with self.stats_lock:
+            if self.completed != 0:
+                latency_avg = self.latency_total / self.completed
+            else:
+                latency_avg = 0.0
+            return {'submitted'       : self.submitted,
+                    'completed'       : self.completed,
+                    'errors'          : self.errors,
+                    'queue_depth'     : self.queue_depth(),
+                    'max_queue_depth' : self.max_queue_depth,
+                    'latency_avg'     : latency_avg,
+                    'latency_max'     : self.latency_max,
+                    'inline_runs'     : self.inline_runs}
+
+    def _note_submitted(self):
+        with self.stats_lock:
+            self.submitted += 1
+            depth = self.queue_depth()
+            if depth > self.max_queue_depth:
+                self.max_queue_depth = depth
+
+    def _run(self, submit_time, function, args, kwargs):
+        try:
+            function(*args, **kwargs)
+        except Exception:
+            with self.stats_lock:
+                self.errors += 1
+            self.logger.exception("Timer callback " + str(function) +
+                                  " raised an exception")
+        latency = time.time() - submit_time
+        with self.stats_lock:
+            self.completed += 1
+            self.latency_total += latency
+            if latency > self.latency_max:
+                self.latency_max = latency
+
+    def _run_inline(self, function, args, kwargs):
+        # For a worker that submits with the queue full, or a submit after
+        # shutdown().
+        with self.stats_lock:
+            self.submitted += 1
+            self.inline_runs += 1
+        self._run(time.time(), function, args, kwargs)
+
+
+class _call_later_handle(object):
+    def __init__(self, scheduler, entry):
+        self.scheduler = scheduler
+        self.entry = entry
+
+    def cancel(self):
+        self.scheduler.cancel(self.entry)
+
+
+class _scheduler(object):
+    '''
+    Runs functions after a delay, all on a single daemon thread that's started
+    with the first call_later(). Cancelled calls are left in the heap until
+    they reach the top, or until they're the majority.
+    '''
+    def __init__(self, logger):
+        self.logger = logger
+        self.heap = []           # [due, sequence, function]
+        self.live = 0
+        self.sequence = 0
+        self.condition = Condition(Lock())
+        self.thread = None
+        self.stopped = False
+
+    def call_later(self, delay, function):
+        with self.condition:
+            entry = [monotonic() + delay, self.sequence, function]
+            self.sequence += 1
+            heapq.heappush(self.heap, entry)
+            self.live += 1
+            if self.thread is None:
+                self.thread = Thread(target=self._run)
+                # If the main program dies, this will die too.
+                self.thread.daemon = True
+                self.thread.start()
+            elif self.heap[0] is entry:
+                # Sooner than what the thread is waiting for.
+                self.condition.notify()
+        return _call_later_handle(self, entry)
+
+    def cancel(self, entry):
+        with self.condition:
+            if entry[2] is None:
+                return
+            entry[2] = None
+            self.live -= 1
+            if len(self.heap) > 2 * self.live + 64:
+                self.heap = [e for e in self.heap if e[2] is not None]
+                heapq.heapify(self.heap)
+
+    def stop(self):
+        # Calls that are already scheduled still run, then the thread exits.
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while True:
+                    heap = self.heap
+                    while len(heap) != 0 and heap[0][2] is None:
+                        heapq.heappop(heap)
+                    if len(heap) == 0:
+                        if self.stopped:
+                            self.thread = None
+                            return
+                        self.condition.wait()
+                        continue
+                    delay = heap[0][0] - monotonic()
+                    if delay <= 0:
+                        break
+                    self.condition.wait(delay)
+                entry = heapq.heappop(heap)
+                function = entry[2]
+                entry[2] = None
+                self.live -= 1
+            # Outside of the lock, as the function may schedule another call.
+            try:
+                function()
+            except Exception:
+                self.logger.exception("Scheduled call " + str(function) +
+                                      " raised an exception")
+
+
+class inline_executor(_executor_base):
+    def __init__(self):
+        super(inline_executor, self).__init__()
+        self.scheduler = _scheduler(self.logger)
+
+    def submit(self, function, *args, **kwargs):
+        self._note_submitted()
+        self._run(time.time(), function, args, kwargs)
+
+    def call_later(self, delay, function):
+        return self.scheduler.call_later(delay, function)
+
+    def shutdown(self):
+        self.scheduler.stop()
+
+
+class thread_pool_executor(inline_executor):
+    def __init__(self, workers=4, max_queue=10000):
+        super(thread_pool_executor, self).__init__()
+        self.queue = Queue(max_queue)
+        self.worker_count = workers
+        self.workers = None
+        self.worker_set = frozenset()
+        self.start_lock = Lock()
+
+    def _start_workers(self):
+        with self.start_lock:
+            if self.workers is not None:
+                return
+            workers = []
+            for x in range(self.worker_count):
+                worker = Thread(target=self._worker)
+                worker.daemon = True
+                worker.start()
+                workers.append(worker)
+            self.worker_set = frozenset(workers)
+            self.workers = workers
+
+    def submit(self, function, *args, **kwargs):
+        # Blocks when the queue is full, unless called from a worker.
+        if self.workers is None:
+            self._start_workers()
+        if len(self.workers) == 0:
+            # Shut down, but a late callback still needs to run.
+            self._run_inline(function, args, kwargs)
+            return
+        if current_thread() in self.worker_set:
+            try:
+                self.queue.put_nowait((time.time(), function, args, kwargs))
+            except Full:
+                self._run_inline(function, args, kwargs)
+                return
+        else:
+            self.queue.put((time.time(), function, args, kwargs))
+        self._note_submitted()
+
+    def shutdown(self):
+        # Each worker exits when it gets to a _STOP, after the work queued
+        # ahead of it.
+        super(thread_pool_executor, self).shutdown()
+        with self.start_lock:
+            workers = self.workers
+            self.workers = []
+        for worker in workers or []:
+            self.queue.put(_STOP)
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+            (submit_time, function, args, kwargs) = item
+            self._run(submit_time, function, args, kwargs)
+
+
+class green_executor(_executor_base):
+    def __init__(self, workers=4, max_queue=10000):
+        super(green_executor, self).__init__()
+        # Only needed in this mode, so Ryu isn't required to use py_timer.
+        from ryu.lib import hub
+        import greenlet
+        self.hub = hub
+        self.getcurrent = greenlet.getcurrent
+        self.queue = hub.Queue(max_queue)
+        self.worker_count = workers
+        self.workers = None
+        self.worker_set = frozenset()
+
+    def _start_workers(self):
+        # Green threads only switch when they block, so there's no need for
+        # a lock here.
+        workers = []
+        for x in range(self.worker_count):
+            workers.append(self.hub.spawn(self._worker))
+        self.worker_set = frozenset(workers)
+        self.workers = workers
+
+    def submit(self, function, *args, **kwargs):
+        # Blocks the calling green thread when the queue is full, unless it's
+        # a worker.
+        if self.workers is None:
+            self._start_workers()
+        if len(self.workers) == 0:
+            self._run_inline(function, args, kwargs)
+            return
+        if self.getcurrent() in self.worker_set:
+            if self.queue.qsize() >= self.queue.maxsize:
+                self._run_inline(function, args, kwargs)
+                return
+            self.queue.put_nowait((time.time(), function, args, kwargs))
+        else:
+            self.queue.put((time.time(), function, args, kwargs))
+        self._note_submitted()
+
+    def call_later(self, delay, function):
+        return self.hub.spawn_after(delay, function)
+
+    def shutdown(self):
+        workers = self.workers
+        self.workers = []
+        for worker in workers or []:
+            self.queue.put(_STOP)
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+            (submit_time, function, args, kwargs) = item
+            self._run(submit_time, function, args, kwargs)
@@ -1,9 +1,29 @@
 # Copyright 2014 Sean Donovan
-# List-based timer that only has one timer active at a time. When a new timer 
-# request comes in, the timer will insert into the list at the appropriate 
-# location. If it's to pop soonest, it will stop the current timer, and start a
-# timer for the newest time. This has only one timer outstanding at a time, 
+# Heap-based timer that only has one timer active at a time. When a new timer
+# request comes in, the timer is pushed onto a binary heap keyed on its
+# expiration. If it's to pop soonest, it will stop the current timer, and start
+# a timer for the newest time. This has only one timer outstanding at a time,
 # rather than starting a timer for each one.
+#
+# Cancellation is lazy: a cancelled timer leaves a tombstone in the heap that
+# is discarded when it reaches the top, or when tombstones outnumber live
+# timers and the heap is compacted. Start, cancel and is_alive are O(log n) or
+# better.
+#
+# Expired timers are handed to an executor (see py_executor.py) rather than
+# each getting a thread of its own. The executor can be swapped with
+# py_timer_manager.set_executor(). Applications running under Ryu should call
+# use_green_executor() at startup, before any timers are started, so that
+# timers and their callbacks run on Ryu's hub rather than on OS threads.
+#
+# Expiry is batched: every timer that's due within the slack window (50ms by
+# default, see py_timer_manager.set_slack()) is popped in a single wakeup and
+# handed to the executor as one batch. By default the batch runs each timer's
+# function in turn; py_timer_manager.set_bulk_callback() replaces that with a
+# function that receives the whole list of expired timers.
+#
+# Expirations are float seconds on the monotonic clock (see py_clock.py), so
+# wall clock jumps don't fire or stall timers.
 # 
 # This should be used by using the following import statement:
 #     from py_timer import py_timer as Timer
@@ -12,10 +32,16 @@
 # From https://github.com/sdonovan1985/py-timer/
 
 import logging
-from datetime import datetime, timedelta
-from threading import Timer, Lock, Thread
+import heapq
+from threading import RLock
 import pprint
 
+from py_executor import thread_pool_executor, green_executor
+from py_clock import monotonic
+
+# Timers due within this many milliseconds of each other fire together.
+DEFAULT_SLACK_MS = 50
+
 class py_timer_manager:
     INSTANCE = None
     
@@ -23,10 +49,18 @@ class py_timer_manager:
         if self.INSTANCE is not None:
             raise ValueError("Instance already exists!")
 
-        self.list_of_inactive_timers = []
-        self.list_of_active_timers = []
+        # Heap of [expiration, sequence, timer]. The sequence number breaks
+        # ties so that timers themselves are never compared. A cancelled
+        # timer's heap entry has its timer slot set to None (a tombstone).
+        self.active_heap = []
+        self.active_count = 0
+        self.sequence = 0
         self.thread_timer = None
-        self.timerlist_lock = Lock()
+        self.timerlist_lock = RLock()
+        self.executor = thread_pool_executor()
+        self.slack = DEFAULT_SLACK_MS / 1000.0
+        self.bulk_callback = self._call_batch
+        self.batches = 0
 
     @classmethod
     def get_instance(cls):
@@ -34,93 +68,144 @@ class py_timer_manager:
             cls.INSTANCE = py_timer_manager()
         return cls.INSTANCE
     
+    def set_executor(self, executor):
+        ''' Changes how expired timer callbacks are run. See py_executor.py '''
+        with self.timerlist_lock:
+            old = self.executor
+            self.executor = executor
+            rearm = self.thread_timer is not None
+        # A wakeup armed on the old executor is moved to the new one.
+        if rearm:
+            self._restart_timer()
+        old.shutdown()
+
+    def set_slack(self, seconds):
+        ''' Timers due within 'seconds' of a wakeup are expired with it. '''
+        with self.timerlist_lock:
+            self.slack = seconds
+
+    def set_bulk_callback(self, function):
+        '''
+        function(timers) is called, through the executor, with the list of
+        timers that expired in a single wakeup. Pass None to return to the
+        default of calling each timer's function in turn.
+        '''
+        with self.timerlist_lock:
+            if function is None:
+                function = self._call_batch
+            self.bulk_callback = function
+
+    def get_stats(self):
+        stats = self.executor.stats()
+        stats['batches'] = self.batches
+        return stats
+
     def insert_into_list(self, timer):
-        # New inactive timer
-        self.list_of_inactive_timers.append(timer)
+        # New inactive timer. Inactive timers aren't tracked, they simply have
+        # no heap entry.
+        timer.heap_entry = None
 
     def start_timer(self, timer):
-        # Move a timer from the inactive list
-        first = False
+        with self.timerlist_lock:
+            # Restarting a running timer reschedules it.
+            if timer.heap_entry is not None:
+                self._tombstone(timer)
         
-        self.list_of_inactive_timers.remove(timer)
-        timer.calculate_expiration()
+            timer.calculate_expiration()
+            entry = [timer.expiration, self.sequence, timer]
+            self.sequence += 1
+            timer.heap_entry = entry
+            heapq.heappush(self.active_heap, entry)
+            self.active_count += 1
         
-        # Insert based on time to expire. O(n) time.
-        if len(self.list_of_active_timers) == 0:
-            self.list_of_active_timers.insert(0, timer)
-            first = True
-        else:
-            inserted = False
-            for x in range(len(self.list_of_active_timers)):
-                if self.list_of_active_timers[x].expiration > timer.expiration:
-                    self.list_of_active_timers.insert(x, timer)
-                    inserted = True
-                    if x == 0:
-                        first = True
-                    break
-            if inserted == False:
-                self.list_of_active_timers.append(timer)
+            first = self.active_heap[0] is entry
         
-        # If the timer is the next to expire, stop the running timer
+        # If the timer is the next to expire, restart the running timer. This
+        # is outside of the lock, as _restart_timer() may block on the
+        # executor.
         if first == True:
-            if self.thread_timer is not None:
-                self.thread_timer.cancel()
-        
-            # Call _restart_timer()
             self._restart_timer()
 
     def is_timer_alive(self, timer):
-        return (timer in self.list_of_active_timers)
+        return timer.heap_entry is not None
 
     def remove_from_list(self, timer):
         with self.timerlist_lock:
-            if timer in self.list_of_inactive_timers:
-                self.list_of_inactive_timers.remove(timer)
-            elif timer in self.list_of_active_timers:
-                # If it's the first in the list_of_active_timers, need to do extra
-                if self.list_of_active_timers[0] == timer:
-                    self.thread_timer.cancel()
-                    self.list_of_active_timers.remove(timer)
-                    self._restart_timer()
-                else:
-                    self.list_of_active_timers.remove(timer)
+            if timer.heap_entry is not None:
+                self._tombstone(timer)
+                self._compact()
+            # There's no need to restart the thread timer if this was the
+            # soonest timer: when it fires, _restart_timer() discards the
+            # tombstone and rearms for the next live timer.
         # else: trying to cancel an already cancelled timer shouldn't blow up.
 
+    def _tombstone(self, timer):
+        timer.heap_entry[2] = None
+        timer.heap_entry = None
+        self.active_count -= 1
+
+    def _compact(self):
+        # Rebuild the heap once tombstones are the majority, keeping memory
+        # bounded when most timers are cancelled before they fire.
+        if len(self.active_heap) > 2 * self.active_count + 64:
+            self.active_heap = [e for e in self.active_heap if e[2] is not None]
+            heapq.heapify(self.active_heap)
+
     def _restart_timer(self):
         ''' 
         This is what happens when things expire, the timer needs to be stopped
-        due to removal of entries, or insertion of new entries at the beginning
-        of the list_of_active_timers, etc. Pretty much the go-to function.
+        due to removal of entries, or insertion of new entries at the top of
+        the active_heap, etc. Pretty much the go-to function.
         '''
+        expired = []
         with self.timerlist_lock:
             if self.thread_timer is not None:
                 self.thread_timer.cancel()
+                self.thread_timer = None
 
-            # Call back anything that's expired
-            now = datetime.now()
-            entries_to_remove = []
+            # Collect anything that's expired or due within the slack window,
+            # dropping tombstones as they reach the top of the heap.
+            now = monotonic()
+            due = now + self.slack
+            heap = self.active_heap
 
-            for entry in self.list_of_active_timers:
-                if entry.expiration <= now:
-                    entries_to_remove.append(entry)
+            while len(heap) != 0 and heap[0][0] <= due:
+                entry = heapq.heappop(heap)
+                timer = entry[2]
+                if timer is not None:
+                    timer.heap_entry = None
+                    self.active_count -= 1
+                    expired.append(timer)
 
-                    entry.call_function()
+            while len(heap) != 0 and heap[0][2] is None:
+                heapq.heappop(heap)
 
-            for entry in entries_to_remove:
-                    self.list_of_active_timers.remove(entry)
+            # Start the first timer that's not expired. The executor's timers
+            # are daemons: if the main program dies, this will die too. That
+            # prevents the case where a 3 day long timer for a long lived DNS
+            # entry keeps the program running for ages.
+            if len(heap) != 0:
+                self.thread_timer = self.executor.call_later(
+                    heap[0][0] - now, self._finish_timer)
 
-        
-            # Start the first timer that's not expired
-            if len(self.list_of_active_timers) != 0:
-                delta = self.list_of_active_timers[0].expiration - now
-
-                self.thread_timer = Timer(delta.total_seconds(), 
-                                          self._finish_timer)
-                # Set the daemon flag: If the main program dies, this will die too
-                # prevents the case where a 3 day long timer for a long lived DNS
-                # entry keeps the program running for ages.
-                self.thread_timer.daemon = True
-                self.thread_timer.start()
+            bulk_callback = self.bulk_callback
+            if len(expired) != 0:
+                self.batches += 1
+
+        # Call back outside of the lock: a full executor queue blocks here,
+        # and callbacks are free to start new timers.
+        if len(expired) != 0:
+            self.executor.submit(bulk_callback, expired)
+
+    def _call_batch(self, timers):
+        ''' Default bulk callback: call each expired timer's function. '''
+        for timer in timers:
+            try:
+                timer.call_function_orig()
+            except Exception:
+                logging.getLogger("netassay.py_timer").exception(
+                    "Timer callback " + str(timer.function) +
+                    " raised an exception")
 
     def _finish_timer(self):
         ''' 
@@ -129,6 +214,12 @@ class py_timer_manager:
         self._restart_timer()
 
 
+def use_green_executor(workers=4, max_queue=10000):
+    ''' Runs timer callbacks, and arms wakeups, on Ryu's hub. '''
+    py_timer_manager.get_instance().set_executor(
+        green_executor(workers, max_queue))
+
+
 class py_timer:
     def __init__(self, interval, function, args=[], kwargs={}):
         ''' 
@@ -143,13 +234,14 @@ class py_timer:
         self.kwargs = kwargs
 
         self.expiration = None
+        self.heap_entry = None
 
-        # Get the instance of the py_timer_manager, insert into list
+        # Get the instance of the py_timer_manager, register as inactive
         self.manager = py_timer_manager.get_instance()
         self.manager.insert_into_list(self)
 
     def calculate_expiration(self):
-        self.expiration = datetime.now() + timedelta(seconds=self.interval)
+        self.expiration = monotonic() + self.interval
 
     def start(self):
         self.manager.start_timer(self)
@@ -158,24 +250,11 @@ class py_timer:
         self.manager.remove_from_list(self)
     
     def is_alive(self):
-        self.manager.is_timer_alive(self)
+        return self.manager.is_timer_alive(self)
 
     def call_function(self):
-        cb_thread = None
-
-        if ((len(self.args) == 0) and len(self.kwargs) == 0):
-            cb_thread = Thread(target=self.function)
-        elif ((len(self.args) != 0) and len(self.kwargs) == 0):
-            cb_thread = Thread(target=self.function, 
-                               args=self.args)
-        elif ((len(self.args) == 0) and len(self.kwargs) != 0):
-            cb_thread = Thread(target=self.function, 
-                               kwargs=self.kwargs)
-        else:
-            cb_thread = Thread(target=self.function, 
-                               args=self.args,
-                               kwargs=self.kwargs)
-        cb_thread.start()
+        ''' Hands the expiration function to the manager's executor. '''
+        self.manager.executor.submit(self.function, *self.args, **self.kwargs)
 
     def call_function_orig(self):
         ''' Calls the expiration function. Lots of splatting. '''
@@ -7,6 +7,35 @@
 # Definition of match_tracking. 
 # Object is only used by NetAssayMatchAction and by the MCM. It is, in effect,
 # a structure holding all of the properties.
+#
+# Definition of match_key.
+# The key that trackers and VMACs are looked up by. It's built from the match
+# kwargs, sorted, so it doesn't depend on dict ordering, and its hash is worked
+# out once up front.
+
+
+class match_key(object):
+    __slots__ = ['items', 'hashval']
+
+    def __init__(self, kwargs):
+        self.items = tuple(sorted(kwargs.iteritems()))
+        self.hashval = hash(self.items)
+
+    def __hash__(self):
+        return self.hashval
+
+    def __eq__(self, other):
+        return (isinstance(other, match_key) and
+                self.hashval == other.hashval and self.items == other.items)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def as_dict(self):
+        return dict(self.items)
+
+    def __repr__(self):
+        return str(self.as_dict())
 
 
 class match_tracking(object):
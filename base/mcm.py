@@ -6,16 +6,35 @@
 
 
 import logging
+from threading import Lock
 
 from RegisteredMatchActions import *
 from match_tracking import *
 from singleton import Singleton
+from flowmod_batcher import FlowModBatcher
+from flow_shadow import FlowShadow
+from base.lib.py_timer import use_green_executor
 from netaddr import EUI
 
 from ryu.lib import mac as mac_lib
 from ryu.ofproto import ofproto_v1_3
 
 DEFAULT_TABLE = 2
+SNOOP_PRIORITY = 65535
+
+# Cookies of the rules a NAMA learns from its ME carry the NAMA's id in the
+# high 32 bits and the rule's sequence number in the low 32 bits. All of a
+# NAMA's rules can then be deleted at once, see remove_all_matches(). A
+# NAMA's rule in the MCM's table has the top bit set instead, above any NAMA
+# id, and a cookie from get_cookie() in the low bits. So every cookie with
+# something in the high 32 bits belongs to a NAMA, and can be reconciled.
+# The MEs' snoop rules have 0 in the high bits.
+NAMA_ID_SHIFT = 32
+RULE_SEQ_MASK = (1 << NAMA_ID_SHIFT) - 1
+MCM_TABLE_COOKIE_BIT = 1 << 63
+MAX_NAMA_ID = (MCM_TABLE_COOKIE_BIT >> NAMA_ID_SHIFT) - 1
+NAMA_COOKIE_MASK = 0xffffffffffffffff ^ RULE_SEQ_MASK
+EXACT_COOKIE_MASK = 0xffffffffffffffff
 
 # All MEs need to be called in here.
 from me.dns.dnsme import *
@@ -29,15 +48,34 @@ class MainControlModuleException(Exception):
 
 # Defines the Main Control Module. Users of NetAssay have to initialize the MCM
 # *before* trying to use any of the NetAssayMatchActions.
+#
+# MEs that learn from traffic, such as the DNS ME, need it copied to the
+# controller. To turn this on, give the MCM a snoop_table for those rules and
+# the snoop_next_table that traffic goes on to, where the application's own
+# forwarding rules are. Then call register_datapath() for each switch as it
+# connects, and pass every EventOFPPacketIn to packet_in_handler().
+#
+# NAMAs' flow-mods are batched per datapath, see flowmod_batcher.py. Pass every
+# EventOFPBarrierReply to barrier_reply_handler() to track batch latency.
+#
+# The rules NAMAs have asked for are shadowed per datapath, see
+# flow_shadow.py. When a switch reconnects, its flow table is pulled and only
+# the difference is sent. Pass every EventOFPFlowStatsReply to
+# flow_stats_reply_handler() for this.
+#
+# NAMAs with the same match, typically one per switch, share a single rule
+# with the ME, see NetAssaySharedRule below.
 class NetAssayMCM(object):
     __metaclass__ = Singleton
         
-    def __init__(self, table=DEFAULT_TABLE):
+    def __init__(self, table=DEFAULT_TABLE, snoop_table=None,
+                 snoop_next_table=None, green=False):
 
         self.setup_logger()
         self.logger.info("NetAssayMCM.__init__(): called")
 
         self.cookie = 1
+        self.nama_id = 1
         self.registrar = RegisteredMatchActions()
         self.match_actions = []
         self.vmac_table = {}
@@ -45,12 +83,32 @@ class NetAssayMCM(object):
 
         # Setup table
         self.table = table
+        self.snoop_table = snoop_table
+        self.snoop_next_table = snoop_next_table
+        if snoop_table is not None and snoop_next_table is None:
+            raise MainControlModuleException(
+                "snoop_table needs a snoop_next_table")
+        self.datapaths = {}            # dpid -> datapath
+        self.batchers = {}             # dpid -> FlowModBatcher
+        self.shadows = {}              # dpid -> FlowShadow
+        self.shared_rules = {}         # (match type, value) -> shared rule
+        self.shared_lock = Lock()
+        self.flow_stats = {}           # dpid -> (request xid, flow stats)
         #TODO: anything else?
         
-        # Get the MEs
+        # Get the MEs, each with a cookie for its forwarding rules
         self.MEs = []
+        self.snoop_cookies = {}
         for me in METADATA_ENGINES:
             self.MEs.append(me)
+            self.snoop_cookies[me] = self.get_cookie()
+
+        # Under Ryu, timers, flow-mod batch windows and the MEs' workers
+        # should run on Ryu's hub rather than on OS threads.
+        if green:
+            use_green_executor()
+            for me in self.MEs:
+                me.set_green(True)
 
         # Finish
         self.logger.info("NetAssayMCM Initialized!")
@@ -76,6 +134,14 @@ class NetAssayMCM(object):
         self.logger.debug("NetAssayMCM.get_cookie(): %d" % retcookie)
         return retcookie
 
+    # Each NAMA has an id for the high bits of its rules' cookies.
+    def get_nama_id(self):
+        if self.nama_id > MAX_NAMA_ID:
+            raise MainControlModuleException("Out of NAMA ids")
+        retid = self.nama_id
+        self.nama_id += 1
+        return retid
+
     # This allows for consisten VMACs based on the hashval passed in. The
     # hashval is the string that's being checked. For instance:
     #    "domain='example.com'" 
@@ -86,8 +152,10 @@ class NetAssayMCM(object):
     #else, such as 
     #    NAMA(domain='example.com') AND match(srcip=1.2.3.4) >> fwd(3)
     #I think just the match is fine as the hash because of this.
+    #
+    # The hashval is now a pair of match_keys, for the match and postmatch.
     def get_vmac(self, hashval):
-        if hashval in self.vmac_table.keys():
+        if hashval in self.vmac_table:
             return self.vmac_table[hashval]
 #SPD        self.current_vmac = EUI(int(self.current_vmac) + 1)
         self.current_vmac = self.current_vmac + 1
@@ -101,6 +169,234 @@ class NetAssayMCM(object):
     def register_NAMA(self, nama):
         self.match_actions.append(nama)
 
+    def unregister_NAMA(self, nama):
+        if nama in self.match_actions:
+            self.match_actions.remove(nama)
+
+    def subscribe(self, nama):
+        # Hooks a NAMA up to the shared rule for its match, creating the rule
+        # with the ME if this is the first NAMA with that match.
+        match_type = nama.match.keys()[0]
+        key = (match_type, nama.match[match_type])
+        with self.shared_lock:
+            shared = self.shared_rules.get(key)
+            if shared is not None:
+                shared.subscribe(nama)
+                return shared
+
+        # Creating the ME's rule can block, on the DNS ME's active lookup,
+        # so it's done without the lock. If another NAMA with the same match
+        # got there first, its rule is used and this one is removed.
+        me = RegisteredMatchActions().lookup(match_type)
+        created = NetAssaySharedRule(me, key[1])
+        with self.shared_lock:
+            shared = self.shared_rules.get(key)
+            if shared is None:
+                shared = created
+                self.shared_rules[key] = shared
+            shared.subscribe(nama)
+        if shared is not created:
+            created.stop()
+        return shared
+
+    def unsubscribe(self, nama):
+        # Unhooks a NAMA. The last NAMA for a match removes the ME's rule.
+        match_type = nama.match.keys()[0]
+        key = (match_type, nama.match[match_type])
+        with self.shared_lock:
+            shared = self.shared_rules.get(key)
+            if shared is None:
+                return
+            if shared.unsubscribe(nama):
+                del self.shared_rules[key]
+
+    def register_datapath(self, datapath):
+        # Installs the MEs' forwarding rules the first time a datapath is
+        # seen, or when it reconnects as a new datapath. NAMAs call this too.
+        old = self.datapaths.get(datapath.id)
+        if old is datapath:
+            return
+        self.datapaths[datapath.id] = datapath
+        if old is None:
+            shadow = FlowShadow()
+            self.shadows[datapath.id] = shadow
+            self.batchers[datapath.id] = FlowModBatcher(datapath, shadow)
+        else:
+            self.reconnect_datapath(datapath)
+        if self.snoop_table is None:
+            return
+
+        self.logger.info("NetAssayMCM.register_datapath(): switch " + str(datapath.id))
+        for me in self.MEs:
+            me.install_forwarding_rules(datapath, self.snoop_table,
+                                        SNOOP_PRIORITY, self.snoop_next_table,
+                                        self.snoop_cookies[me])
+
+        # Everything else goes straight on to the next table.
+        parser = datapath.ofproto_parser
+        inst = [parser.OFPInstructionGotoTable(self.snoop_next_table)]
+        mod = parser.OFPFlowMod(datapath=datapath, table_id=self.snoop_table,
+                                priority=0, match=parser.OFPMatch(),
+                                instructions=inst)
+        datapath.send_msg(mod)
+
+    def reconnect_datapath(self, datapath):
+        # Moves everything over to the new connection, then asks for the
+        # switch's flow table so it can be reconciled with the shadow.
+        self.logger.info("NetAssayMCM.reconnect_datapath(): switch " + str(datapath.id))
+        self.batchers[datapath.id].rebind(datapath)
+        for nama in self.match_actions:
+            if nama.datapath.id == datapath.id:
+                nama.datapath = datapath
+
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        req = parser.OFPFlowStatsRequest(datapath, 0, ofproto.OFPTT_ALL,
+                                         ofproto.OFPP_ANY, ofproto.OFPG_ANY,
+                                         0, 0, parser.OFPMatch())
+        datapath.set_xid(req)
+        self.flow_stats[datapath.id] = (req.xid, [])
+        datapath.send_msg(req)
+
+    def flow_stats_reply_handler(self, ev):
+        # Collects the replies to reconnect_datapath()'s request, then sends
+        # the switch the difference from the shadow. Returns True if the reply
+        # was for that request.
+        msg = ev.msg
+        datapath = msg.datapath
+        pending = self.flow_stats.get(datapath.id)
+        if pending is None or pending[0] != msg.xid:
+            return False
+        pending[1].extend(msg.body)
+        if msg.flags & datapath.ofproto.OFPMPF_REPLY_MORE:
+            return True
+        del self.flow_stats[datapath.id]
+
+        # Anything with a NAMA id or the MCM table bit is ours, even if it's
+        # no longer shadowed.
+        (deletes, adds) = self.batchers[datapath.id].reconcile(
+            pending[1], lambda c: c >> NAMA_ID_SHIFT != 0,
+            lambda shadow, deletes, adds:
+                self.reconcile_mods(datapath, shadow, deletes, adds))
+        self.logger.info("NetAssayMCM.flow_stats_reply_handler(): switch " +
+                         str(datapath.id) + " has " + str(len(pending[1])) +
+                         " rules, sent " + str(deletes) +
+                         " deletes and " + str(adds) + " adds")
+        return True
+
+    def reconcile_mods(self, datapath, shadow, deletes, adds):
+        # Builds the flow-mods for a diff from the shadow. Called by the
+        # batcher with its lock held, so the shadow can't change under it.
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        mods = []
+        for cookie in deletes:
+            mods.append(parser.OFPFlowMod(datapath=datapath, cookie=cookie,
+                                          cookie_mask=EXACT_COOKIE_MASK,
+                                          table_id=ofproto.OFPTT_ALL,
+                                          command=ofproto.OFPFC_DELETE,
+                                          out_group=ofproto.OFPG_ANY,
+                                          out_port=ofproto.OFPP_ANY,
+                                          match=parser.OFPMatch()))
+        for cookie in adds:
+            (table_id, priority, match, inst) = shadow.entries[cookie]
+            mods.append(parser.OFPFlowMod(datapath=datapath, cookie=cookie,
+                                          table_id=table_id, priority=priority,
+                                          match=match, instructions=inst))
+        return mods
+
+    def get_batcher(self, datapath):
+        return self.batchers[datapath.id]
+
+    def barrier_reply_handler(self, ev):
+        # Hands an EventOFPBarrierReply to the datapath's batcher. Returns
+        # True if the barrier was sent by it.
+        msg = ev.msg
+        batcher = self.batchers.get(msg.datapath.id)
+        if batcher is None or batcher.datapath is not msg.datapath:
+            return False
+        return batcher.barrier_reply(msg)
+
+    def packet_in_handler(self, ev):
+        # Hands an EventOFPPacketIn to the MEs. Returns True if one of them
+        # took it.
+        msg = ev.msg
+        for me in self.MEs:
+            if me.handle_packet_in(msg):
+                return True
+        return False
+
+
+
+
+
+
+# Definition of the NetAssaySharedRule.
+# One ME rule, for a single match value, shared by every NAMA with that match.
+# The ME's add and remove callbacks are reference counted here, and only the
+# first add and the last remove of a match are passed on to the NAMAs. A NAMA
+# that subscribes late is given every match that's currently added.
+class NetAssaySharedRule(object):
+
+    def __init__(self, me, value):
+        self.lock = Lock()
+        self.subscribers = []
+        self.active = {}           # match key -> [match kwargs, count]
+        self.me = me
+        self.value = value
+        # The ME may seed matches from what it already knows, before there's
+        # anyone to pass them to. They're kept in self.active.
+        self.me_rule = me.new_rule(value, self.add_rule, self.remove_rule)
+
+    def subscribe(self, nama):
+        with self.lock:
+            self.subscribers.append(nama)
+            for (kwargs, count) in self.active.values():
+                nama.add_rule(**kwargs)
+
+    def unsubscribe(self, nama):
+        # Returns True if this was the last subscriber, and the ME's rule has
+        # been removed.
+        with self.lock:
+            if nama in self.subscribers:
+                self.subscribers.remove(nama)
+            if len(self.subscribers) != 0:
+                return False
+        self.stop()
+        return True
+
+    def stop(self):
+        # The ME can call add_rule() and remove_rule() until its rule is
+        # removed, so the matches are only forgotten after that.
+        self.me.remove_rule(self.me_rule)
+        with self.lock:
+            self.active = {}
+
+    def add_rule(self, **kwargs):
+        key = match_key(kwargs)
+        with self.lock:
+            entry = self.active.get(key)
+            if entry is not None:
+                entry[1] += 1
+                return
+            self.active[key] = [kwargs, 1]
+            for nama in self.subscribers:
+                nama.add_rule(**kwargs)
+
+    def remove_rule(self, **kwargs):
+        key = match_key(kwargs)
+        with self.lock:
+            entry = self.active.get(key)
+            if entry is None:
+                raise MainControlModuleException(
+                    "Trying to remove one that doesn't exists:\n    " +
+                    str(kwargs))
+            if entry[1] > 1:
+                entry[1] -= 1
+                return
+            del self.active[key]
+            for nama in self.subscribers:
+                nama.remove_rule(**kwargs)
 
 
 
@@ -112,7 +408,8 @@ class NetAssayMCM(object):
 class NetAssayMatchAction(object):
     
     # match is a one entry dictionary - needs to be for now - may be fancier in
-    #    the future
+    #    the future. For example {'domain':'example.com'}, or with a wildcard,
+    #    {'domain':'*.example.com'} for every name below example.com.
     # action are a list of actions that would typically be used in Ryu
     # priority is optional parameter, much like Ryu
     # postmatch is a secondary match action(s), also in a dictionary
@@ -124,6 +421,7 @@ class NetAssayMatchAction(object):
     #    OR is simpler: same table, more entries.
     #TODO: Make match and postmatch easier to use
     def __init__(self, datapath, match, action, priority=1, table=0, postmatch=None):
+        self.shut_down = False
         self.match = match
         self.action = action
         self.postmatch = postmatch
@@ -136,12 +434,15 @@ class NetAssayMatchAction(object):
         # Register with MCM
         self.mcm = NetAssayMCM()
         self.mcm.register_NAMA(self)
-        self.vmac = self.mcm.get_vmac(str(self.match) + 
-                                      str(self.postmatch))
+        self.mcm.register_datapath(datapath)
+        self.vmac = self.mcm.get_vmac((match_key(self.match),
+                                       match_key(self.postmatch or {})))
         self.mcmtable = self.mcm.get_table()
         self.subtable = table
         self.datapath = datapath
-        self.cookie = self.mcm.get_cookie()
+        self.cookie = MCM_TABLE_COOKIE_BIT | self.mcm.get_cookie()
+        self.nama_id = self.mcm.get_nama_id()
+        self.rule_seq = 0
 
         # Install rule in MCM's table for future action
         self.install_mcm_table_match()
@@ -152,19 +453,32 @@ class NetAssayMatchAction(object):
 #        self.MErules = self._create_ME_rules()
 #        self._register_with_MEs()
         # FOR A SINGLE RULE ONLY
-        rma = RegisteredMatchActions()
-        self.ME = rma.lookup(self.match.keys()[0])
-        self.MErule = self.ME.new_rule(self.match[self.match.keys()[0]],
-                                       self.add_rule, self.remove_rule)
+        # The ME's rule is shared with every other NAMA with the same match.
+        self.shared_rule = self.mcm.subscribe(self)
+        self.ME = self.shared_rule.me
+        self.MErule = self.shared_rule.me_rule
 
         self.mcm.logger.info("Created NAMA on switch " + str(self.datapath.id) + " for: " + str(self.match))
 
     def __del__(self):
-        # Clean up all the outstanding rules before deletion.
+        # Clean up all the outstanding rules before deletion, unless
+        # shutdown() already has.
+        if self.shut_down:
+            return
         self.mcm.logger.info("Deleting NAMA on switch "+ str(self.datapath.id) + " for: " + str(self.match))
-        for key in self.trackers.keys():
-            to_remove = self.trackers[key]
-            self.remove_match(to_remove)
+        self.remove_all_matches()
+
+    def shutdown(self):
+        # The shared rule and the MCM hold on to the NAMA, so __del__ won't
+        # be called until it's been shut down.
+        if self.shut_down:
+            return
+        self.shut_down = True
+        self.mcm.logger.info("Shutting down NAMA on switch "+ str(self.datapath.id) + " for: " + str(self.match))
+        self.mcm.unsubscribe(self)
+        self.mcm.unregister_NAMA(self)
+        self.remove_all_matches()
+        self.remove_mcm_table_match()
 
         
     #TODO - This is for multiple included rules in a single NAMA. 
@@ -191,33 +505,34 @@ class NetAssayMatchAction(object):
         # a new OF rule.
         matchval = kwargs
 
-        self.mcm.logger.debug("For " + str(self.match) + "\n            add_rule: " + str(matchval))
+        self.mcm.logger.debug("For %s\n            add_rule: %s", self.match, matchval)
 
-        strval = str(matchval)
-        if strval in self.trackers.keys():
-            self.trackers[strval].count += 1
+        key = match_key(matchval)
+        tracker = self.trackers.get(key)
+        if tracker is not None:
+            tracker.count += 1
         else:
             to_install = self.create_match_tracking(matchval)
             self.install_match(to_install)
-            self.trackers[strval] = to_install
+            self.trackers[key] = to_install
 
 
     def remove_rule(self, **kwargs):
         # Make sure it exists
         matchval = kwargs
 
-        self.mcm.logger.debug("For " + str(self.match) + "\n            remove_rule: " + str(matchval))
+        self.mcm.logger.debug("For %s\n            remove_rule: %s", self.match, matchval)
 
-        strval = str(matchval)
-        if strval in self.trackers.keys():
+        key = match_key(matchval)
+        tracker = self.trackers.get(key)
+        if tracker is not None:
             # If there are multiple instances of the same rule, slightly
             # different behaviour. No need to remove the OF rule.
-            if self.trackers[strval].count > 1:
-                self.trackers[strval].count -= 1
+            if tracker.count > 1:
+                tracker.count -= 1
             else:
-                to_remove = self.trackers[strval]
-                del self.trackers[strval]
-                self.remove_match(to_remove)
+                del self.trackers[key]
+                self.remove_match(tracker)
         else:
             print "We have the following valid rules:"
             for key in self.trackers.keys():
@@ -226,8 +541,15 @@ class NetAssayMatchAction(object):
                 "Trying to remove one that doesn't exists:\n    " +
                 str(matchval))
 
+    def get_rule_cookie(self):
+        self.rule_seq += 1
+        if self.rule_seq > RULE_SEQ_MASK:
+            raise MainControlModuleException(
+                "NAMA " + str(self.nama_id) + " is out of rule cookies")
+        return (self.nama_id << NAMA_ID_SHIFT) | self.rule_seq
+
     def create_match_tracking(self, match_kwargs):
-        cookie = self.mcm.get_cookie()
+        cookie = self.get_rule_cookie()
 
         parser = self.datapath.ofproto_parser
         subaction = [parser.OFPInstructionWriteMetadata(self.vmac, 4095)]
@@ -270,14 +592,17 @@ class NetAssayMatchAction(object):
 
         if buffer_id:
             mod = parser.OFPFlowMod(datapath=datapath, buffer_id=buffer_id,
+                                    cookie=cookie, priority=priority,
+                                    match=match, instructions=inst,
+                                    table_id=table)
+        else:
+            mod = parser.OFPFlowMod(datapath=datapath, cookie=cookie,
                                     priority=priority, match=match,
                                     instructions=inst, table_id=table)
-        else:
-            mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
-                                    match=match, instructions=inst, 
-                                    table_id=table)
 
-        datapath.send_msg(mod)
+        # The tracker's cookie is unique, so it identifies the rule for the
+        # batcher.
+        self.mcm.get_batcher(datapath).add(cookie, mod)
         
 
     def remove_match(self, tracker):
@@ -295,16 +620,40 @@ class NetAssayMatchAction(object):
         table = self.subtable
 
         self.mcm.logger.debug("remove_match  : switch   " + str(datapath.id))
-        self.mcm.logger.debug("              : priority " + str(priority))
+        self.mcm.logger.debug("              : priority " + str(self.priority))
         self.mcm.logger.debug("              : match    " + str(match))
         self.mcm.logger.debug("              : actions  " + str(actions))
         
-        mod = parser.OFPFlowMod(datapath=datapath, cookie=cookie, 
+        # The exact cookie keeps other NAMAs' rules for the same address.
+        mod = parser.OFPFlowMod(datapath=datapath, cookie=cookie,
+                                cookie_mask=EXACT_COOKIE_MASK,
                                 table_id=table, command=ofproto_v1_3.OFPFC_DELETE,
                                 out_group=ofproto_v1_3.OFPG_ANY, 
                                 out_port=ofproto_v1_3.OFPP_ANY, 
                                 match=match)
-        datapath.send_msg(mod)
+        self.mcm.get_batcher(datapath).delete(cookie, mod)
+
+    def remove_all_matches(self):
+        # Removes every rule learned from the ME with a single flow-mod,
+        # matching on the NAMA's id in the cookie. As a NAMA has a single
+        # domain rule, this is also every rule learned for that domain.
+        datapath = self.datapath
+        parser = self.datapath.ofproto_parser
+        cookie = self.nama_id << NAMA_ID_SHIFT
+
+        self.mcm.logger.debug("remove_all_matches : switch " + str(datapath.id))
+        self.mcm.logger.debug("                   : rules  " + str(len(self.trackers)))
+        self.trackers = {}
+
+        mod = parser.OFPFlowMod(datapath=datapath, cookie=cookie,
+                                cookie_mask=NAMA_COOKIE_MASK,
+                                table_id=ofproto_v1_3.OFPTT_ALL,
+                                command=ofproto_v1_3.OFPFC_DELETE,
+                                out_group=ofproto_v1_3.OFPG_ANY,
+                                out_port=ofproto_v1_3.OFPP_ANY,
+                                match=parser.OFPMatch())
+        self.mcm.get_batcher(datapath).delete_cookies(cookie, NAMA_COOKIE_MASK,
+                                                     mod)
 
 
     def install_mcm_table_match(self):
@@ -329,14 +678,16 @@ class NetAssayMatchAction(object):
 
         if buffer_id:
             mod = parser.OFPFlowMod(datapath=datapath, buffer_id=buffer_id,
+                                    cookie=cookie, priority=priority,
+                                    match=match, instructions=inst,
+                                    table_id=table)
+        else:
+            mod = parser.OFPFlowMod(datapath=datapath, cookie=cookie,
                                     priority=priority, match=match,
                                     instructions=inst, table_id=table)
-        else:
-            mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
-                                    match=match, instructions=inst, 
-                                    table_id=table)
 
-        datapath.send_msg(mod)
+        # Through the batcher, so it's shadowed and restored on reconnect.
+        self.mcm.get_batcher(datapath).add(cookie, mod)
         
 
     def remove_mcm_table_match(self):
@@ -345,17 +696,18 @@ class NetAssayMatchAction(object):
         ofproto = self.datapath.ofproto
         parser = self.datapath.ofproto_parser
 
-        match = self.match
-        actions = self.actions
+        match = parser.OFPMatch(metadata=self.vmac)
         cookie = self.cookie
-        buffer_id = None
 
         #TODO: Should this be in the match_tracking class?
         table = self.mcmtable
 
-        mod = parser.OFPFlowMod(datapath=datapath, cookie=cookie, 
+        # The exact cookie, as other NAMAs may share the vmac. Through the
+        # batcher, so it's dropped from the shadow too.
+        mod = parser.OFPFlowMod(datapath=datapath, cookie=cookie,
+                                cookie_mask=EXACT_COOKIE_MASK,
                                 table_id=table, command=ofproto_v1_3.OFPFC_DELETE,
                                 out_group=ofproto_v1_3.OFPG_ANY, 
                                 out_port=ofproto_v1_3.OFPP_ANY, 
                                 match=match)
-        datapath.send_msg(mod)
+        self.mcm.get_batcher(datapath).delete(cookie, mod)
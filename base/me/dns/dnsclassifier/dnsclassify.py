@@ -2,10 +2,16 @@
 # Based off of https://github.com/shahifaqeer/dnsclassifier. Modified
 # to work with Pyretic.
 
-from ryu.lib.packet import dns
-from ryu.lib import addrconv
+import socket
+from threading import RLock
+from ryu.lib.packet.dns import dns
 from mapper import Mapper
 from base.me.dns.dnsentry import DNSClassifierEntry as Entry
+from base.me.dns.dnsentry import intern_name, normalize_name
+from base.lib.expiry_index import expiry_index
+from base.lib.ip_addr import text_to_packed
+from base.lib.py_clock import monotonic
+from base.lib.py_timer import py_timer as Timer
 
 # need hooks for passing in DNS packets
 #    Parsing out different types
@@ -17,8 +23,14 @@ from base.me.dns.dnsentry import DNSClassifierEntry as Entry
 # querying by IP (string)
 # prepopulating db from a file?
 
-# Database dictionary of dictionaries:
-#    Primary key - IP address string - returns the dictionary associated with IP
+# Database dictionary of DNSClassifierEntrys:
+#    Primary key - packed IP address, the raw rddata of the A or AAAA record.
+#                  IPv4 and IPv6 share the database, as 4 and 16 byte keys
+#                  can never collide. The address is only converted to text
+#                  (see base.lib.ip_addr) for logging and for OpenFlow
+#                  matches. Everything handed to callbacks and returned by
+#                  the find_by_*() methods is keyed this way. find_by_ip(),
+#                  get_classification() and has() take text.
 #    Secondary keys
 #        record types?
 #        'ttl' - TTL value from the packet
@@ -26,6 +38,45 @@ from base.me.dns.dnsentry import DNSClassifierEntry as Entry
 #                   upon hitting, delete/move to "expired" list
 #        'classification'
 #
+# Expiry is handled by a single expiry_index, rather than a timer per entry. It
+# buckets entries by the second they expire in and is swept every
+# SWEEP_INTERVAL seconds. Expired entries are removed from the database and
+# their timeout callbacks are called. Refreshing an entry's TTL just moves it
+# to a different bucket.
+#
+# Secondary indexes, name -> set of IPs and classification -> set of IPs, are
+# kept in sync with the database so that find_by_name() and
+# find_by_classification() don't need to scan every entry. Always go through
+# _add_entry(), _add_name() and _set_classification() to change the database.
+# Names are lowercased on the way in (see dnsentry.normalize_name()), and so
+# are the names find_by_name() and find_by_domain() are given.
+#
+# CNAME records are kept as a graph of alias -> canonical name edges, each
+# with its own TTL in a second expiry index. An address is filed under its
+# owner name and under every alias that leads to that name, so a rule for
+# 'www.example.com' matches the address of the CDN name it's an alias for.
+# When a new edge arrives, the alias is also added to the addresses already
+# cached for the canonical name. The walk back through the aliases is
+# guarded against loops and stops after MAX_CNAME_NAMES names. An expired
+# edge only stops new addresses picking up the alias; names already filed
+# under an address stay until the address expires.
+#
+# Callbacks may well install rules, so they're never called with the lock
+# held. Changes to the database queue up their callbacks as (callback, args)
+# on a list, and the list is run once the lock is released.
+
+SWEEP_INTERVAL = 1
+MAX_CNAME_NAMES = 32
+
+# Address record types, and the length of their rddata.
+ADDRESS_LENGTHS = {dns.rr.A_TYPE    : 4,
+                   dns.rr.AAAA_TYPE : 16}
+
+# Responses are parsed lazily, and only the records below are ever built. The
+# rest are skipped over by their rdlength, and packets that aren't NOERROR
+# responses are dropped right after the header.
+PARSE_QTYPES = frozenset(ADDRESS_LENGTHS.keys() + [dns.rr.CNAME_TYPE])
+PARSE_SECTIONS = frozenset(['answers', 'additional'])
 
 class DNSClassifierException(Exception):
     pass
@@ -40,84 +91,257 @@ class DNSClassifier:
         self.all_callbacks = []        # When entry is updated or new
         self.class_callbacks = {}      # Dictionary of lists of callbacks per
                                        # classification
+        self.new_name_callbacks = []   # When any name is first seen for an IP
+        self.name_index = {}           # name -> set of IPs
+        self.class_index = {}          # classification -> set of IPs
+        self.cnames = {}               # alias -> canonical name
+        self.aliases = {}              # canonical name -> set of aliases
+        self.cname_expiry = expiry_index()
+        self.expiry_index = expiry_index()
+        self.sweep_timer = None
+        self.lock = RLock()
 
     def parse_new_DNS(self, packet):
+        records = self.parse_records(packet)
+        if records is not None:
+            self.apply_records(*records)
+
+    def parse_records(self, packet):
+        """Parses a DNS response without touching the database, so it can be
+           called from any thread without the lock. Returns None, or
+           (cnames, addresses) to hand to apply_records():
+             cnames    - list of (alias, canonical name, ttl)
+             addresses - list of (packed address, name, ttl)
+        """
         # Only look at responses with 'No error' reply code
-        dns_parsed = dns.parser(packet)
-        if (dns_parsed.qr and dns_parsed.rcode == 0000):
-            # skip the questions...
-            # we don't care about authorities
-            # we care about answers
-            # we care about additional - could be some goodies in there
-            for resp in (dns_parsed.answers + dns_parsed.additional):
-                # save off the ttl, classification, calculate expiry time
-                # Name of item that's being saved, 
-                if (resp.qtype == dns.rr.A_TYPE):
-                    classification = self.mapper.searchType(resp.name)
-                    addr = addrconv.ipv4.bin_to_text(resp.rddata)
-                    
-                    if addr not in self.db.keys():
-                        self.db[addr] =  Entry(addr, list(), classification,
-                                               resp.ttl)
-                        self.db[addr].names.append(resp.name)
-                        for callback in self.new_callbacks:
-                            callback(addr, self.db[addr])
-                        if classification in self.class_callbacks.keys():
-                            for callback in self.class_callbacks[classification]:
-                                callback(addr, self.db[addr])
-                    else:
-                        self.db[addr].update_expiry(resp.ttl)
-                        old_class = self.db[addr].classification
-                        self.db[addr].classification = classification
-
-                        if resp.name not in self.db[addr].names:
-                            self.db[addr].names.append(resp.name)
-                        for callback in self.update_callbacks:
-                            callback(addr, self.db[addr])
-                        if old_class != classification:
-                            if classification in self.class_callbacks.keys():
-                                for callback in self.class_callbacks[classification]:
-                                    callback(addr, self.db[addr])
-
-                    for callback in self.all_callbacks:
-                        callback(addr, self.db[addr])
-
-                elif (resp.qtype == dns.rr.AAAA_TYPE):
-                    #placeholder
-                    print "Found a AAAA"
-                elif (resp.qtype == dns.rr.CNAME_TYPE):
-                    #placeholder
-                    print "Found a CNAME!"
-                elif (resp.qtype == dns.rr.MX_TYPE):
-                    #placeholder
-                    print "Found an MX!"
+        dns_parsed = dns.lazy_parser(packet, qtypes=PARSE_QTYPES,
+                                     sections=PARSE_SECTIONS,
+                                     noerror_responses_only=True)
+        if dns_parsed is None:
+            return None
+        if not (dns_parsed.qr and dns_parsed.rcode == 0000):
+            return None
 
-    def _install_new_rule(self, domain, addr):
-        # DIRTY, doesn't handle classification.
-        if addr not in self.db.keys():
-            self.db[addr] = Entry(addr, list(), "", 1000)
-            self.db[addr].names.append(domain)
-            for callback in self.new_callbacks:
-                callback(addr, self.db[addr])
+        # skip the questions...
+        # we don't care about authorities
+        # we care about answers
+        # we care about additional - could be some goodies in there
+        cnames = []
+        addresses = []
+        for resp in (dns_parsed.answers + dns_parsed.additional):
+            if resp.qtype == dns.rr.CNAME_TYPE:
+                cnames.append((resp.name, resp.rddata, resp.ttl))
+            elif ADDRESS_LENGTHS.get(resp.qtype) == resp.rdlen:
+                addresses.append((resp.rddata, resp.name, resp.ttl))
+        return (cnames, addresses)
+
+    def apply_records(self, cnames, addresses):
+        """Applies records from parse_records(), from one or more responses,
+           to the database in a single pass under the lock. The callbacks are
+           called afterwards.
+        """
+        calls = []
+        with self.lock:
+            # CNAMEs first, so that the addresses they lead to pick up
+            # every alias in the chain.
+            for (alias, canonical, ttl) in cnames:
+                self._add_cname(alias, canonical, ttl, calls)
+            for (addr, name, ttl) in addresses:
+                self._add_address(addr, name, ttl, calls)
+        self._run_callbacks(calls)
+
+    def _run_callbacks(self, calls):
+        for (callback, args) in calls:
+            callback(*args)
 
+    def _add_address(self, addr, name, ttl, calls):
+        # Called with the lock held. Callbacks are queued on calls.
+        # save off the ttl, classification, calculate expiry time
+        name = intern_name(name)
+        classification = self.mapper.searchType(name)
+        names = self._names_for(name)
+
+        entry = self.db.get(addr)
+        if entry is None:
+            entry = Entry(addr, names, classification, ttl)
+            self._add_entry(entry)
+            for name in names:
+                self._queue_name_callbacks(name, entry, calls)
+            for callback in self.new_callbacks:
+                calls.append((callback, (addr, entry)))
+            for callback in self.class_callbacks.get(classification, ()):
+                calls.append((callback, (addr, entry)))
         else:
-            self.db[addr].update_expiry(1000)
-            
-            if domain not in self.db[addr].names:
-                self.db[addr].names.append(domain)
+            self.update_entry_expiry(entry, ttl)
+            old_class = entry.classification
+            self._set_classification(entry, classification)
+            for name in names:
+                if self._add_name(entry, name):
+                    self._queue_name_callbacks(name, entry, calls)
             for callback in self.update_callbacks:
-                callback(addr, self.db[addr])
+                calls.append((callback, (addr, entry)))
+            if old_class != classification:
+                for callback in self.class_callbacks.get(classification, ()):
+                    calls.append((callback, (addr, entry)))
+
+        for callback in self.all_callbacks:
+            calls.append((callback, (addr, entry)))
+
+    def _install_new_rule(self, domain, addr):
+        # DIRTY, doesn't handle classification.
+        # addr is text, as this comes from outside rather than from a packet.
+        addr = text_to_packed(addr)
+        domain = intern_name(domain)
+        calls = []
+        with self.lock:
+            entry = self.db.get(addr)
+            if entry is None:
+                entry = Entry(addr, [domain], "", 1000)
+                self._add_entry(entry)
+                self._queue_name_callbacks(domain, entry, calls)
+                for callback in self.new_callbacks:
+                    calls.append((callback, (addr, entry)))
+
+            else:
+                self.update_entry_expiry(entry, 1000)
             
+                if self._add_name(entry, domain):
+                    self._queue_name_callbacks(domain, entry, calls)
+                for callback in self.update_callbacks:
+                    calls.append((callback, (addr, entry)))
+        self._run_callbacks(calls)
 
-    def _clean_expiry_full(self):
-        # Loop through everything to check for expired DNS entries
-        for key in self.db.keys():
-            entry = self.db[key]
-            if entry.is_expired():
-                del self.db[key]
+    def _add_entry(self, entry):
+        with self.lock:
+            self.db[entry.IP] = entry
+            for name in entry.names:
+                self.name_index.setdefault(name, set()).add(entry.IP)
+            self.class_index.setdefault(entry.classification,
+                                        set()).add(entry.IP)
+            self.expiry_index.add(entry.IP, entry.expiry)
+            self._start_sweep_timer()
+
+    def _remove_entry(self, entry):
+        # The entry has already been taken out of the expiry index.
+        with self.lock:
+            del self.db[entry.IP]
+            for name in entry.names:
+                self._unindex(self.name_index, name, entry.IP)
+            self._unindex(self.class_index, entry.classification, entry.IP)
+
+    def _unindex(self, index, key, addr):
+        addrs = index.get(key)
+        if addrs is not None:
+            addrs.discard(addr)
+            if len(addrs) == 0:
+                del index[key]
+
+    def _add_name(self, entry, name):
+        # Returns True if the name is new for this entry.
+        with self.lock:
+            if name in entry.names:
+                return False
+            name = intern_name(name)
+            entry.names.append(name)
+            self.name_index.setdefault(name, set()).add(entry.IP)
+            return True
+
+    def _add_cname(self, alias, canonical, ttl, calls):
+        # Callbacks are queued on calls.
+        with self.lock:
+            alias = intern_name(alias)
+            canonical = intern_name(canonical)
+            self.cname_expiry.add(alias, monotonic() + ttl)
+            self._start_sweep_timer()
+            old_canonical = self.cnames.get(alias)
+            if old_canonical == canonical:
+                return
+            if old_canonical is not None:
+                self._unindex(self.aliases, old_canonical, alias)
+            self.cnames[alias] = canonical
+            self.aliases.setdefault(canonical, set()).add(alias)
+
+            # Addresses already cached for the canonical name are now also
+            # reached through the alias, and whatever leads to it.
+            addrs = self.name_index.get(canonical)
+            if addrs is not None:
+                names = self._names_for(alias)
+                for addr in list(addrs):
+                    entry = self.db[addr]
+                    for name in names:
+                        if self._add_name(entry, name):
+                            self._queue_name_callbacks(name, entry, calls)
+
+    def _remove_cname(self, alias):
+        # The edge has already been taken out of the expiry index.
+        canonical = self.cnames.pop(alias, None)
+        if canonical is not None:
+            self._unindex(self.aliases, canonical, alias)
+
+    def _names_for(self, name):
+        # name, followed by every alias that leads to it. names grows while
+        # it's walked, breadth first.
+        names = [name]
+        seen = set(names)
+        for current in names:
+            for alias in self.aliases.get(current, ()):
+                if alias not in seen:
+                    seen.add(alias)
+                    names.append(alias)
+                    if len(names) >= MAX_CNAME_NAMES:
+                        return names
+        return names
+
+    def _queue_name_callbacks(self, name, entry, calls):
+        # Subscribers do their own dispatch by name, see
+        # set_new_name_callback().
+        for callback in self.new_name_callbacks:
+            calls.append((callback, (name, entry.IP, entry)))
+
+    def _set_classification(self, entry, classification):
+        with self.lock:
+            if entry.classification != classification:
+                self._unindex(self.class_index, entry.classification, entry.IP)
+                entry.classification = classification
+                self.class_index.setdefault(classification,
+                                            set()).add(entry.IP)
+
+    def update_entry_expiry(self, entry, ttl):
+        """Sets a new TTL on an entry, moving it in the expiry index.
+        """
+        with self.lock:
+            entry.update_expiry(ttl)
+            self.expiry_index.move(entry.IP, entry.expiry)
+
+    def _start_sweep_timer(self):
+        if self.sweep_timer is None or not self.sweep_timer.is_alive():
+            self.sweep_timer = Timer(SWEEP_INTERVAL, self._sweep_timer_expired)
+            self.sweep_timer.start()
+
+    def _sweep_timer_expired(self):
+        self.clean_expired()
+        with self.lock:
+            if len(self.expiry_index) != 0 or len(self.cname_expiry) != 0:
+                self._start_sweep_timer()
 
     def clean_expired(self):
-        self._clean_expiry_full()
+        """Removes all expired entries from the database, and calls their
+           timeout callbacks. Expired CNAME edges are removed too.
+        """
+        expired = []
+        with self.lock:
+            now = monotonic()
+            for key in self.expiry_index.pop_expired(now):
+                entry = self.db.get(key)
+                if entry is not None:
+                    self._remove_entry(entry)
+                    expired.append(entry)
+            for alias in self.cname_expiry.pop_expired(now):
+                self._remove_cname(alias)
+
+        # Call back outside of the lock, callbacks may well install rules.
+        for entry in expired:
+            entry.call_timeout_callbacks()
         
     def print_entries(self):
         for key in self.db.keys():
@@ -149,59 +373,94 @@ class DNSClassifier:
     def set_classification_callback(self, cb, classification):
         print "set_classification_callback: " + str(cb)
         print "classification:              " + str(classification)
-        if classification not in self.class_callbacks.keys():
+        if classification not in self.class_callbacks:
             self.class_callbacks[classification] = list()
         if cb not in self.class_callbacks[classification]:
             self.class_callbacks[classification].append(cb)
 
     def remove_classification_callback(self, cb, classification):
-        if classification not in self.class_callbacks.keys():
+        if classification not in self.class_callbacks:
             return
         self.class_callbacks[classification].remove(cb)
 
+    def set_new_name_callback(self, cb):
+        """cb(name, addr, entry) is called whenever any name resolves to an
+           IP that it didn't resolve to before. This is for subscribers that
+           do their own dispatch by name, such as the DNSMetadataEngine.
+        """
+        with self.lock:
+            if cb not in self.new_name_callbacks:
+                self.new_name_callbacks.append(cb)
+
+    def remove_new_name_callback(self, cb):
+        with self.lock:
+            self.new_name_callbacks.remove(cb)
+
     def find_by_ip(self, addr):
-        """Returns the entry specified by the ip 'addr' if it exists
+        """Returns the entry specified by the ip 'addr' (text) if it exists
         """
-        if addr in self.db.keys():
-            return self.db[addr]
-        return None
+        return self._lookup(addr)
 
-    def get_classification(self, IP):
+    def get_classification(self, addr):
         """Returns the classification for the entry specified by the ip 'addr'
-           if it exists
+           (text) if it exists
         """
-        if addr in self.db.keys():
-            return self.db[addr].classification
+        entry = self._lookup(addr)
+        if entry is not None:
+            return entry.classification
         return None
 
     def find_by_classification(self, classification):
         """Returns a dictionary of database entries from a particular category  
-           Dictionary will be ipaddr:dbentry
+           Dictionary will be packed ipaddr:dbentry
         """
-        retdict = {}
-        for key in self.db.keys():
-            if classification == self.db[key].classification:
-                retdict[key] = self.db[key]
-        return retdict
+        with self.lock:
+            return self._find_by_index(self.class_index, classification)
 
     def find_by_name(self, name):
         """Returns a dictionary of database entries for a particular webname
-           Dictionary will be ipaddr:dbentry
+           Dictionary will be packed ipaddr:dbentry
+        """
+        with self.lock:
+            return self._find_by_index(self.name_index, normalize_name(name))
+
+    def find_by_domain(self, domain):
+        """Like find_by_name(), but 'domain' may also be a wildcard such as
+           '*.example.com', which matches every name below example.com.
+           Wildcards need a scan of every name in the database.
         """
+        if not domain.startswith('*.'):
+            return self.find_by_name(domain)
+
+        suffix = normalize_name(domain[1:])
         retdict = {}
-        for key in self.db.keys():
-            for nameval in self.db[key].names:
-                if nameval == name:
-                    retdict[key] = self.db[key]
-                    continue # don't need to look at any more of the names
+        with self.lock:
+            for (name, addrs) in self.name_index.items():
+                if name.endswith(suffix):
+                    for addr in addrs:
+                        retdict[addr] = self.db[addr]
+        return retdict
+
+    def _lookup(self, addr):
+        # Something that isn't an address can't be in the database.
+        try:
+            return self.db.get(text_to_packed(addr))
+        except (socket.error, TypeError, ValueError):
+            return None
+
+    def _find_by_index(self, index, key):
+        retdict = {}
+        for addr in index.get(key, ()):
+            retdict[addr] = self.db[addr]
         return retdict
 
     def has(self, ipaddr):
-        """Returns true if we have a record for a particular IP address.
-           Returns fase if we don't have an active record for a particular
-           IP address.
+        """Returns true if we have a record for a particular IP address
+           (text). Returns false if we don't have an active record for a
+           particular IP address.
         """
-        if ipaddr not in self.db.keys():
-            return false        
-        return self.db[ipaddr].is_expired()
+        entry = self._lookup(ipaddr)
+        if entry is None:
+            return False
+        return not entry.is_expired()
 
@@ -1,5 +1,36 @@
 import re
 from collections import defaultdict
+from base.lib.domain_trie import domain_trie
+from base.lib.lru_cache import lru_cache
+
+# Service definitions are compiled once into a matcher (see Mapper._compile()).
+# Patterns of the form '*.example.com' go in a reversed-label suffix trie and
+# match names below example.com. Everything else is combined into as few
+# regexes as possible: each pattern becomes an optional lookahead with its own
+# named group, so a single match() call reports every pattern that a name
+# matches, exactly as re.search() would have.
+#
+# DNS names aren't case sensitive, so names are lowercased before the search,
+# and the regexes are compiled with re.IGNORECASE so that patterns written with
+# uppercase letters still match. The trie lowercases its patterns too.
+
+# What loadFile() turns '*.example.com' into.
+_WILDCARD_SUFFIX = re.compile(r'^\[\\S\]\*\.([A-Za-z0-9_-]+(?:\.[A-Za-z0-9_-]+)*)$')
+
+# What loadFile() turns a leading or trailing '*' into. For a search, these
+# can match nothing, so they don't change whether a pattern matches, and are
+# dropped to save backtracking.
+_ANY = '[\\S]*'
+
+# Python's re module can't have more than 100 groups in a single pattern.
+_MAX_GROUPS = 99
+
+# Flags for the combined regexes.
+_FLAGS = re.DOTALL | re.IGNORECASE
+
+# The same names come up again and again, so searchType() results are kept in
+# an LRU cache keyed on the lowercased name. It's emptied by loadFile().
+DEFAULT_CACHE_SIZE = 100000
 
 
 class MapperException(Exception):
@@ -7,8 +38,10 @@ class MapperException(Exception):
 
 
 class Mapper:
-  def __init__(self, DNS_SEARCH_REGEX = 1):
+  def __init__(self, DNS_SEARCH_REGEX = 1, cache_size = DEFAULT_CACHE_SIZE):
     self.name_to_service = defaultdict(lambda: 'DEFAULT')
+    self._matcher = None
+    self.cache = lru_cache(cache_size)
 
 
     if DNS_SEARCH_REGEX:
@@ -29,6 +62,45 @@ class Mapper:
     f = open(filename, 'r')
     for line in f.readlines():
       self.name_to_service[(line.strip('\n').replace('*', '[\S]*'))] = service
+    # Recompile on the next search
+    self._matcher = None
+    self.cache.clear()
+
+  def _compile(self):
+    trie = domain_trie()
+    regexes = []            # list of (compiled regex, its pattern groups)
+    group_to_service = {}
+    chunk = []
+    chunk_names = []
+    chunk_groups = 0
+
+    for name, service in self.name_to_service.items():
+      found = _WILDCARD_SUFFIX.match(name)
+      if found is not None:
+        trie.insert('*.' + found.group(1), service)
+        continue
+
+      pattern = name
+      while pattern.startswith(_ANY):
+        pattern = pattern[len(_ANY):]
+      while pattern.endswith(_ANY) and not pattern.endswith('\\' + _ANY):
+        pattern = pattern[:-len(_ANY)]
+
+      groups = re.compile(pattern).groups + 1
+      if chunk_groups + groups > _MAX_GROUPS and len(chunk) != 0:
+        regexes.append((re.compile(''.join(chunk), _FLAGS), chunk_names))
+        chunk = []
+        chunk_names = []
+        chunk_groups = 0
+      group = '_p%d' % len(group_to_service)
+      group_to_service[group] = service
+      chunk.append('(?:(?=.*?(?P<%s>%s)))?' % (group, pattern))
+      chunk_names.append(group)
+      chunk_groups += groups
+    if len(chunk) != 0:
+      regexes.append((re.compile(''.join(chunk), _FLAGS), chunk_names))
+
+    self._matcher = (trie, regexes, group_to_service)
 
   def createTypePoll(self):
     """For every new search, poll the type with the most
@@ -37,13 +109,37 @@ class Mapper:
     self.types_poll['DEFAULT'] = 0
 
   def searchType(self, dnsname):
-    self.createTypePoll()
-    for name, service in self.name_to_service.items():
-      found = re.search(name, dnsname)
-      if found is not None:
+    dnsname = dnsname.lower()
+    service = self.cache.get(dnsname)
+    if service is None:
+      service = self._searchType(dnsname)
+      self.cache.put(dnsname, service)
+    return service
+
+  def cacheStats(self):
+    """Returns the hit/miss/eviction counters of the searchType() cache"""
+    return self.cache.stats()
+
+  def _searchType(self, dnsname):
+    """Poll the type with the most matches instead of the first match"""
+    if self._matcher is None:
+      self._compile()
+    (trie, regexes, group_to_service) = self._matcher
+
+    votes = {}
+    for service in trie.lookup(dnsname):
+      votes[service] = votes.get(service, 0) + 1
+    for (regex, groups) in regexes:
+      found = regex.match(dnsname)
+      for group in groups:
+        if found.group(group) is not None:
           # if match is found, increment counter of that TYPE
-          self.types_poll[service]+=1
-    return max(self.types_poll, key=self.types_poll.get)
+          service = group_to_service[group]
+          votes[service] = votes.get(service, 0) + 1
+
+    if len(votes) == 0:
+      return 'DEFAULT'
+    return max(votes, key=votes.get)
 
   def searchTypeByStringMatching(self, dnsname):
     self.createTypePoll()
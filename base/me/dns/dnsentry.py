@@ -1,18 +1,21 @@
-from datetime import datetime, timedelta
-from base.lib.py_timer import py_timer as Timer
+from datetime import datetime
+from base.lib.py_clock import monotonic, to_datetime, from_datetime
+from base.lib.ip_addr import packed_to_text
 
 
 # Creating a new entry takes at least 4 parameters.
-#   IP    - The IP address (as a string!) of the website
+#   IP    - The packed IP address of the website, the raw bytes from the DNS
+#           record. See base.lib.ip_addr for converting it to text.
 #   names - a list of website names (url/uri) associated with the IP address
 #   classification - the type of site that this is. It's currently a string.
 #   ttl   - Time to live, which is a field in the DNS frame. It's the number of 
 #           seconds that the entry is valid for
 # There is one optional parameter.
-#   expiry - This is the time, as a datetime, that the entry expires. If it is
-#            None (the default), the expiry time will be now + ttl seconds.
+#   expiry - This is the time, as a monotonic time from py_clock (or as a
+#            datetime), that the entry expires. If it is None (the default),
+#            the expiry time will be now + ttl seconds.
 #
-# It has 3 public methods:
+# It has 6 public methods:
 #   print_entry()   - This prints the entry with an offset (that's is a string) 
 #                     and can be anything from spaces to text.
 #   is_expired()    - This returns if the entry is expired or not. By default,
@@ -21,25 +24,49 @@ from base.lib.py_timer import py_timer as Timer
 #   register_timeout_callback() - takes a function of the form func(addr,entry) 
 #                     where 'addr' is the IP address of the entry and 'entry' 
 #                     will be the the entry that's expiring.
-class DNSClassifierEntry:
+#   unregister_timeout_callback() - removes a function registered above.
+#   call_timeout_callbacks() - Calls the registered timeout callbacks.
+#
+# Entries use __slots__, and timeout_callbacks stays None until a callback is
+# registered, as there can be a great many entries. Names are interned with
+# intern_name(), so every entry and index for a name share one string.
+#
+# DNS names aren't case sensitive. normalize_name() lowercases them, and is the
+# one place that's done: intern_name() uses it for every name that's stored,
+# and lookups by name use it too.
+#
+# Entries don't have timers of their own. The DNSClassifier that owns them keeps
+# a single expiry index, and calls call_timeout_callbacks() when the entry
+# expires. If the expiry is changed, the owner needs to be told so that the
+# entry is moved in its expiry index (see DNSClassifier.update_entry_expiry()).
+def normalize_name(name):
+    return name.lower()
+
+def intern_name(name):
+    name = normalize_name(name)
+    if type(name) is str:
+        return intern(name)
+    return name
+
+class DNSClassifierEntry(object):
+    __slots__ = ['IP', 'names', 'classification', 'ttl', 'expiry',
+                 'timeout_callbacks']
+
     def __init__(self, IP, names, classification, ttl, expiry=None):
         self.IP = IP
-        self.names = names
+        self.names = [intern_name(name) for name in names]
         self.classification = classification
         self.ttl = ttl
-        if expiry is datetime:
+        if isinstance(expiry, datetime):
+            self.expiry = from_datetime(expiry)
+        elif expiry is not None:
             self.expiry = expiry
         else:
-            self.expiry = datetime.now() + timedelta(seconds=ttl)
+            self.expiry = monotonic() + ttl
 
-        # callbacks! 
-        self.timeout_callbacks = []
-        self.timer = None
+        # callbacks! Allocated on first use.
+        self.timeout_callbacks = None
 
-    def __del__(self):
-        if self.timer is not None:
-            self.timer.cancel()
-    
     def print_entry(self, offset=""):
         names_str = ""
         for name in self.names:
@@ -49,40 +76,46 @@ class DNSClassifierEntry:
         else:
             expired = "Not expired"
 
-        print offset + self.IP
+        print offset + packed_to_text(self.IP)
         print offset + names_str
         print offset + str(self.ttl)
         print offset + self.classification
-        print offset + str(self.expiry)
+        print offset + str(to_datetime(self.expiry))
         print offset + expired
 
     def is_expired(self, expiry=None):
-        if expiry is datetime:
+        if isinstance(expiry, datetime):
+            expiration_time = from_datetime(expiry)
+        elif expiry is not None:
             expiration_time = expiry
         else:
-            expiration_time = datetime.now()
+            expiration_time = monotonic()
 
         return self.expiry < expiration_time
     
     def update_expiry(self, ttl):
         self.ttl = ttl
-        self.expiry = datetime.now() + timedelta(seconds=ttl)
-        if self.timer is not None:
-            self.timer.cancel()
-            self._set_and_start_timer()
+        self.expiry = monotonic() + ttl
     
     def register_timeout_callback(self, func):
-        if func not in self.timeout_callbacks:
+        if self.timeout_callbacks is None:
+            self.timeout_callbacks = [func]
+        elif func not in self.timeout_callbacks:
             self.timeout_callbacks.append(func) 
-        if self.timer is None and not self.is_expired():
-            self._set_and_start_timer()
 
-    def _call_callbacks(self):
+    def unregister_timeout_callback(self, func):
+        # A new list rather than removing in place, as the callbacks may be
+        # being called on another thread.
+        if self.timeout_callbacks is None or func not in self.timeout_callbacks:
+            return
+        callbacks = [cb for cb in self.timeout_callbacks if cb != func]
+        if len(callbacks) == 0:
+            callbacks = None
+        self.timeout_callbacks = callbacks
+
+    def call_timeout_callbacks(self):
         # This is called when it expires.
+        if self.timeout_callbacks is None:
+            return
         for cb in self.timeout_callbacks:
             cb(self.IP, self)
-
-    def _set_and_start_timer(self):
-        time_to_go = self.expiry - datetime.now()
-        self.timer = Timer(time_to_go.total_seconds(), self._call_callbacks)
-        self.timer.start()
@@ -0,0 +1,176 @@
+#########################
+# NetAssay Project
+#########################
+
+# Copyright 2015 - Sean Donovan
+
+# DNS ingest stage, between packet-ins and the DNS Classifier.
+#
+# submit() is called from the OpenFlow event loop with the DNS payload of a
+# packet-in. It never blocks: payloads go on a bounded queue, and if the queue
+# is full, the payload is dropped and counted. Worker threads drain the queue
+# in batches of up to batch_size. For each batch, they:
+#   - drop payloads identical to one already in the batch, such as the same
+#     response copied to the controller by every switch on its path,
+#   - parse each remaining response with DNSClassifier.parse_records(). Names
+#     are only decoded there, so a bad one, such as a compression pointer
+#     past the end of the packet, only shows up then. That response is
+#     dropped and counted in errors, and the rest of the batch carries on,
+#   - merge identical answers, keeping the longest TTL,
+#   - apply the lot with DNSClassifier.apply_records(), so cache updates and
+#     the rule changes they cause happen in a single pass under the lock.
+#
+# Workers are OS threads, or green threads from Ryu's hub with green=True. They
+# are started by the first submit().
+
+import logging
+from threading import Thread, Lock
+from Queue import Queue, Full, Empty
+
+DEFAULT_MAX_QUEUE = 10000
+DEFAULT_BATCH_SIZE = 256
+
+
+class DNSIngest(object):
+    def __init__(self, classifier, workers=1, max_queue=DEFAULT_MAX_QUEUE,
+                 batch_size=DEFAULT_BATCH_SIZE, green=False):
+        self.logger = logging.getLogger("netassay.DNSIngest")
+        self.classifier = classifier
+        self.num_workers = workers
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.green = green
+        self.workers = None
+        self.start_lock = Lock()
+        if green:
+            # Only needed in this mode, so Ryu's hub isn't otherwise required.
+            from ryu.lib import hub
+            self.hub = hub
+            self.queue = hub.Queue(max_queue)
+            self.queue_empty = hub.QueueEmpty
+        else:
+            self.queue = Queue(max_queue)
+            self.queue_empty = Empty
+
+        self.stats_lock = Lock()
+        self.received = 0
+        self.dropped = 0
+        self.duplicates = 0
+        self.parsed = 0
+        self.records = 0
+        self.batches = 0
+        self.max_batch = 0
+        self.errors = 0
+
+    def start(self):
+        with self.start_lock:
+            if self.workers is not None:
+                return
+            self.workers = []
+            for x in range(self.num_workers):
+                if self.green:
+                    self.workers.append(self.hub.spawn(self._worker))
+                else:
+                    worker = Thread(target=self._worker)
+                    worker.daemon = True
+                    worker.start()
+                    self.workers.append(worker)
+
+    def submit(self, payload):
+        """Queues a DNS payload. Returns False if it was dropped because the
+           queue is full.
+        """
+        if self.workers is None:
+            self.start()
+        with self.stats_lock:
+            self.received += 1
+        try:
+            # A green queue is never full here, as nothing else can run
+            # between the check and the put.
+            if self.queue.qsize() >= self.max_queue:
+                raise Full
+            self.queue.put_nowait(payload)
+        except Full:
+            with self.stats_lock:
+                self.dropped += 1
+            return False
+        return True
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def stats(self):
+        with self.stats_lock:
+            return {'received'    : self.received,
+                    'dropped'     : self.dropped,
+                    'duplicates'  : self.duplicates,
+                    'parsed'      : self.parsed,
+                    'records'     : self.records,
+                    'batches'     : self.batches,
+                    'max_batch'   : self.max_batch,
+                    'errors'      : self.errors,
+                    'queue_depth' : self.queue_depth()}
+
+    def _worker(self):
+        while True:
+            batch = [self.queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except self.queue_empty:
+                pass
+
+            try:
+                self._process(batch)
+            except Exception:
+                with self.stats_lock:
+                    self.errors += 1
+                self.logger.exception("Processing a batch of " +
+                                      str(len(batch)) + " DNS responses")
+            if self.green:
+                # Let the event loop in between batches.
+                self.hub.sleep(0)
+
+    def _process(self, batch):
+        seen = set()
+        parsed = 0
+        errors = 0
+        cnames = {}        # alias -> (canonical name, ttl)
+        addresses = {}     # (packed address, name) -> ttl
+        for payload in batch:
+            if payload in seen:
+                continue
+            seen.add(payload)
+            try:
+                records = self.classifier.parse_records(payload)
+            except Exception:
+                errors += 1
+                self.logger.debug("Dropping a malformed DNS response",
+                                  exc_info=True)
+                continue
+            if records is None:
+                continue
+            parsed += 1
+            for (alias, canonical, ttl) in records[0]:
+                old = cnames.get(alias)
+                if old is None or old[0] != canonical or old[1] < ttl:
+                    cnames[alias] = (canonical, ttl)
+            for (addr, name, ttl) in records[1]:
+                key = (addr, name)
+                if addresses.get(key, -1) < ttl:
+                    addresses[key] = ttl
+
+        self.classifier.apply_records(
+            [(alias, canonical, ttl) for (alias, (canonical, ttl))
+             in cnames.iteritems()],
+            [(addr, name, ttl) for ((addr, name), ttl)
+             in addresses.iteritems()])
+
+        with self.stats_lock:
+            self.batches += 1
+            self.duplicates += len(batch) - len(seen)
+            self.parsed += parsed
+            self.errors += errors
+            self.records += len(cnames) + len(addresses)
+            if len(batch) > self.max_batch:
+                self.max_batch = len(batch)
@@ -11,12 +11,17 @@
 ACTIVE_MAPPING = True
 
 import logging
+from threading import Lock
 from base.singleton import Singleton
 
 from dnsclassifier.dnsclassify import *
 from dnsentry import DNSClassifierEntry as DNSEntry
 from base.me.metadataengine import *
 from base.RegisteredMatchActions import *
+from base.lib.domain_trie import domain_trie
+from base.lib.ip_addr import packed_to_text
+from dnssnoop import dns_payload, IPPROTO_UDP, DNS_PORT
+from dnsingest import DNSIngest
 from ryu.ofproto import ether
 
 if ACTIVE_MAPPING == True:
@@ -33,71 +38,172 @@ class DNSMetadataEngine(MetadataEngine):
         super(DNSMetadataEngine, self).__init__(DNSClassifier(), 
                                                 DNSMetadataEntry)
 
+        # Domain rules, both exact ('example.com') and wildcard
+        # ('*.example.com'), are kept in a reversed-label trie, so that each
+        # new name in the DNS cache is matched against every rule in
+        # O(labels).
+        self.rule_trie = domain_trie()
+        self.data_source.set_new_name_callback(self._new_name_callback)
+
+        # Cookie of the rules that copy DNS responses to the controller.
+        # Their payloads are handed to the ingest stage, which parses and
+        # applies them off the OpenFlow event loop.
+        self.snoop_cookie = None
+        self.ingest = DNSIngest(self.data_source)
+
         # Register the different actions this ME can handle
         RegisteredMatchActions().register('domain', self)
         #TODO - disabling class for now.
         #RegisteredMatchActions.register('class', matchClass)
 
-    def __del__(self):
-        # Clean up timer, lest we cause other problems...
-        self.logger.debug("__del__ called.")
-        if ACTIVE_MAPPING == True:
-            if self._active_timer is not None:
-                self._active_timer.cancel()
-                self._active_timer.join()
-
-    def get_forwarding_rules(self):
+    def install_forwarding_rules(self, datapath, table_id, priority,
+                                 next_table, cookie):
         """
-        This gets the forwarding rules that the DNS Classifier needs to work.
+        Copies DNS responses, UDP from port 53 over IPv4 or IPv6, to the
+        controller and sends them on to next_table to be forwarded as normal.
+        Only responses are needed, the DNS Classifier ignores queries.
         """
-        #TODO - This is necessary for getting DNS data that is passing through 
-        # the switches. Currently disabled on the Ryu version as I don't know 
-        # how to implement  forward-to-controller-and-forward-normally-too.
-        self.logger.info("DNSMetadataEngine.get_forwarding_rules(): called")
-        dnspkts = packets(None, ['srcmac'])
-        self.offset = 42 #FIXME! THIS ONLY WORKS WITH IPv4
-        dnspkts.register_callback(self._dns_parse_cb)
+        self.logger.info("DNSMetadataEngine.install_forwarding_rules(): switch " + str(datapath.id))
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        self.snoop_cookie = cookie
 
-        dns_inbound = Match(dict(srcport = 53)) >> dnspkts
-        dns_outbound = Match(dict(dstport = 53)) >> dnspkts
+        actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
+                                          ofproto.OFPCML_NO_BUFFER)]
+        inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS,
+                                             actions),
+                parser.OFPInstructionGotoTable(next_table)]
+        for eth_type in (ether.ETH_TYPE_IP, ether.ETH_TYPE_IPV6):
+            match = parser.OFPMatch(eth_type=eth_type, ip_proto=IPPROTO_UDP,
+                                    udp_src=DNS_PORT)
+            mod = parser.OFPFlowMod(datapath=datapath, cookie=cookie,
+                                    table_id=table_id, priority=priority,
+                                    match=match, instructions=inst)
+            datapath.send_msg(mod)
 
-        return dns_inbound + dns_outbound
+    def set_green(self, green):
+        if green == self.ingest.green:
+            return
+        # The ingest's workers start with the first packet-in, and can't be
+        # swapped after that.
+        if self.ingest.workers is not None:
+            raise DNSMetadataEngineException(
+                "set_green(): DNS ingest has already started")
+        self.ingest = DNSIngest(self.data_source, green=green)
 
-    def _dns_parse_cb(self, pkt):
-        self.logger.info("DNSMetadataEngine._dns_parse_cb(): called")
-        self.data_source.parse_new_DNS(pkt['raw'][self.offset:])
+    def handle_packet_in(self, msg):
+        if self.snoop_cookie is None or msg.cookie != self.snoop_cookie:
+            return False
+        payload = dns_payload(msg.data)
+        if payload is not None:
+            self.ingest.submit(payload)
+        return True
 
     def _install_new_rule(self, domain, ipaddr):
         self.data_source._install_new_rule(domain, ipaddr)
+
+    def add_domain_rule(self, metadata_entry):
+        self.rule_trie.insert(metadata_entry.rule, metadata_entry)
+
+    def remove_domain_rule(self, metadata_entry):
+        self.rule_trie.remove(metadata_entry.rule, metadata_entry)
+
+    def _new_name_callback(self, name, addr, entry):
+        for metadata_entry in self.rule_trie.lookup(name):
+            metadata_entry.handle_new_entry_callback(addr, entry)
     
 
+def address_matches(text):
+    """The two matches for an address, as text: one on the source address and
+       one on the destination.
+    """
+    if ':' in text:
+        return ({'ipv6_src' : text, 'eth_type' : ether.ETH_TYPE_IPV6},
+                {'ipv6_dst' : text, 'eth_type' : ether.ETH_TYPE_IPV6})
+    return ({'ipv4_src' : text, 'eth_type' : ether.ETH_TYPE_IP},
+            {'ipv4_dst' : text, 'eth_type' : ether.ETH_TYPE_IP})
+
+
 class DNSMetadataEntry(MetadataEntry):
     def __init__(self, data_source, engine, rule, add_rule_cb, remove_rule_cb):
         super(DNSMetadataEntry, self).__init__(data_source, engine, rule)
         
         self.register_callbacks(add_rule_cb, remove_rule_cb)
-        self.data_source.set_new_callback(self.handle_new_entry_callback)
-        if ACTIVE_MAPPING == True:
+
+        # Addresses that rules have been added for, and the cache entry whose
+        # expiry removes them. With a wildcard rule, an address can match
+        # through more than one name. If an address is cached again before
+        # the old entry's expiry is handled, the new entry takes over, so the
+        # late expiry of the old one doesn't remove the rules. The cache calls
+        # back from the ingest and sweep threads, hence the lock.
+        self.addrs = {}            # packed address -> DNSClassifierEntry
+        self.addrs_lock = Lock()
+        self.wildcard = self.rule.startswith('*.')
+        self.stopped = False
+        self.engine.add_domain_rule(self)
+
+        # Seed rules from what's already in the passive cache.
+        for (addr, entry) in self.data_source.find_by_domain(self.rule).items():
+            if not entry.is_expired():
+                self.handle_new_entry_callback(addr, entry)
+
+        # There's nothing to actively look up for a wildcard.
+        if ACTIVE_MAPPING == True and not self.wildcard:
             self._active_timer = None
-            self._active_results = []
+            self._active_results = {}  # record type -> list of addresses
             self._active_get_mapping()
                 
 
+    # addr is the packed address from the DNS cache, either IPv4 or IPv6.
+    # It's only converted to text here, for logging and the OpenFlow matches.
+
+    def shutdown(self):
+        # Unhooks from the cache entries this was following. One that's
+        # expiring right now may still call handle_expiration_callback(),
+        # but with self.addrs empty, that does nothing.
+        self.stopped = True
+        self.engine.remove_domain_rule(self)
+        with self.addrs_lock:
+            for entry in self.addrs.values():
+                entry.unregister_timeout_callback(
+                    self.handle_expiration_callback)
+            self.addrs = {}
+        if ACTIVE_MAPPING == True and not self.wildcard:
+            if self._active_timer is not None:
+                self._active_timer.cancel()
+
     def handle_expiration_callback(self, addr, entry):
-        self.logger.info("DNSMetadataEntry.handle_expiration_callback(): called with " + addr)
         #need to remove the rules that was generated by the particular DNSEntry
-        #TODO
-        self.remove_rule_cb(ipv4_src=str(addr), eth_type=ether.ETH_TYPE_IP)
-        self.remove_rule_cb(ipv4_dst=str(addr), eth_type=ether.ETH_TYPE_IP)
+        with self.addrs_lock:
+            # Nothing to do if another entry for the address has taken over.
+            if self.addrs.get(addr) is not entry:
+                return
+            del self.addrs[addr]
+            text = packed_to_text(addr)
+            self.logger.info("DNSMetadataEntry.handle_expiration_callback(): called with " + text)
+            for match in address_matches(text):
+                self.remove_rule_cb(**match)
 
     def handle_new_entry_callback(self, addr, entry):
-        self.logger.info("DNSMetadataEntry.handle_new_entry_callback(): called with " + addr)
-        for name in entry.names:
-            if name == self.rule:
-                self.add_rule_cb(ipv4_src=str(addr), eth_type=ether.ETH_TYPE_IP)
-                self.add_rule_cb(ipv4_dst=str(addr), eth_type=ether.ETH_TYPE_IP)
-                self.logger.debug("    New rule for " + name)
-                entry.register_timeout_callback(self.handle_expiration_callback)
+        # Only called for entries that match self.rule
+        with self.addrs_lock:
+            if self.stopped:
+                return
+            current = self.addrs.get(addr)
+            if current is entry:
+                return
+            self.addrs[addr] = entry
+            if current is not None:
+                # The new entry has taken over the address.
+                current.unregister_timeout_callback(
+                    self.handle_expiration_callback)
+            else:
+                text = packed_to_text(addr)
+                self.logger.info("DNSMetadataEntry.handle_new_entry_callback(): called with " + text)
+                for match in address_matches(text):
+                    self.add_rule_cb(**match)
+                self.logger.debug("    New rule for " + self.rule)
+            entry.register_timeout_callback(self.handle_expiration_callback)
 
     def _active_get_mapping_expired(self):
         #self.logger.debug("_active_get_mapping_expired() called " + str(self._active_timer.is_alive()))
@@ -105,38 +211,52 @@ class DNSMetadataEntry(MetadataEntry):
         self._active_get_mapping()
 
     def _active_get_mapping(self):
-        # Anly working on A record now
+        # A and AAAA records. The lookup is repeated after the shorter of the
+        # two TTLs, or in 30 seconds if neither lookup worked.
+        if self.stopped:
+            return
         if ((self._active_timer != None) and
             (self._active_timer.is_alive())):
                 return
-        try:
-            results = resolver.query(self.rule, 'A')
-            ttl = results.ttl
+        ttl = None
+        for rdtype in ('A', 'AAAA'):
+            old_results = self._active_results.get(rdtype, [])
+            try:
+                answer = resolver.query(self.rule, rdtype)
+            except exception.Timeout:
+                # Keep what we had, the lookup will be retried.
+                continue
+            except (resolver.NoAnswer, resolver.NXDOMAIN):
+                answer = None
+            if answer is None:
+                results = []
+            else:
+                results = [str(addr) for addr in answer]
+                if ttl is None or answer.ttl < ttl:
+                    ttl = answer.ttl
 
-            self._active_timer = Timer(ttl, self._active_get_mapping_expired)
-            self._active_timer.start()
-            new_active_results = []
-        
             # These two reduce churn: only adds things that weren't there from the 
             # previous pass, only deletes things that aren't there from this pass.
         
             # Add new addresses
             for addr in results:
-                new_active_results.append(addr)
-                if addr not in self._active_results:
-                    print "adding addr: " + str(addr)
-                    self.add_rule_cb(ipv4_src=str(addr), eth_type=ether.ETH_TYPE_IP)
-                    self.add_rule_cb(ipv4_dst=str(addr), eth_type=ether.ETH_TYPE_IP)
+                if addr not in old_results:
+                    print "adding addr: " + addr
+                    for match in address_matches(addr):
+                        self.add_rule_cb(**match)
 
             # Remove old addresses
-            for addr in self._active_results:
+            for addr in old_results:
                 if addr not in results:
-                    self.remove_rule_cb(ipv4_src=str(addr), eth_type=ether.ETH_TYPE_IP)
-                    self.remove_rule_cb(ipv4_dst=str(addr), eth_type=ether.ETH_TYPE_IP)
-            self._active_results = new_active_results
-        except (resolver.NoAnswer, exception.Timeout, resolver.NXDOMAIN):
+                    for match in address_matches(addr):
+                        self.remove_rule_cb(**match)
+            self._active_results[rdtype] = results
+
+        if ttl is None:
             self.logger.info("Could not query for " + self.rule + ". Trying again in 30 seconds.")
-            self._active_timer = Timer(30, self._active_get_mapping_expired)
-            self._active_timer.start()
-            self._active_results = []
+            ttl = 30
+        if self.stopped:
+            return
+        self._active_timer = Timer(ttl, self._active_get_mapping_expired)
+        self._active_timer.start()
         
@@ -0,0 +1,70 @@
+#########################
+# NetAssay Project
+#########################
+
+# Copyright 2015 - Sean Donovan
+
+# Fast path for pulling DNS responses out of packet-ins.
+#
+# The DNS Metadata Engine has a copy of every DNS response sent to the
+# controller. Rather than building a ryu.lib.packet.Packet for each one, the
+# headers are walked by offset: Ethernet, any number of VLAN tags, IPv4 (with
+# options) or IPv6 (with hop-by-hop, routing and destination options headers),
+# then UDP. Anything that isn't UDP from port 53 is turned away as early as
+# possible. So are IPv4 fragments, as they're not reassembled.
+
+import struct
+
+ETH_TYPE_IP = 0x0800
+ETH_TYPE_IPV6 = 0x86dd
+VLAN_ETH_TYPES = (0x8100, 0x88a8, 0x9100)
+IPV6_EXTENSION_HEADERS = (0, 43, 60)
+IPPROTO_UDP = 17
+DNS_PORT = 53
+
+_SHORT_STRUCT = struct.Struct('!H')
+_UDP_STRUCT = struct.Struct('!HHH')
+
+
+def dns_payload(data):
+    """
+    Returns the DNS message in the Ethernet frame data, if it's a UDP packet
+    from port 53. Otherwise returns None.
+    """
+    try:
+        (eth_type,) = _SHORT_STRUCT.unpack_from(data, 12)
+        index = 14
+        while eth_type in VLAN_ETH_TYPES:
+            (eth_type,) = _SHORT_STRUCT.unpack_from(data, index + 2)
+            index += 4
+
+        if eth_type == ETH_TYPE_IP:
+            version_ihl = ord(data[index])
+            if version_ihl >> 4 != 4:
+                return None
+            if ord(data[index + 9]) != IPPROTO_UDP:
+                return None
+            # More fragments flag, or a fragment offset
+            (fragment,) = _SHORT_STRUCT.unpack_from(data, index + 6)
+            if fragment & 0x3fff:
+                return None
+            index += (version_ihl & 0x0f) * 4
+        elif eth_type == ETH_TYPE_IPV6:
+            next_header = ord(data[index + 6])
+            index += 40
+            while next_header in IPV6_EXTENSION_HEADERS:
+                next_header = ord(data[index])
+                index += (ord(data[index + 1]) + 1) * 8
+            if next_header != IPPROTO_UDP:
+                return None
+        else:
+            return None
+
+        (src_port, dst_port, length) = _UDP_STRUCT.unpack_from(data, index)
+    except (IndexError, struct.error):
+        return None
+
+    if src_port != DNS_PORT or length < 8:
+        return None
+    # The UDP length leaves out any Ethernet padding.
+    return data[index + 8 : index + length]
@@ -44,17 +44,39 @@ class MetadataEngine(object):
         # Save off the data source that is used by the MetadataEntrys
         self.data_source = data_source
 
-    def get_forwarding_rule(self):
+    def install_forwarding_rules(self, datapath, table_id, priority,
+                                 next_table, cookie):
         """
-        This gets the default forwarding rules. If there are no forwarding rules,
-        then this need not be defined in the subclasses. 
+        Installs the forwarding rules the ME needs on a datapath, such as
+        copying the traffic it learns from to the controller. This is called
+        by the MCM once for each datapath. The rules go in table_id, with
+        priority and cookie, and should send traffic on to next_table so that
+        it's forwarded as normal.
+
+        If there are no forwarding rules, then this need not be defined in
+        the subclasses.
+        """
+        pass
+
+    def set_green(self, green):
+        """
+        Called by the MCM before any datapaths connect. If green is True, the
+        ME is running under Ryu, and any threads it starts should be green
+        threads from Ryu's hub.
+
+        By default, the ME has no threads of its own, so this does nothing.
+        """
+        pass
+
+    def handle_packet_in(self, msg):
+        """
+        Called by the MCM with every OpenFlow packet-in message. Returns True
+        if the packet was for this ME, which should check msg.cookie against
+        the cookie its forwarding rules were installed with. 
 
-        By default, return identity, so that it can be ignored. returning drop
-        could actually drop traffic.
+        By default, nothing is for the ME.
         """
-#TODO - This is needed for getting DNS data from the switches directly.
-        self.logger.info("get_forwarding_rules(): called")
-        return identity
+        return False
 
     def new_rule(self, rule, add_rule_cb, remove_rule_cb):
         """
@@ -64,8 +86,20 @@ class MetadataEngine(object):
         version.
         """
         self.logger.info("new_rule(): called")
-        self.entries.append(self.entry_type(self.data_source, self, rule,
-                                            add_rule_cb, remove_rule_cb))
+        entry = self.entry_type(self.data_source, self, rule,
+                                add_rule_cb, remove_rule_cb)
+        self.entries.append(entry)
+        return entry
+
+    def remove_rule(self, entry):
+        """
+        Stops a MetadataEntry returned by new_rule(). Its callbacks won't be
+        called again.
+        """
+        self.logger.info("remove_rule(): called")
+        if entry in self.entries:
+            self.entries.remove(entry)
+        entry.shutdown()
 
 
 
@@ -96,4 +130,11 @@ class MetadataEntry(object):
     def register_callbacks(self, add_rule_cb, remove_rule_cb):
         self.add_rule_cb = add_rule_cb
         self.remove_rule_cb = remove_rule_cb
+
+    def shutdown(self):
+        """
+        Called when the rule is removed from the ME. Child classes that
+        register for callbacks or run timers need to stop them here.
+        """
+        pass
     
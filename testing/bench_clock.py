@@ -0,0 +1,56 @@
+# Copyright 2015 - Sean Donovan
+# NetAssay Project
+
+# Micro-benchmark for the per-check cost of the expiry test used by py_timer
+# and DNSClassifierEntry: the old datetime.now()/timedelta arithmetic against
+# the monotonic float time base from py_clock.
+#
+# PYTHONPATH=<netassay-ryu> python bench_clock.py [number of checks]
+
+import sys
+import time
+from datetime import datetime, timedelta
+
+from base.lib.py_clock import monotonic
+from base.me.dns.dnsentry import DNSClassifierEntry
+
+
+def bench_datetime(count):
+    expiry = datetime.now() + timedelta(seconds=3600)
+    start = time.time()
+    for x in xrange(count):
+        expired = expiry < datetime.now()
+        new_expiry = datetime.now() + timedelta(seconds=300)
+    return time.time() - start
+
+def bench_monotonic(count):
+    expiry = monotonic() + 3600
+    start = time.time()
+    for x in xrange(count):
+        expired = expiry < monotonic()
+        new_expiry = monotonic() + 300
+    return time.time() - start
+
+def bench_entry(count):
+    entry = DNSClassifierEntry("10.0.0.1", ["example.com"], "WEB", 3600)
+    start = time.time()
+    for x in xrange(count):
+        entry.is_expired()
+    return time.time() - start
+
+
+def run(count):
+    print "checks:                       %d" % count
+    for (name, bench) in (("datetime.now() + timedelta", bench_datetime),
+                          ("monotonic() float",          bench_monotonic),
+                          ("DNSClassifierEntry.is_expired", bench_entry)):
+        elapsed = bench(count)
+        print "%-30s %.3f s (%.3f us/check)" % (name, elapsed,
+                                                elapsed * 1e6 / count)
+
+
+if __name__ == "__main__":
+    count = 1000000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    run(count)
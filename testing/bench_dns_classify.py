@@ -0,0 +1,90 @@
+# Copyright 2015 - Sean Donovan
+# NetAssay Project
+
+# Throughput benchmark for DNSClassifier.parse_new_DNS(), in packets/sec and
+# records/sec, on synthetic responses with several A records each. Half of the
+# responses are for addresses already in the cache, so both new entries and
+# updates are exercised.
+#
+# Also times building the cache key for an A record on its own: the dotted
+# text key the cache used to use, against the packed rddata it uses now.
+#
+# Requires the updated Ryu DNS library, see vendor-updates/.
+#
+# PYTHONPATH=<netassay-ryu> python bench_dns_classify.py [number of packets]
+
+import random
+import struct
+import sys
+import time
+
+from ryu.lib.packet.dns import dns
+from ryu.lib import addrconv
+from base.me.dns.dnsclassifier.dnsclassify import DNSClassifier
+
+RECORDS_PER_PACKET = 8
+KEYS = 1000000
+
+
+def make_corpus(count):
+    rand = random.Random(53)
+    corpus = []
+    for x in xrange(count):
+        name = "edge%d.cdn%d.example.net" % (x % 50, x % 500)
+        d = dns()
+        d.id = x & 0xffff
+        d.qr = True
+        d.questions.append(dns.question(name, 1, 1))
+        for y in xrange(RECORDS_PER_PACKET):
+            # Reuse addresses from earlier packets half of the time
+            if rand.random() < 0.5:
+                addr = rand.randint(0, count * RECORDS_PER_PACKET / 2)
+            else:
+                addr = rand.getrandbits(24)
+            rddata = struct.pack('!I', 0x0a000000 | addr)
+            d.answers.append(dns.rr(name, 1, 1, 3600, 4, rddata))
+        corpus.append(d.serialize(None, None))
+    return corpus
+
+
+def bench_parse(corpus):
+    classifier = DNSClassifier()
+    start = time.time()
+    for packet in corpus:
+        classifier.parse_new_DNS(packet)
+    elapsed = time.time() - start
+    if classifier.sweep_timer is not None:
+        classifier.sweep_timer.cancel()
+    return (elapsed, len(classifier.db))
+
+def bench_keys(count):
+    rddata = [struct.pack('!I', 0x0a000000 | x) for x in xrange(1000)]
+    results = []
+    for key in (addrconv.ipv4.bin_to_text, lambda x: x):
+        db = {}
+        start = time.time()
+        for x in xrange(count):
+            db[key(rddata[x % 1000])] = x
+        results.append(time.time() - start)
+    return results
+
+
+def run(count):
+    corpus = make_corpus(count)
+    (elapsed, entries) = bench_parse(corpus)
+    print "packets:         %d (%d A records each)" % (count,
+                                                       RECORDS_PER_PACKET)
+    print "cache entries:   %d" % entries
+    print "parse_new_DNS:   %.0f packets/sec, %.0f records/sec" % (
+        count / elapsed, count * RECORDS_PER_PACKET / elapsed)
+
+    (text, packed) = bench_keys(KEYS)
+    print "text key:        %.3f us/record" % (text * 1e6 / KEYS)
+    print "packed key:      %.3f us/record" % (packed * 1e6 / KEYS)
+
+
+if __name__ == "__main__":
+    count = 20000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    run(count)
@@ -0,0 +1,109 @@
+# Copyright 2015 - Sean Donovan
+# NetAssay Project
+
+# Benchmark for the dual-stack DNS cache: checks that adding IPv6 entries to
+# the shared, packed-address database doesn't make IPv4 lookups any slower.
+#
+# Two classifiers are filled with the same IPv4 entries, and the second also
+# gets as many IPv6 entries. A third gets twice as many IPv4 entries instead,
+# to tell the cost of a bigger database apart from the cost of mixing address
+# families. For each, it times:
+#   db lookup     - looking up an IPv4 entry by packed address, as callbacks do
+#   find_by_ip    - the same, by text address
+#   parse_new_DNS - a corpus of A record responses for addresses already
+#                   cached
+#
+# Requires the updated Ryu DNS library, see vendor-updates/.
+#
+# PYTHONPATH=<netassay-ryu> python bench_dns_dualstack.py [number of entries]
+
+import socket
+import struct
+import sys
+import time
+
+from ryu.lib.packet.dns import dns
+from base.me.dns.dnsclassifier.dnsclassify import DNSClassifier
+from base.me.dns.dnsentry import DNSClassifierEntry
+
+LOOKUPS = 500000
+PACKETS = 5000
+
+
+def ipv4(x):
+    return struct.pack('!I', (10 << 24) + x)
+
+def ipv6(x):
+    return '\x20\x01\x0d\xb8' + '\x00' * 8 + struct.pack('!I', x)
+
+def fill(count, extra):
+    # extra is None, or makes the address of each extra entry
+    classifier = DNSClassifier()
+    for x in xrange(count):
+        name = "host%d.example.com" % (x % 10000)
+        classifier._add_entry(DNSClassifierEntry(ipv4(x), [name], 'WEB',
+                                                 3600))
+        if extra is not None:
+            classifier._add_entry(DNSClassifierEntry(extra(x), [name], 'WEB',
+                                                     3600))
+    return classifier
+
+def make_corpus(count):
+    corpus = []
+    for x in xrange(PACKETS):
+        name = "host%d.example.com" % (x % 10000)
+        d = dns()
+        d.id = x & 0xffff
+        d.qr = True
+        d.questions.append(dns.question(name, 1, 1))
+        for y in xrange(4):
+            d.answers.append(dns.rr(name, 1, 1, 3600, 4,
+                                    ipv4((x * 4 + y) % count)))
+        corpus.append(d.serialize(None, None))
+    return corpus
+
+
+def bench(classifier, count, corpus):
+    keys = [ipv4(x % count) for x in xrange(LOOKUPS)]
+    db = classifier.db
+    start = time.time()
+    for key in keys:
+        db.get(key)
+    lookup = time.time() - start
+
+    texts = [socket.inet_ntoa(key) for key in keys[:LOOKUPS / 10]]
+    start = time.time()
+    for text in texts:
+        classifier.find_by_ip(text)
+    find = time.time() - start
+
+    start = time.time()
+    for packet in corpus:
+        classifier.parse_new_DNS(packet)
+    parse = time.time() - start
+
+    classifier.sweep_timer.cancel()
+    return (lookup * 1e6 / len(keys), find * 1e6 / len(texts),
+            parse * 1e6 / len(corpus))
+
+
+def run(count):
+    corpus = make_corpus(count)
+    print "IPv4 entries:   %d" % count
+    print "%-14s %10s %12s %16s" % ("", "db lookup", "find_by_ip",
+                                    "parse_new_DNS")
+    for (label, extra) in (("IPv4 only", None),
+                           ("dual stack", ipv6),
+                           ("IPv4 only x2", lambda x: ipv4(count + x))):
+        classifier = fill(count, extra)
+        (lookup, find, parse) = bench(classifier, count, corpus)
+        print "%-14s %7.3f us %9.3f us %10.1f us/pkt" % (label, lookup, find,
+                                                         parse)
+        del classifier
+
+
+if __name__ == "__main__":
+    count = 200000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    run(count)
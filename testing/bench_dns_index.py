@@ -0,0 +1,63 @@
+# Copyright 2015 - Sean Donovan
+# NetAssay Project
+
+# Benchmark for the DNSClassifier secondary indexes: fills the passive cache
+# with a large number of records, then times find_by_name() and
+# find_by_classification(), which used to scan every record.
+#
+# PYTHONPATH=<netassay-ryu> python bench_dns_index.py [number of records]
+
+import struct
+import sys
+import time
+
+from base.me.dns.dnsclassifier.dnsclassify import DNSClassifier
+from base.me.dns.dnsentry import DNSClassifierEntry
+
+NAMES = 100000
+CLASSIFICATIONS = ['WEB', 'VIDEO', 'ADVERT', 'BACKGROUND', 'DEFAULT']
+LOOKUPS = 10000
+
+
+def ip_packed(x):
+    return struct.pack('!I', (10 << 24) + x)
+
+def run(count):
+    classifier = DNSClassifier()
+
+    start = time.time()
+    for x in xrange(count):
+        name = "host%d.example.com" % (x % NAMES)
+        classification = CLASSIFICATIONS[x % len(CLASSIFICATIONS)]
+        classifier._add_entry(DNSClassifierEntry(ip_packed(x), [name],
+                                                 classification, 3600))
+    fill_time = time.time() - start
+
+    start = time.time()
+    found = 0
+    for x in xrange(LOOKUPS):
+        found += len(classifier.find_by_name("host%d.example.com" %
+                                             (x % NAMES)))
+    name_time = time.time() - start
+
+    start = time.time()
+    classification = classifier.find_by_classification('VIDEO')
+    class_time = time.time() - start
+
+    # Don't leave the sweep timer running.
+    classifier.sweep_timer.cancel()
+
+    print "records:                  %d" % count
+    print "fill:                     %.3f s (%.2f us/record)" % (
+        fill_time, fill_time * 1e6 / count)
+    print "find_by_name:             %.2f us/lookup (%d matches)" % (
+        name_time * 1e6 / LOOKUPS, found)
+    print "find_by_classification:   %.3f s (%d matches)" % (
+        class_time, len(classification))
+
+
+if __name__ == "__main__":
+    count = 1000000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    run(count)
@@ -0,0 +1,104 @@
+# Copyright 2015 - Sean Donovan
+# NetAssay Project
+
+# Benchmark for the DNS ingest stage in base/me/dns/dnsingest.py, against
+# calling DNSClassifier.parse_new_DNS() inline on the OpenFlow event loop.
+#
+# Each response in the corpus is seen DUPLICATES times, as if copied to the
+# controller by several switches. It times:
+#   inline   - parse_new_DNS() on every payload, as the event loop used to
+#   submit   - the cost of DNSIngest.submit() on the event loop
+#   drain    - from the first submit until the workers have applied everything
+# and reports how many payloads were dropped with a small queue.
+#
+# Requires the updated Ryu DNS library, see vendor-updates/.
+#
+# PYTHONPATH=<netassay-ryu> python bench_dns_ingest.py [number of responses]
+
+import struct
+import sys
+import time
+
+from ryu.lib.packet.dns import dns
+from base.me.dns.dnsclassifier.dnsclassify import DNSClassifier
+from base.me.dns.dnsingest import DNSIngest
+
+RECORDS_PER_PACKET = 4
+DUPLICATES = 3
+SMALL_QUEUE = 1000
+
+
+def make_corpus(count):
+    corpus = []
+    for x in xrange(count):
+        name = "host%d.example.com" % (x % 1000)
+        d = dns()
+        d.id = x & 0xffff
+        d.qr = True
+        d.questions.append(dns.question(name, 1, 1))
+        for y in xrange(RECORDS_PER_PACKET):
+            rddata = struct.pack('!I', 0x0a000000 | (x * RECORDS_PER_PACKET + y))
+            d.answers.append(dns.rr(name, 1, 1, 3600, 4, rddata))
+        packet = d.serialize(None, None)
+        corpus.extend([packet] * DUPLICATES)
+    return corpus
+
+
+def stop(classifier):
+    if classifier.sweep_timer is not None:
+        classifier.sweep_timer.cancel()
+
+def bench_inline(corpus):
+    classifier = DNSClassifier()
+    start = time.time()
+    for packet in corpus:
+        classifier.parse_new_DNS(packet)
+    elapsed = time.time() - start
+    stop(classifier)
+    return (elapsed, len(classifier.db))
+
+def bench_ingest(corpus, max_queue):
+    classifier = DNSClassifier()
+    ingest = DNSIngest(classifier, max_queue=max_queue)
+    ingest.start()
+    start = time.time()
+    for packet in corpus:
+        ingest.submit(packet)
+    submitted = time.time() - start
+    while True:
+        stats = ingest.stats()
+        if stats['queue_depth'] == 0 and (stats['parsed'] + stats['duplicates']
+                                          + stats['dropped'] ==
+                                          stats['received']):
+            break
+        time.sleep(0.001)
+    drained = time.time() - start
+    stop(classifier)
+    return (submitted, drained, len(classifier.db), stats)
+
+
+def run(count):
+    corpus = make_corpus(count)
+    print "payloads:        %d (%d responses x %d copies)" % (len(corpus),
+                                                             count, DUPLICATES)
+    (elapsed, entries) = bench_inline(corpus)
+    print "inline:          %.3f us/payload, %d entries" % (
+        elapsed * 1e6 / len(corpus), entries)
+
+    for max_queue in (len(corpus), SMALL_QUEUE):
+        (submitted, drained, entries, stats) = bench_ingest(corpus, max_queue)
+        print "queue of %d:" % max_queue
+        print "  submit:        %.3f us/payload" % (submitted * 1e6 /
+                                                    len(corpus))
+        print "  drain:         %.3f us/payload, %d entries" % (
+            drained * 1e6 / len(corpus), entries)
+        print "  batches:       %d (largest %d), %d duplicates, %d dropped" % (
+            stats['batches'], stats['max_batch'], stats['duplicates'],
+            stats['dropped'])
+
+
+if __name__ == "__main__":
+    count = 10000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    run(count)
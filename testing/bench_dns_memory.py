@@ -0,0 +1,121 @@
+# Copyright 2015 - Sean Donovan
+# NetAssay Project
+
+# Memory benchmark for the DNS cache, reporting bytes per cached record.
+#
+# Each run builds a dictionary of entries keyed by IP address, with names
+# drawn from a pool of domains. Every name is built afresh, as it would be
+# when decoded from a packet. The runs are:
+#   dict entry    - a dict-backed entry with a callback list, like
+#                   DNSClassifierEntry used to be
+#   slots entry   - DNSClassifierEntry, keyed by packed address
+#   DNSClassifier - DNSClassifierEntry plus the classifier's name,
+#                   classification and expiry indexes
+#   dns.rr        - parsed A records, for reference
+#
+# Memory is the growth in resident set size of a child process per run.
+#
+# PYTHONPATH=<netassay-ryu> python bench_dns_memory.py [number of records]
+
+import gc
+import os
+import resource
+import struct
+import sys
+
+from ryu.lib.packet.dns import dns
+from base.me.dns.dnsentry import DNSClassifierEntry
+from base.me.dns.dnsclassifier.dnsclassify import DNSClassifier
+from base.lib.py_clock import monotonic
+
+DOMAINS = 5000
+CLASSES = ['WEB', 'VIDEO', 'ADVERT', 'BACKGROUND', '']
+
+
+class dict_entry:
+    def __init__(self, IP, names, classification, ttl):
+        self.IP = IP
+        self.names = names
+        self.classification = classification
+        self.ttl = ttl
+        self.expiry = monotonic() + ttl
+        self.timeout_callbacks = []
+
+
+def rss():
+    try:
+        f = open('/proc/self/statm')
+        pages = int(f.read().split()[1])
+        f.close()
+        return pages * resource.getpagesize()
+    except IOError:
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def address(x):
+    return "10.%d.%d.%d" % ((x >> 16) & 0xff, (x >> 8) & 0xff, x & 0xff)
+
+def packed_address(x):
+    return struct.pack('!I', (10 << 24) + x)
+
+def name(x):
+    # A new string each time, as if it had come out of a packet
+    return "host%d.example%d.com" % (x % 7, x % DOMAINS)
+
+def fill_entries(count, entry_class, make_address):
+    db = {}
+    for x in xrange(count):
+        addr = make_address(x)
+        db[addr] = entry_class(addr, [name(x)], CLASSES[x % len(CLASSES)], 300)
+    return db
+
+def fill_classifier(count):
+    classifier = DNSClassifier()
+    for x in xrange(count):
+        entry = DNSClassifierEntry(packed_address(x), [name(x)],
+                                   CLASSES[x % len(CLASSES)], 300)
+        classifier._add_entry(entry)
+    classifier.sweep_timer.cancel()
+    return classifier
+
+def fill_rrs(count):
+    rrs = []
+    for x in xrange(count):
+        rrs.append(dns.rr(name(x), 1, 1, 300, 4, struct.pack('!I', x)))
+    return rrs
+
+
+def measure(label, fill, count):
+    # In a child process, so that no run reuses memory freed by another
+    pid = os.fork()
+    if pid != 0:
+        os.waitpid(pid, 0)
+        return
+    gc.collect()
+    gc.disable()
+    before = rss()
+    result = fill(count)
+    after = rss()
+    print "%-16s %6.1f bytes/record" % (label, float(after - before) / count)
+    sys.stdout.flush()
+    os._exit(0)
+
+
+def run(count):
+    print "records:         %d" % count
+    sys.stdout.flush()
+    for (label, fill) in (("dict entry",
+                           lambda n: fill_entries(n, dict_entry, address)),
+                          ("slots entry",
+                           lambda n: fill_entries(n, DNSClassifierEntry,
+                                                  packed_address)),
+                          ("DNSClassifier", fill_classifier),
+                          ("dns.rr", fill_rrs)):
+        measure(label, fill, count)
+
+
+if __name__ == "__main__":
+    count = 200000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    run(count)
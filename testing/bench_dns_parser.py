@@ -0,0 +1,124 @@
+# Copyright 2015 - Sean Donovan
+# NetAssay Project
+
+# Parse throughput benchmark for the DNS parser, in packets/sec, comparing
+# dns.parser() against dns.lazy_parser(). Each run only looks at the name and
+# address of A records. The filtered lazy run also parses the way the DNS
+# classifier does: only A, AAAA and CNAME records in the answer and additional
+# sections are built, and only NOERROR responses are parsed past the header.
+#
+# The corpus is the DNS payload of every UDP source port 53 packet in a pcap
+# capture (Ethernet, IPv4 or IPv6, no IP options or extension headers). If no
+# capture is given, a synthetic corpus of CDN-style responses is used.
+#
+# Requires the updated Ryu DNS library, see vendor-updates/.
+#
+# PYTHONPATH=<netassay-ryu> python bench_dns_parser.py [capture.pcap]
+
+import random
+import struct
+import sys
+import time
+
+from ryu.lib.packet.dns import dns
+from ryu.lib import addrconv
+
+ROUNDS = 20000
+FILTER_QTYPES = frozenset([dns.rr.A_TYPE, dns.rr.AAAA_TYPE, dns.rr.CNAME_TYPE])
+FILTER_SECTIONS = frozenset(['answers', 'additional'])
+
+
+def load_pcap(filename):
+    f = open(filename, 'rb')
+    data = f.read()
+    f.close()
+
+    magic = struct.unpack('<I', data[:4])[0]
+    if magic == 0xa1b2c3d4:
+        endian = '<'
+    else:
+        endian = '>'
+
+    corpus = []
+    index = 24
+    while index + 16 <= len(data):
+        (sec, usec, caplen, origlen) = struct.unpack(endian + 'IIII',
+                                                     data[index:index + 16])
+        index += 16
+        frame = data[index:index + caplen]
+        index += caplen
+
+        ethertype = struct.unpack('!H', frame[12:14])[0]
+        if ethertype == 0x0800:
+            proto = ord(frame[23])
+            udp = 14 + (ord(frame[14]) & 0x0f) * 4
+        elif ethertype == 0x86dd:
+            proto = ord(frame[20])
+            udp = 14 + 40
+        else:
+            continue
+        if proto != 17 or struct.unpack('!H', frame[udp:udp + 2])[0] != 53:
+            continue
+        corpus.append(frame[udp + 8:])
+    return corpus
+
+def synthetic_corpus(count=200):
+    rand = random.Random(1)
+    corpus = []
+    for x in xrange(count):
+        name = "www.site%d.com" % x
+        cdn = "e%d.a.cdn%d.net" % (x, rand.randint(0, 9))
+        msg = dns()
+        msg.id = x
+        msg.qr = True
+        msg.rd = True
+        msg.ra = True
+        msg.questions.append(dns.question(name, 1, 1))
+        msg.answers.append(dns.rr(name, 5, 1, 300, 0, cdn))
+        for y in xrange(rand.randint(1, 4)):
+            addr = "%d.%d.%d.%d" % (rand.randint(1, 223), rand.randint(0, 255),
+                                    rand.randint(0, 255), rand.randint(1, 254))
+            msg.answers.append(dns.rr(cdn, 1, 1, 20, 4,
+                                      addrconv.ipv4.text_to_bin(addr)))
+        for y in xrange(2):
+            msg.authorities.append(dns.rr("a.cdn.net", 2, 1, 3600, 0,
+                                          "ns%d.a.cdn.net" % y))
+            msg.additional.append(dns.rr("ns%d.a.cdn.net" % y, 1, 1, 3600, 4,
+                                         addrconv.ipv4.text_to_bin(
+                                             "192.0.2.%d" % (y + 1))))
+        corpus.append(msg.serialize(None, None))
+    return corpus
+
+def bench(corpus, parse):
+    count = 0
+    start = time.time()
+    while count < ROUNDS:
+        for packet in corpus:
+            parsed = parse(packet)
+            for r in parsed.answers + parsed.additional:
+                if r.qtype == dns.rr.A_TYPE:
+                    r.name
+                    r.rddata
+            count += 1
+    return count / (time.time() - start)
+
+
+def filtered(packet):
+    return dns.lazy_parser(packet, qtypes=FILTER_QTYPES,
+                           sections=FILTER_SECTIONS,
+                           noerror_responses_only=True)
+
+def run(corpus):
+    print "corpus:                %d packets" % len(corpus)
+    print "parser:                %.0f packets/sec" % bench(corpus, dns.parser)
+    print "lazy_parser:           %.0f packets/sec" % bench(corpus,
+                                                            dns.lazy_parser)
+    print "lazy_parser, filtered: %.0f packets/sec" % bench(corpus, filtered)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        corpus = load_pcap(sys.argv[1])
+    else:
+        corpus = synthetic_corpus()
+    run(corpus)
@@ -0,0 +1,185 @@
+# Copyright 2015 - Sean Donovan
+# NetAssay Project
+
+# Round-trip fuzz test and benchmark for dns.serialize().
+#
+# Random messages are built from a small pool of names, so that there's plenty
+# of compression, and serialized with both dns.serialize() and the old
+# string-based serializer kept below. The two must be byte-identical, and the
+# output must parse back to the same message. Then both serializers are timed
+# on messages of increasing size.
+#
+# Requires the updated Ryu DNS library, see vendor-updates/.
+#
+# PYTHONPATH=<netassay-ryu> python bench_dns_serialize.py [number of messages]
+
+import random
+import struct
+import sys
+import time
+
+from ryu.lib.packet.dns import dns, makeName
+
+A_TYPE = 1
+NS_TYPE = 2
+CNAME_TYPE = 5
+PTR_TYPE = 12
+TXT_TYPE = 16
+AAAA_TYPE = 28
+
+DOMAINS = ['example.com', 'example.net', 'cdn.example.net', 'googlevideo.com',
+           'r3.sn-abc.googlevideo.com', 'akamaiedge.net', 'in-addr.arpa']
+HOSTS = ['www', 'ns1', 'ns2', 'mail', 'a', 'edge-12', 'static']
+
+
+# The old serializer, from before serialize() used a bytearray and a suffix
+# map.
+def old_putName (s, name, name_map):
+    pre = ''
+    post = name
+    while True:
+        at = s.find(makeName(post, True))
+        if at == -1:
+            if post in name_map:
+                at = name_map[post]
+        if at == -1:
+            post = post.split('.', 1)
+            if pre: pre += '.'
+            pre += post[0]
+            if len(post) == 1:
+                if len(pre) == 0:
+                    s += '\x00'
+                else:
+                    name_map[name] = len(s)
+                    s += makeName(pre, True)
+                break
+            post = post[1]
+        else:
+            if len(pre) > 0:
+                name_map[name] = len(s)
+                s += makeName(pre, False)
+            s += struct.pack("!H", at | 0xc000)
+            break
+    return s
+
+def old_putData (s, r, name_map):
+    if r.qtype in (2,12,5,15):
+        return old_putName(s, r.rddata, name_map)
+    else:
+        return s + r.rddata
+
+def old_serialize(d):
+    bits0 = 0
+    if d.qr: bits0 |= 0x80
+    bits0 |= (d.opcode & 0x7) << 4
+    if d.rd: bits0 |= 1
+    bits1 = (d.rcode & 0xf)
+    if d.ra: bits1 |= 0x80
+
+    s = struct.pack("!HBBHHHH", d.id, bits0, bits1,
+                    len(d.questions), len(d.answers),
+                    len(d.authorities), len(d.additional))
+    name_map = {}
+    for r in d.questions:
+        s = old_putName(s, r.name, name_map)
+        s += struct.pack("!HH", r.qtype, r.qclass)
+    for r in d.answers + d.authorities + d.additional:
+        s = old_putName(s, r.name, name_map)
+        s += struct.pack("!HHIH", r.qtype, r.qclass, r.ttl, 0)
+        fixup = len(s) - 2
+        s = old_putData(s, r, name_map)
+        fixlen = len(s) - fixup - 2
+        s = s[:fixup] + struct.pack('!H', fixlen) + s[fixup+2:]
+    return s
+
+
+def random_name(rand):
+    name = rand.choice(DOMAINS)
+    for x in xrange(rand.randint(0, 2)):
+        name = rand.choice(HOSTS) + '.' + name
+    return name
+
+def random_rr(rand):
+    # No MX records: serialize() doesn't write the preference, but the parser
+    # skips over it, so they don't round trip.
+    qtype = rand.choice((A_TYPE, A_TYPE, A_TYPE, NS_TYPE, CNAME_TYPE,
+                         PTR_TYPE, AAAA_TYPE, TXT_TYPE))
+    if qtype == A_TYPE:
+        rddata = struct.pack('!I', rand.getrandbits(32))
+    elif qtype == AAAA_TYPE:
+        rddata = ''.join(chr(rand.getrandbits(8)) for x in xrange(16))
+    elif qtype == TXT_TYPE:
+        text = 'v=spf1 include:%s ~all' % rand.choice(DOMAINS)
+        rddata = chr(len(text)) + text
+    else:
+        rddata = random_name(rand)
+    return dns.rr(random_name(rand), qtype, 1, rand.randint(0, 86400),
+                  len(rddata), rddata)
+
+def random_message(rand, records):
+    d = dns()
+    d.id = rand.getrandbits(16)
+    d.qr = True
+    d.rd = True
+    d.ra = True
+    d.questions.append(dns.question(random_name(rand), A_TYPE, 1))
+    for x in xrange(records):
+        rand.choice((d.answers, d.answers, d.authorities,
+                     d.additional)).append(random_rr(rand))
+    return d
+
+
+def same_message(a, b):
+    if (len(a.questions), len(a.answers), len(a.authorities),
+        len(a.additional)) != (len(b.questions), len(b.answers),
+                               len(b.authorities), len(b.additional)):
+        return False
+    for (r, s) in zip(a.questions, b.questions):
+        if (r.name, r.qtype, r.qclass) != (s.name, s.qtype, s.qclass):
+            return False
+    for (r, s) in zip(a.answers + a.authorities + a.additional,
+                      b.answers + b.authorities + b.additional):
+        if ((r.name, r.qtype, r.qclass, r.ttl, r.rddata) !=
+            (s.name, s.qtype, s.qclass, s.ttl, s.rddata)):
+            return False
+    return True
+
+
+def fuzz(count):
+    rand = random.Random(53)
+    mismatches = 0
+    bad_round_trips = 0
+    for x in xrange(count):
+        d = random_message(rand, rand.randint(0, 40))
+        buf = d.serialize(None, None)
+        if buf != old_serialize(d):
+            mismatches += 1
+        parsed = dns.parser(buf)
+        if parsed is None or not same_message(d, parsed):
+            bad_round_trips += 1
+    print "fuzzed messages:      %d" % count
+    print "differ from old:      %d" % mismatches
+    print "bad round trips:      %d" % bad_round_trips
+
+
+def bench():
+    rand = random.Random(1)
+    for records in (10, 50, 200, 800):
+        d = random_message(rand, records)
+        rounds = max(1, 4000 / records)
+        results = []
+        for serialize in (old_serialize, lambda m: m.serialize(None, None)):
+            start = time.time()
+            for x in xrange(rounds):
+                serialize(d)
+            results.append((time.time() - start) * 1e3 / rounds)
+        print "%4d records:  old %8.3f ms  new %8.3f ms  (%.1fx)" % (
+            records, results[0], results[1], results[0] / results[1])
+
+
+if __name__ == "__main__":
+    count = 2000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    fuzz(count)
+    bench()
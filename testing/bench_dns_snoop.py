@@ -0,0 +1,86 @@
+# Copyright 2015 - Sean Donovan
+# NetAssay Project
+
+# Benchmark for the packet-in fast path in base/me/dns/dnssnoop.py, which
+# finds the DNS payload of a frame by offset, against building a full
+# ryu.lib.packet.Packet and asking it for the UDP header.
+#
+# The frames are DNS responses over untagged IPv4, VLAN-tagged IPv4 and IPv6,
+# plus a DNS query that has to be turned away.
+#
+# PYTHONPATH=<netassay-ryu> python bench_dns_snoop.py [number of frames]
+
+import struct
+import sys
+import time
+
+from base.me.dns.dnssnoop import dns_payload
+
+try:
+    from ryu.lib.packet import packet, udp
+except ImportError:
+    packet = None
+
+
+def make_frames():
+    # A response for example.com with one A record
+    payload = (struct.pack('!HBBHHHH', 1, 0x81, 0x80, 1, 1, 0, 0) +
+               '\x07example\x03com\x00' + struct.pack('!HH', 1, 1) +
+               '\xc0\x0c' + struct.pack('!HHIH', 1, 1, 300, 4) +
+               '\x5d\xb8\xd8\x22')
+
+    def udp_header(src, dst):
+        return struct.pack('!HHHH', src, dst, 8 + len(payload), 0)
+
+    def ipv4(segment):
+        return struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(segment), 0,
+                           0x4000, 64, 17, 0, '\x0a\x00\x00\x01',
+                           '\x0a\x00\x00\x02') + segment
+
+    def ipv6(segment):
+        return struct.pack('!IHBB16s16s', 6 << 28, len(segment), 17, 64,
+                           '\x20\x01\x0d\xb8' + '\x00' * 11 + '\x01',
+                           '\x20\x01\x0d\xb8' + '\x00' * 11 + '\x02') + segment
+
+    macs = '\x02\x00\x00\x00\x00\x01\x02\x00\x00\x00\x00\x02'
+    response = udp_header(53, 33000) + payload
+    query = udp_header(33000, 53) + payload
+    return [macs + '\x08\x00' + ipv4(response),
+            macs + '\x81\x00\x00\x05\x08\x00' + ipv4(response),
+            macs + '\x86\xdd' + ipv6(response),
+            macs + '\x08\x00' + ipv4(query)]
+
+
+def fast_path(frame):
+    return dns_payload(frame)
+
+def full_parse(frame):
+    pkt = packet.Packet(frame)
+    header = pkt.get_protocol(udp.udp)
+    if header is None or header.src_port != 53:
+        return None
+    return pkt.protocols[-1]
+
+
+def run(count):
+    frames = make_frames()
+    print "frames:          %d" % count
+    benches = [("dnssnoop", fast_path)]
+    if packet is not None:
+        benches.append(("ryu Packet", full_parse))
+    else:
+        print "(ryu.lib.packet not available, skipping the full parse)"
+
+    for (label, parse) in benches:
+        start = time.time()
+        for x in xrange(count):
+            parse(frames[x % len(frames)])
+        elapsed = time.time() - start
+        print "%-16s %.3f us/frame" % (label, elapsed * 1e6 / count)
+
+
+if __name__ == "__main__":
+    count = 200000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    run(count)
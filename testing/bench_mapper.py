@@ -0,0 +1,97 @@
+# Copyright 2015 - Sean Donovan
+# NetAssay Project
+
+# Benchmark for Mapper.searchType(): the compiled matcher against the original
+# loop of one re.search() per service definition, with a few thousand
+# generated service definitions.
+#
+# PYTHONPATH=<netassay-ryu> python bench_mapper.py [number of patterns]
+
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+from base.me.dns.dnsclassifier.mapper import Mapper
+
+SERVICES = ['ADVERT', 'BACKGROUND', 'VIDEO', 'WEB']
+SEARCHES = 2000
+LOOP_SEARCHES = 20
+
+
+def search_type_loop(mapper, dnsname):
+    # Mapper.searchType() before the patterns were compiled together.
+    mapper.createTypePoll()
+    for name, service in mapper.name_to_service.items():
+        found = re.search(name, dnsname)
+        if found is not None:
+            mapper.types_poll[service] += 1
+    return max(mapper.types_poll, key=mapper.types_poll.get)
+
+def build_mapper(count):
+    # Mostly '*.domain' suffixes, with some patterns that aren't, like the ones
+    # in servicedef/adverts.ini
+    rand = random.Random(1)
+    mapper = Mapper()
+    for service in SERVICES:
+        (fd, filename) = tempfile.mkstemp(suffix='.ini')
+        f = os.fdopen(fd, 'w')
+        for x in xrange(count / len(SERVICES)):
+            n = rand.randint(0, count)
+            if x % 10 == 0:
+                f.write("*.%s%d.*\n" % (service.lower(), n))
+            else:
+                f.write("*.%s%d.com\n" % (service.lower(), n))
+        f.close()
+        mapper.loadFile(filename, service)
+        os.remove(filename)
+    return mapper
+
+def build_names(count):
+    rand = random.Random(2)
+    names = []
+    for x in xrange(SEARCHES):
+        service = rand.choice(SERVICES).lower()
+        names.append("host%d.%s%d.com" % (x, service, rand.randint(0, count)))
+    return names
+
+def time_search(search, names):
+    start = time.time()
+    for name in names:
+        search(name)
+    return time.time() - start
+
+
+def run(count):
+    mapper = build_mapper(count)
+    names = build_names(count)
+
+    start = time.time()
+    mapper.searchType(names[0])
+    compile_time = time.time() - start
+
+    compiled_time = time_search(mapper.searchType, names)
+    # The loop is very slow (re's cache only holds 100 patterns, so every
+    # re.search() recompiles), only run it on a sample.
+    sample = names[:LOOP_SEARCHES]
+    loop_time = time_search(lambda n: search_type_loop(mapper, n), sample)
+
+    mismatches = 0
+    for name in sample:
+        if mapper.searchType(name) != search_type_loop(mapper, name):
+            mismatches += 1
+
+    print "patterns:         %d" % len(mapper.name_to_service)
+    print "compile:          %.3f s" % compile_time
+    print "re.search loop:   %.2f us/name" % (loop_time * 1e6 / len(sample))
+    print "compiled matcher: %.2f us/name" % (compiled_time * 1e6 / len(names))
+    print "mismatches:       %d of %d" % (mismatches, len(sample))
+
+
+if __name__ == "__main__":
+    count = 4000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    run(count)
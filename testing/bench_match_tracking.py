@@ -0,0 +1,89 @@
+# Copyright 2015 - Sean Donovan
+# NetAssay Project
+
+# Benchmark for the tracker lookups in NetAssayMatchAction.add_rule() and
+# remove_rule(), as the number of trackers grows. Each op is what add_rule()
+# does for a rule that's already installed: build the key from the match
+# kwargs, look up the tracker, and bump its count.
+#   match_key  - a match_key (base/match_tracking.py) and a dict lookup
+#   str keys   - str(kwargs) and a membership check on trackers.keys(), as
+#                add_rule() used to. This is O(n), so it's only run for the
+#                smaller sizes.
+#
+# PYTHONPATH=<netassay-ryu> python bench_match_tracking.py [max trackers]
+
+import socket
+import struct
+import sys
+import time
+
+from base.match_tracking import match_key
+
+OPS = 100000
+STR_KEYS_MAX = 10000
+
+
+class tracker(object):
+    def __init__(self):
+        self.count = 1
+
+def matches(count):
+    # Half source and half destination rules, as the DNS ME adds
+    result = []
+    for x in xrange(count):
+        addr = socket.inet_ntoa(struct.pack('!I', (10 << 24) + x / 2))
+        if x % 2 == 0:
+            result.append({'ipv4_src' : addr, 'eth_type' : 0x0800})
+        else:
+            result.append({'ipv4_dst' : addr, 'eth_type' : 0x0800})
+    return result
+
+
+def bench_match_key(kwargs_list, ops):
+    trackers = {}
+    for kwargs in kwargs_list:
+        trackers[match_key(kwargs)] = tracker()
+    count = len(kwargs_list)
+    start = time.time()
+    for x in xrange(ops):
+        key = match_key(kwargs_list[(x * 7919) % count])
+        t = trackers.get(key)
+        if t is not None:
+            t.count += 1
+    return (time.time() - start) * 1e6 / ops
+
+def bench_str_keys(kwargs_list, ops):
+    trackers = {}
+    for kwargs in kwargs_list:
+        trackers[str(kwargs)] = tracker()
+    count = len(kwargs_list)
+    start = time.time()
+    for x in xrange(ops):
+        strval = str(kwargs_list[(x * 7919) % count])
+        if strval in trackers.keys():
+            trackers[strval].count += 1
+    return (time.time() - start) * 1e6 / ops
+
+
+def run(max_trackers):
+    print "%-10s %14s %14s" % ("trackers", "match_key", "str keys")
+    size = 1000
+    while size <= max_trackers:
+        kwargs_list = matches(size)
+        keyed = bench_match_key(kwargs_list, OPS)
+        if size <= STR_KEYS_MAX:
+            # Fewer ops, as each one walks the whole key list.
+            ops = max(100, OPS * 100 / size)
+            stringed = "%8.3f us/op" % bench_str_keys(kwargs_list, ops)
+        else:
+            stringed = "%14s" % "-"
+        print "%-10d %8.3f us/op %s" % (size, keyed, stringed)
+        del kwargs_list
+        size *= 10
+
+
+if __name__ == "__main__":
+    max_trackers = 1000000
+    if len(sys.argv) > 1:
+        max_trackers = int(sys.argv[1])
+    run(max_trackers)
@@ -0,0 +1,53 @@
+# Copyright 2015 - Sean Donovan
+# NetAssay Project
+
+# Benchmark for the py_timer manager: schedules and cancels a large number of
+# timers and reports the per-operation cost.
+#
+# Timers are scheduled far in the future so that none of them fire during the
+# run.
+#
+# PYTHONPATH=<netassay-ryu> python bench_py_timer.py [number of timers]
+
+import random
+import sys
+import time
+
+from base.lib.py_timer import py_timer as Timer
+
+
+def noop():
+    pass
+
+
+def run(count):
+    rand = random.Random(1)
+    intervals = [3600 + rand.random() * 3600 for x in xrange(count)]
+
+    start = time.time()
+    timers = []
+    for interval in intervals:
+        t = Timer(interval, noop)
+        t.start()
+        timers.append(t)
+    schedule_time = time.time() - start
+
+    rand.shuffle(timers)
+
+    start = time.time()
+    for t in timers:
+        t.cancel()
+    cancel_time = time.time() - start
+
+    print "timers:   %d" % count
+    print "schedule: %.3f s (%.2f us/op)" % (schedule_time,
+                                             schedule_time * 1e6 / count)
+    print "cancel:   %.3f s (%.2f us/op)" % (cancel_time,
+                                             cancel_time * 1e6 / count)
+
+
+if __name__ == "__main__":
+    count = 1000000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    run(count)
@@ -11,12 +11,19 @@ from ryu.lib.packet import packet
 from ryu.lib.packet import ethernet
 from base.mcm import *
 
+# DNS responses are copied to the controller from SNOOP_TABLE, and everything
+# then goes on to FORWARDING_TABLE.
+SNOOP_TABLE = 0
+FORWARDING_TABLE = 1
+
 class Diamond(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
 
     def __init__(self, *args, **kwargs):
         super(Diamond, self).__init__(*args, **kwargs)
-        self.mcm = NetAssayMCM()
+        self.mcm = NetAssayMCM(snoop_table=SNOOP_TABLE,
+                               snoop_next_table=FORWARDING_TABLE,
+                               green=True)
         self.NAMAs = []
         print "__init__() complete."
 
@@ -40,6 +47,7 @@ class Diamond(app_manager.RyuApp):
 #        self.add_flow(datapath, 0, match, actions)
 
         print "Datapath ID: " + str(datapath.id)
+        self.mcm.register_datapath(datapath)
         if(datapath.id == 3 or datapath.id == 4):
             match = parser.OFPMatch()
             actions = [parser.OFPActionOutput(ofproto.OFPP_FLOOD)]
@@ -58,9 +66,23 @@ class Diamond(app_manager.RyuApp):
             actions = [parser.OFPActionOutput(2)]
 #            NetAssayMatchAction(datapath, match, action)
             self.NAMAs.append(NetAssayMatchAction(datapath, match, 
-                                                  actions, priority=0))
+                                                  actions, priority=0,
+                                                  table=FORWARDING_TABLE))
+
+    @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
+    def packet_in_handler(self, ev):
+        self.mcm.packet_in_handler(ev)
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, MAIN_DISPATCHER)
+    def barrier_reply_handler(self, ev):
+        self.mcm.barrier_reply_handler(ev)
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def flow_stats_reply_handler(self, ev):
+        self.mcm.flow_stats_reply_handler(ev)
 
-    def add_flow(self, datapath, priority, match, actions, buffer_id=None):
+    def add_flow(self, datapath, priority, match, actions, buffer_id=None,
+                 table_id=FORWARDING_TABLE):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
@@ -75,8 +97,9 @@ class Diamond(app_manager.RyuApp):
         if buffer_id:
             mod = parser.OFPFlowMod(datapath=datapath, buffer_id=buffer_id,
                                     priority=priority, match=match,
-                                    instructions=inst)
+                                    instructions=inst, table_id=table_id)
         else:
             mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
-                                    match=match, instructions=inst)
+                                    match=match, instructions=inst,
+                                    table_id=table_id)
         datapath.send_msg(mod)
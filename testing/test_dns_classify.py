@@ -0,0 +1,104 @@
+# Copyright 2015 - Sean Donovan
+# NetAssay Project
+
+# Unit tests for DNSClassifier, fed real serialized DNS responses.
+#
+# Requires the updated Ryu DNS library, see vendor-updates/.
+#
+# PYTHONPATH=<netassay-ryu> python test_dns_classify.py
+
+import socket
+import unittest
+
+from ryu.lib.packet.dns import dns
+from base.me.dns.dnsclassifier.dnsclassify import DNSClassifier
+
+
+def make_response(name, addrs, ttl=3600, rcode=0):
+    # An A record for each IPv4 address in addrs, and an AAAA for each IPv6.
+    d = dns()
+    d.id = 0x1234
+    d.qr = True
+    d.rcode = rcode
+    d.questions.append(dns.question(name, dns.rr.A_TYPE, 1))
+    for addr in addrs:
+        if ':' in addr:
+            d.answers.append(dns.rr(name, dns.rr.AAAA_TYPE, 1, ttl, 16,
+                                    socket.inet_pton(socket.AF_INET6, addr)))
+        else:
+            d.answers.append(dns.rr(name, dns.rr.A_TYPE, 1, ttl, 4,
+                                    socket.inet_aton(addr)))
+    return str(d.serialize(None, None))
+
+
+class Test_DNSClassifier(unittest.TestCase):
+    def setUp(self):
+        self.classifier = DNSClassifier()
+
+    def tearDown(self):
+        if self.classifier.sweep_timer is not None:
+            self.classifier.sweep_timer.cancel()
+
+    def test_parse_new_DNS(self):
+        new = []
+        self.classifier.set_new_callback(lambda addr, entry: new.append(addr))
+        packet = make_response("www.Example.com", ["10.0.0.1", "10.0.0.2"])
+        self.classifier.parse_new_DNS(packet)
+
+        entry = self.classifier.find_by_ip("10.0.0.1")
+        self.assertNotEqual(entry, None)
+        self.assertEqual(entry.names, ["www.example.com"])
+        self.assertEqual(entry.ttl, 3600)
+        self.assertTrue(self.classifier.has("10.0.0.2"))
+        self.assertEqual(sorted(new), [socket.inet_aton("10.0.0.1"),
+                                       socket.inet_aton("10.0.0.2")])
+        self.assertEqual(len(self.classifier.find_by_name("www.example.com")),
+                         2)
+
+    def test_update_and_new_name(self):
+        names = []
+        self.classifier.set_new_name_callback(
+            lambda name, addr, entry: names.append(name))
+        self.classifier.parse_new_DNS(make_response("a.example.com",
+                                                    ["10.0.0.1"]))
+        self.classifier.parse_new_DNS(make_response("a.example.com",
+                                                    ["10.0.0.1"], ttl=60))
+        self.classifier.parse_new_DNS(make_response("b.example.com",
+                                                    ["10.0.0.1"], ttl=60))
+
+        self.assertEqual(names, ["a.example.com", "b.example.com"])
+        entry = self.classifier.find_by_ip("10.0.0.1")
+        self.assertEqual(entry.ttl, 60)
+        self.assertEqual(entry.names, ["a.example.com", "b.example.com"])
+
+    def test_dual_stack(self):
+        self.classifier.parse_new_DNS(make_response("www.example.com",
+                                                    ["10.0.0.1",
+                                                     "2001:db8::1"]))
+        entry = self.classifier.find_by_ip("2001:db8::1")
+        self.assertNotEqual(entry, None)
+        self.assertEqual(entry.IP, socket.inet_pton(socket.AF_INET6,
+                                                    "2001:db8::1"))
+        self.assertEqual(entry.names, ["www.example.com"])
+        self.assertEqual(len(self.classifier.find_by_name("www.example.com")),
+                         2)
+
+    def test_address_length_mismatch(self):
+        # An AAAA record with a 4 byte address is skipped.
+        d = dns()
+        d.qr = True
+        d.answers.append(dns.rr("www.example.com", dns.rr.AAAA_TYPE, 1, 60, 4,
+                                socket.inet_aton("10.0.0.1")))
+        self.classifier.parse_new_DNS(str(d.serialize(None, None)))
+        self.assertEqual(len(self.classifier.db), 0)
+
+    def test_ignored_packets(self):
+        self.classifier.parse_new_DNS(make_response("a.example.com",
+                                                    ["10.0.0.1"], rcode=3))
+        self.classifier.parse_new_DNS("\x00" * 5)
+        self.assertEqual(len(self.classifier.db), 0)
+        self.assertEqual(self.classifier.find_by_ip("not an address"), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+# Copyright 2015 - Sean Donovan
+# NetAssay Project
+
+# Unit tests for DNSIngest, the batching stage in front of the DNSClassifier.
+#
+# Requires the updated Ryu DNS library, see vendor-updates/.
+#
+# PYTHONPATH=<netassay-ryu> python test_dns_ingest.py
+
+import socket
+import struct
+import time
+import unittest
+
+from base.me.dns.dnsclassifier.dnsclassify import DNSClassifier
+from base.me.dns.dnsingest import DNSIngest
+from test_dns_classify import make_response
+
+
+# A NOERROR response with one A record, whose owner name is a compression
+# pointer past the end of the packet. It parses, as names are only skipped,
+# but fails once the name is decoded.
+BAD_POINTER = (struct.pack("!HBBHHHH", 1, 0x80, 0, 0, 1, 0, 0) +
+               "\xc0\xff" + struct.pack("!HHIH", 1, 1, 60, 4) +
+               socket.inet_aton("10.0.0.9"))
+
+
+class Test_DNSIngest(unittest.TestCase):
+    def setUp(self):
+        self.classifier = DNSClassifier()
+        self.ingest = DNSIngest(self.classifier)
+
+    def tearDown(self):
+        if self.classifier.sweep_timer is not None:
+            self.classifier.sweep_timer.cancel()
+
+    def test_duplicates_and_merge(self):
+        short = make_response("a.example.com", ["10.0.0.1"], ttl=60)
+        longer = make_response("a.example.com", ["10.0.0.1"], ttl=600)
+        self.ingest._process([short, short, longer])
+
+        stats = self.ingest.stats()
+        self.assertEqual(stats['duplicates'], 1)
+        self.assertEqual(stats['parsed'], 2)
+        self.assertEqual(stats['records'], 1)
+        self.assertEqual(self.classifier.find_by_ip("10.0.0.1").ttl, 600)
+
+    def test_bad_payload_only_drops_itself(self):
+        batch = [make_response("a.example.com", ["10.0.0.1"]),
+                 BAD_POINTER,
+                 make_response("b.example.com", ["10.0.0.2"])]
+        self.ingest._process(batch)
+
+        stats = self.ingest.stats()
+        self.assertEqual(stats['errors'], 1)
+        self.assertEqual(stats['parsed'], 2)
+        self.assertEqual(stats['batches'], 1)
+        self.assertTrue(self.classifier.has("10.0.0.1"))
+        self.assertTrue(self.classifier.has("10.0.0.2"))
+        self.assertFalse(self.classifier.has("10.0.0.9"))
+
+    def test_submit(self):
+        self.assertTrue(self.ingest.submit(make_response("a.example.com",
+                                                         ["10.0.0.1"])))
+        deadline = time.time() + 5
+        while (not self.classifier.has("10.0.0.1") and
+               time.time() < deadline):
+            time.sleep(0.01)
+        self.assertTrue(self.classifier.has("10.0.0.1"))
+        self.assertEqual(self.ingest.stats()['received'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
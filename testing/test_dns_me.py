@@ -0,0 +1,97 @@
+# Copyright 2015 - Sean Donovan
+# NetAssay Project
+
+# End-to-end test of the DNS Metadata Engine: a packet-in carrying a DNS
+# response goes through the snoop fast path, the ingest stage and the
+# DNSClassifier, and ends up as rules from a DNSMetadataEntry.
+#
+# Requires the updated Ryu DNS library, see vendor-updates/.
+#
+# PYTHONPATH=<netassay-ryu> python test_dns_me.py
+
+import struct
+import time
+import unittest
+
+from base.me.dns.dnsme import DNSMetadataEngine
+from test_dns_classify import make_response
+
+SNOOP_COOKIE = 0x10000
+
+
+class packet_in(object):
+    # Just the parts of an OFPPacketIn that the ME looks at.
+    def __init__(self, cookie, data):
+        self.cookie = cookie
+        self.data = data
+
+
+def make_frame(payload, src_port=53, dst_port=33000):
+    # Ethernet, IPv4 and UDP headers around payload, plus Ethernet padding.
+    segment = struct.pack('!HHHH', src_port, dst_port, 8 + len(payload),
+                          0) + payload
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(segment), 0, 0x4000,
+                     64, 17, 0, '\x0a\x00\x00\x35', '\x0a\x00\x00\x02')
+    return ('\x02\x00\x00\x00\x00\x01\x02\x00\x00\x00\x00\x02\x08\x00' +
+            ip + segment + '\x00' * 4)
+
+
+def wait_for(condition):
+    deadline = time.time() + 5
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class Test_DNSMetadataEngine(unittest.TestCase):
+    def setUp(self):
+        self.engine = DNSMetadataEngine()
+        self.classifier = self.engine.data_source
+        # Normally set by install_forwarding_rules()
+        self.engine.snoop_cookie = SNOOP_COOKIE
+        self.added = []
+        self.removed = []
+        # A wildcard rule, so there's no active lookup.
+        self.entry = self.engine.new_rule(
+            '*.example.com',
+            lambda **match: self.added.append(match),
+            lambda **match: self.removed.append(match))
+
+    def tearDown(self):
+        self.engine.remove_rule(self.entry)
+        if self.classifier.sweep_timer is not None:
+            self.classifier.sweep_timer.cancel()
+
+    def test_packet_in(self):
+        frame = make_frame(make_response("www.Example.com", ["10.0.0.1"]))
+        self.assertTrue(self.engine.handle_packet_in(
+            packet_in(SNOOP_COOKIE, frame)))
+        self.assertTrue(wait_for(lambda: len(self.added) == 2))
+
+        entry = self.classifier.find_by_ip("10.0.0.1")
+        self.assertNotEqual(entry, None)
+        self.assertEqual(entry.names, ["www.example.com"])
+        self.assertEqual(sorted(self.added),
+                         sorted([{'ipv4_src' : "10.0.0.1",
+                                  'eth_type' : 0x0800},
+                                 {'ipv4_dst' : "10.0.0.1",
+                                  'eth_type' : 0x0800}]))
+        self.assertEqual(self.removed, [])
+
+    def test_ignored_packet_ins(self):
+        received = self.engine.ingest.stats()['received']
+        response = make_response("mail.example.com", ["10.0.0.3"])
+        # Another ME's cookie
+        self.assertFalse(self.engine.handle_packet_in(
+            packet_in(SNOOP_COOKIE + 1, make_frame(response))))
+        # A query, not a response
+        self.assertTrue(self.engine.handle_packet_in(
+            packet_in(SNOOP_COOKIE, make_frame(response, 33000, 53))))
+
+        self.assertEqual(self.engine.ingest.stats()['received'], received)
+        self.assertFalse(self.classifier.has("10.0.0.3"))
+        self.assertEqual(self.added, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
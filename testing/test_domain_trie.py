@@ -0,0 +1,63 @@
+# Copyright 2015 - Sean Donovan
+# NetAssay Project
+
+# Unit tests for domain_trie.
+#
+# PYTHONPATH=<netassay-ryu> python test_domain_trie.py
+
+import unittest
+
+from base.lib.domain_trie import domain_trie
+
+
+class Test_domain_trie(unittest.TestCase):
+    def setUp(self):
+        self.trie = domain_trie()
+        self.trie.insert('example.com', 'exact')
+        self.trie.insert('*.example.com', 'wildcard')
+        self.trie.insert('*.b.example.com', 'deeper')
+
+    def test_lookup(self):
+        self.assertEqual(self.trie.lookup('example.com'), ['exact'])
+        self.assertEqual(self.trie.lookup('www.example.com'), ['wildcard'])
+        self.assertEqual(sorted(self.trie.lookup('a.b.example.com')),
+                         ['deeper', 'wildcard'])
+        # A wildcard doesn't match its own domain.
+        self.assertEqual(self.trie.lookup('b.example.com'), ['wildcard'])
+        self.assertEqual(self.trie.lookup('example.org'), [])
+        self.assertEqual(self.trie.lookup('com'), [])
+        self.assertEqual(self.trie.lookup('notexample.com'), [])
+
+    def test_case_and_trailing_dot(self):
+        self.trie.insert('WWW.Example.ORG.', 'upper')
+        self.assertEqual(self.trie.lookup('www.example.org'), ['upper'])
+        self.assertEqual(self.trie.lookup('WWW.EXAMPLE.COM.'), ['wildcard'])
+
+    def test_remove(self):
+        self.trie.insert('example.com', 'second')
+        self.assertEqual(len(self.trie), 4)
+        self.trie.remove('example.com', 'exact')
+        self.assertEqual(self.trie.lookup('example.com'), ['second'])
+
+        self.trie.remove('*.b.example.com', 'deeper')
+        self.assertEqual(self.trie.lookup('a.b.example.com'), ['wildcard'])
+        self.assertFalse('b' in
+                         self.trie.root.children['com'].children['example']
+                         .children)
+
+        # Removing what isn't there is harmless.
+        self.trie.remove('*.b.example.com', 'deeper')
+        self.trie.remove('a.example.net', 'none')
+        self.assertEqual(len(self.trie), 2)
+
+    def test_prune(self):
+        for (pattern, value) in (('example.com', 'exact'),
+                                 ('*.example.com', 'wildcard'),
+                                 ('*.b.example.com', 'deeper')):
+            self.trie.remove(pattern, value)
+        self.assertEqual(len(self.trie), 0)
+        self.assertEqual(self.trie.root.children, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
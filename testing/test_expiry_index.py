@@ -0,0 +1,66 @@
+# Copyright 2015 - Sean Donovan
+# NetAssay Project
+
+# Unit tests for expiry_index.
+#
+# PYTHONPATH=<netassay-ryu> python test_expiry_index.py
+
+import unittest
+
+from base.lib.expiry_index import expiry_index
+
+
+class Test_expiry_index(unittest.TestCase):
+    def setUp(self):
+        self.index = expiry_index()
+
+    def test_pop_expired(self):
+        self.index.add('a', 10.2)
+        self.index.add('b', 10.7)
+        self.index.add('c', 12.5)
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.index.next_expiry(), 11.0)
+
+        # Buckets round up, so nothing goes before its expiry.
+        self.assertEqual(self.index.pop_expired(10.9), [])
+        self.assertEqual(sorted(self.index.pop_expired(11.0)), ['a', 'b'])
+        self.assertFalse('a' in self.index)
+        self.assertTrue('c' in self.index)
+        self.assertEqual(self.index.next_expiry(), 13.0)
+        self.assertEqual(self.index.pop_expired(20), ['c'])
+        self.assertEqual(self.index.next_expiry(), None)
+
+    def test_move(self):
+        self.index.add('a', 10.5)
+        self.index.move('a', 30.5)
+        self.assertEqual(len(self.index), 1)
+        # The emptied bucket is skipped.
+        self.assertEqual(self.index.next_expiry(), 31.0)
+        self.assertEqual(self.index.pop_expired(20), [])
+        self.assertEqual(self.index.pop_expired(31), ['a'])
+
+    def test_remove(self):
+        self.index.add('a', 10.5)
+        self.index.add('b', 10.5)
+        self.index.remove('a')
+        # Removing something that isn't there is harmless.
+        self.index.remove('a')
+        self.assertEqual(self.index.pop_expired(11), ['b'])
+
+    def test_bucket_reused(self):
+        # A bucket emptied and filled again is only popped once.
+        self.index.add('a', 10.5)
+        self.index.remove('a')
+        self.index.add('b', 10.5)
+        self.assertEqual(self.index.pop_expired(11), ['b'])
+        self.assertEqual(len(self.index), 0)
+
+    def test_granularity(self):
+        index = expiry_index(granularity=0.25)
+        index.add('a', 1.1)
+        self.assertEqual(index.next_expiry(), 1.25)
+        self.assertEqual(index.pop_expired(1.25), ['a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
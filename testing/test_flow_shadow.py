@@ -0,0 +1,85 @@
+# Copyright 2015 - Sean Donovan
+# NetAssay Project
+
+# Unit tests for FlowShadow, and the cookies the MCM reconciles with it.
+#
+# PYTHONPATH=<netassay-ryu> python test_flow_shadow.py
+
+import unittest
+
+from base.flow_shadow import FlowShadow
+from base.mcm import NAMA_ID_SHIFT, MCM_TABLE_COOKIE_BIT
+
+
+class rule(object):
+    # Stands in for both an OFPFlowMod and an OFPFlowStats, as FlowShadow
+    # only looks at these attributes.
+    def __init__(self, cookie, table_id, priority, match):
+        self.cookie = cookie
+        self.table_id = table_id
+        self.priority = priority
+        self.match = match
+        self.instructions = []
+
+
+def owned(cookie):
+    # As in NetAssayMCM.flow_stats_reply_handler()
+    return cookie >> NAMA_ID_SHIFT != 0
+
+
+NAMA_1 = 1 << NAMA_ID_SHIFT
+NAMA_2 = 2 << NAMA_ID_SHIFT
+
+
+class Test_FlowShadow(unittest.TestCase):
+    def setUp(self):
+        self.shadow = FlowShadow()
+
+    def test_diff(self):
+        kept = rule(NAMA_1 | 1, 2, 1, {'ipv4_src' : "10.0.0.1"})
+        missing = rule(NAMA_1 | 2, 2, 1, {'ipv4_dst' : "10.0.0.1"})
+        moved = rule(NAMA_1 | 3, 2, 1, {'ipv4_src' : "10.0.0.2"})
+        for mod in (kept, missing, moved):
+            self.shadow.record(mod)
+        self.assertEqual(len(self.shadow), 3)
+
+        stats = [kept,
+                 rule(moved.cookie, 2, 5, moved.match),
+                 rule(NAMA_1 | 4, 2, 1, {'ipv4_src' : "10.0.0.3"}),
+                 rule(7, 0, 65535, {'udp_src' : 53})]
+        (deletes, adds) = self.shadow.diff(stats, owned)
+        # The stale rule and the one with the wrong priority go, the snoop
+        # rule with a low cookie is left alone.
+        self.assertEqual(sorted(deletes), [NAMA_1 | 3, NAMA_1 | 4])
+        self.assertEqual(sorted(adds), [NAMA_1 | 2, NAMA_1 | 3])
+
+    def test_stale_mcm_table_rule(self):
+        current = rule(MCM_TABLE_COOKIE_BIT | 2, 3, 1, {'metadata' : 2})
+        self.shadow.record(current)
+        stale = rule(MCM_TABLE_COOKIE_BIT | 1, 3, 1, {'metadata' : 1})
+        (deletes, adds) = self.shadow.diff([current, stale], owned)
+        self.assertEqual(deletes, [stale.cookie])
+        self.assertEqual(adds, [])
+
+    def test_shared_rule_key(self):
+        # Two NAMAs with the same rule: the switch only keeps one.
+        match = {'ipv4_src' : "10.0.0.1"}
+        first = rule(NAMA_1 | 1, 2, 1, match)
+        second = rule(NAMA_2 | 1, 2, 1, match)
+        self.shadow.record(first)
+        self.shadow.record(second)
+        self.assertEqual(self.shadow.diff([], owned), ([], [second.cookie]))
+        self.assertEqual(self.shadow.diff([first], owned), ([], []))
+
+    def test_forget_cookies(self):
+        self.shadow.record(rule(NAMA_1 | 1, 2, 1, {'ipv4_src' : "10.0.0.1"}))
+        self.shadow.record(rule(NAMA_2 | 1, 2, 1, {'ipv4_src' : "10.0.0.2"}))
+        self.shadow.record(rule(MCM_TABLE_COOKIE_BIT | 1, 3, 1,
+                                {'metadata' : 1}))
+        self.shadow.forget_cookies(NAMA_1, 0xffffffff << NAMA_ID_SHIFT)
+        self.assertEqual(sorted(self.shadow.entries.keys()),
+                         [NAMA_2 | 1, MCM_TABLE_COOKIE_BIT | 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
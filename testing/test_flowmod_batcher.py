@@ -0,0 +1,132 @@
+# Copyright 2015 - Sean Donovan
+# NetAssay Project
+
+# Unit tests for FlowModBatcher, with a stand-in for a Ryu datapath.
+#
+# PYTHONPATH=<netassay-ryu> python test_flowmod_batcher.py
+
+import threading
+import unittest
+
+from base.flowmod_batcher import FlowModBatcher
+from base.flow_shadow import FlowShadow
+
+
+class fake_msg(object):
+    # Serializes to its name, so what was sent can be read back.
+    def __init__(self, name, cookie=0):
+        self.name = name
+        self.cookie = cookie
+        self.table_id = 2
+        self.priority = 1
+        self.match = {'name' : name}
+        self.instructions = []
+        self.xid = None
+        self.buf = None
+
+    def serialize(self):
+        self.buf = self.name + ';'
+
+
+class fake_parser(object):
+    @staticmethod
+    def OFPBarrierRequest(datapath):
+        return fake_msg('barrier')
+
+
+class fake_reply(object):
+    def __init__(self, xid):
+        self.xid = xid
+
+
+class fake_datapath(object):
+    ofproto_parser = fake_parser
+
+    def __init__(self):
+        self.id = 1
+        self.xid = 0
+        self.sent = []
+        self.event = threading.Event()
+
+    def set_xid(self, msg):
+        self.xid += 1
+        msg.xid = self.xid
+
+    def send(self, data):
+        self.sent.append(data.split(';')[:-1])
+        self.event.set()
+
+
+class Test_FlowModBatcher(unittest.TestCase):
+    def setUp(self):
+        self.datapath = fake_datapath()
+        self.shadow = FlowShadow()
+        # A long window, so batches only go out on flush().
+        self.batcher = FlowModBatcher(self.datapath, self.shadow, window=60,
+                                      max_messages=4)
+
+    def tearDown(self):
+        self.batcher.rebind(self.datapath)
+
+    def test_add_then_cancel(self):
+        self.batcher.add(1, fake_msg('add 1', 1))
+        self.batcher.add(2, fake_msg('add 2', 2))
+        self.batcher.delete(1, fake_msg('delete 1', 1))
+        self.assertEqual(self.shadow.entries.keys(), [2])
+        self.batcher.flush()
+
+        self.assertEqual(self.datapath.sent, [['add 2', 'barrier']])
+        stats = self.batcher.stats()
+        self.assertEqual(stats['cancelled'], 2)
+        self.assertEqual(stats['messages'], 1)
+
+        # Once sent, a delete is sent too.
+        self.batcher.delete(2, fake_msg('delete 2', 2))
+        self.batcher.flush()
+        self.assertEqual(self.datapath.sent[-1], ['delete 2', 'barrier'])
+        self.assertEqual(len(self.shadow), 0)
+
+    def test_all_cancelled(self):
+        self.batcher.add(1, fake_msg('add 1', 1))
+        self.batcher.delete(1, fake_msg('delete 1', 1))
+        self.batcher.flush()
+        self.assertEqual(self.datapath.sent, [])
+        self.assertEqual(self.batcher.stats()['batches'], 0)
+
+    def test_delete_cookies(self):
+        nama = 1 << 32
+        self.batcher.add(nama | 1, fake_msg('add 1', nama | 1))
+        self.batcher.add(2, fake_msg('add 2', 2))
+        self.batcher.delete_cookies(nama, 0xffffffff << 32,
+                                    fake_msg('delete nama'))
+        self.batcher.flush()
+        self.assertEqual(self.datapath.sent,
+                         [['add 2', 'delete nama', 'barrier']])
+        self.assertEqual(self.shadow.entries.keys(), [2])
+
+    def test_max_messages(self):
+        for x in range(5):
+            self.batcher.add(x, fake_msg('add %d' % x, x))
+        self.assertEqual(self.datapath.sent,
+                         [['add 0', 'add 1', 'add 2', 'add 3', 'barrier']])
+        self.assertEqual(self.batcher.stats()['pending'], 1)
+
+    def test_barrier_reply(self):
+        self.batcher.add(1, fake_msg('add 1', 1))
+        self.batcher.flush()
+        # The barrier has the last xid.
+        self.assertFalse(self.batcher.barrier_reply(fake_reply(1)))
+        self.assertTrue(self.batcher.barrier_reply(fake_reply(2)))
+        stats = self.batcher.stats()
+        self.assertEqual(stats['unacked'], 0)
+        self.assertNotEqual(stats['last_latency'], None)
+
+    def test_window(self):
+        batcher = FlowModBatcher(self.datapath, window=0.01)
+        batcher.add(1, fake_msg('add 1', 1))
+        self.assertTrue(self.datapath.event.wait(5))
+        self.assertEqual(self.datapath.sent, [['add 1', 'barrier']])
+
+
+if __name__ == '__main__':
+    unittest.main()
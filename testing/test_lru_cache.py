@@ -0,0 +1,59 @@
+# Copyright 2015 - Sean Donovan
+# NetAssay Project
+
+# Unit tests for lru_cache.
+#
+# PYTHONPATH=<netassay-ryu> python test_lru_cache.py
+
+import unittest
+
+from base.lib.lru_cache import lru_cache
+
+
+class Test_lru_cache(unittest.TestCase):
+    def setUp(self):
+        self.cache = lru_cache(3)
+
+    def test_get_and_put(self):
+        self.assertEqual(self.cache.get('a'), None)
+        self.assertEqual(self.cache.get('a', 'missing'), 'missing')
+        self.cache.put('a', 1)
+        self.cache.put('a', 2)
+        self.assertEqual(self.cache.get('a'), 2)
+        self.assertEqual(len(self.cache), 1)
+        self.assertTrue('a' in self.cache)
+
+        stats = self.cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['evictions'], 0)
+
+    def test_eviction_order(self):
+        for key in ('a', 'b', 'c'):
+            self.cache.put(key, key)
+        # Using 'a' leaves 'b' as the least recently used.
+        self.cache.get('a')
+        self.cache.put('d', 'd')
+        self.assertFalse('b' in self.cache)
+        # As does updating a value.
+        self.cache.put('c', 'C')
+        self.cache.put('e', 'e')
+        self.assertFalse('a' in self.cache)
+        self.assertEqual(sorted(self.cache.links.keys()), ['c', 'd', 'e'])
+        self.assertEqual(self.cache.stats()['evictions'], 2)
+
+    def test_clear(self):
+        self.cache.put('a', 1)
+        self.cache.get('a')
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.get('a'), None)
+        # The counters are kept.
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        for key in range(5):
+            self.cache.put(key, key)
+        self.assertEqual(len(self.cache), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
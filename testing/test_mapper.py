@@ -0,0 +1,94 @@
+# Copyright 2015 - Sean Donovan
+# NetAssay Project
+
+# Unit tests for the DNS classifier's Mapper, checked against a re.search()
+# of each service definition.
+#
+# PYTHONPATH=<netassay-ryu> python test_mapper.py
+
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from base.me.dns.dnsclassifier.mapper import Mapper
+
+
+class Test_Mapper(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.mapper = Mapper()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def load(self, service, lines):
+        filename = os.path.join(self.directory, service + '.ini')
+        f = open(filename, 'w')
+        f.write('\n'.join(lines) + '\n')
+        f.close()
+        self.mapper.loadFile(filename, service)
+
+    def search_loop(self, dnsname):
+        # What searchType() did before the definitions were compiled.
+        self.mapper.createTypePoll()
+        for name, service in self.mapper.name_to_service.items():
+            if re.search(name, dnsname) is not None:
+                self.mapper.types_poll[service] += 1
+        return max(self.mapper.types_poll, key=self.mapper.types_poll.get)
+
+    def test_search_type(self):
+        self.load('VIDEO', ['*.video.example.com', '*.cdn.example.net',
+                            'stream*'])
+        self.load('ADVERT', ['*ads.*', 'doubleclick'])
+        self.assertEqual(self.mapper.searchType('www.video.example.com'),
+                         'VIDEO')
+        self.assertEqual(self.mapper.searchType('Edge.CDN.Example.net'),
+                         'VIDEO')
+        self.assertEqual(self.mapper.searchType('ads.example.org'), 'ADVERT')
+        self.assertEqual(self.mapper.searchType('stream3.example.org'),
+                         'VIDEO')
+        self.assertEqual(self.mapper.searchType('video.example.com'),
+                         'DEFAULT')
+        self.assertEqual(self.mapper.searchType('example.com'), 'DEFAULT')
+
+    def test_votes(self):
+        # The service with the most matching definitions wins. Names with
+        # a tie are left out, as either service could win.
+        self.load('WEB', ['*.example.com'])
+        self.load('ADVERT', ['*ads.*', 'track'])
+        for name in ('ads.track.example.com', 'www.example.com',
+                     'ads.example.org', 'tracker.example.org'):
+            self.assertEqual(self.mapper.searchType(name),
+                             self.search_loop(name))
+        self.assertEqual(self.mapper.searchType('ads.track.example.com'),
+                         'ADVERT')
+
+    def test_many_patterns(self):
+        # More groups than fit in a single regex.
+        self.load('WEB', ['site%d-' % x for x in range(150)])
+        self.load('VIDEO', ['(clip|movie)%d-' % x for x in range(50)])
+        for name in ('site7-a.example.com', 'site149-b.example.com',
+                     'movie42-x.example.com', 'clip0-.example.com',
+                     'nothing.example.com'):
+            self.assertEqual(self.mapper.searchType(name),
+                             self.search_loop(name))
+        self.assertEqual(self.mapper.searchType('movie42-x.example.com'),
+                         'VIDEO')
+
+    def test_cache(self):
+        self.load('WEB', ['*.example.com'])
+        self.assertEqual(self.mapper.searchType('www.example.com'), 'WEB')
+        self.assertEqual(self.mapper.searchType('WWW.example.com'), 'WEB')
+        stats = self.mapper.cacheStats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+        # Loading more definitions empties the cache.
+        self.load('VIDEO', ['www', 'www.ex'])
+        self.assertEqual(self.mapper.searchType('www.example.com'), 'VIDEO')
+
+
+if __name__ == '__main__':
+    unittest.main()
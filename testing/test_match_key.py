@@ -0,0 +1,49 @@
+# Copyright 2015 - Sean Donovan
+# NetAssay Project
+
+# Unit tests for match_key.
+#
+# PYTHONPATH=<netassay-ryu> python test_match_key.py
+
+import unittest
+
+from base.match_tracking import match_key
+
+
+class Test_match_key(unittest.TestCase):
+    def test_equality(self):
+        first = match_key({'ipv4_src' : "10.0.0.1", 'eth_type' : 0x0800})
+        second = match_key(dict([('eth_type', 0x0800),
+                                 ('ipv4_src', "10.0.0.1")]))
+        other = match_key({'ipv4_dst' : "10.0.0.1", 'eth_type' : 0x0800})
+        self.assertEqual(first, second)
+        self.assertEqual(hash(first), hash(second))
+        self.assertNotEqual(first, other)
+        self.assertTrue(first != other)
+        self.assertFalse(first != second)
+        # Not equal to the dict it was built from.
+        self.assertNotEqual(first, {'ipv4_src' : "10.0.0.1",
+                                    'eth_type' : 0x0800})
+
+    def test_dict_key(self):
+        trackers = {}
+        trackers[match_key({'ipv4_src' : "10.0.0.1"})] = 'tracker'
+        self.assertEqual(trackers.get(match_key({'ipv4_src' : "10.0.0.1"})),
+                         'tracker')
+        self.assertEqual(trackers.get(match_key({'ipv4_src' : "10.0.0.2"})),
+                         None)
+
+        # As for VMACs: a match and a postmatch together.
+        vmacs = {(match_key({'domain' : 'example.com'}), match_key({})) : 1}
+        self.assertEqual(vmacs.get((match_key({'domain' : 'example.com'}),
+                                    match_key({}))), 1)
+
+    def test_as_dict(self):
+        kwargs = {'ipv6_src' : "2001:db8::1", 'eth_type' : 0x86dd}
+        key = match_key(kwargs)
+        self.assertEqual(key.as_dict(), kwargs)
+        self.assertEqual(repr(key), str(kwargs))
+
+
+if __name__ == '__main__':
+    unittest.main()
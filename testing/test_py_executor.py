@@ -0,0 +1,112 @@
+# Copyright 2015 - Sean Donovan
+# NetAssay Project
+
+# Unit tests for the executors in base/lib/py_executor.py.
+#
+# PYTHONPATH=<netassay-ryu> python test_py_executor.py
+
+import threading
+import time
+import unittest
+
+from base.lib.py_executor import inline_executor, thread_pool_executor
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class Test_thread_pool_executor(unittest.TestCase):
+    def setUp(self):
+        self.executor = thread_pool_executor(workers=2)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_workers_start_lazily(self):
+        self.assertEqual(self.executor.workers, None)
+        self.executor.call_later(0, lambda: None)
+        self.assertEqual(self.executor.workers, None)
+
+        done = threading.Event()
+        self.executor.submit(done.set)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(len(self.executor.workers), 2)
+        self.assertTrue(wait_for(
+            lambda: self.executor.stats()['completed'] == 1))
+
+    def test_shutdown(self):
+        calls = []
+        for x in range(10):
+            self.executor.submit(calls.append, x)
+        workers = self.executor.workers
+        self.executor.shutdown()
+        for worker in workers:
+            worker.join(5)
+            self.assertFalse(worker.is_alive())
+        self.assertEqual(sorted(calls), range(10))
+
+        # Late callbacks are run inline.
+        self.executor.submit(calls.append, 10)
+        self.assertEqual(calls[-1], 10)
+        self.assertEqual(self.executor.stats()['inline_runs'], 1)
+
+    def test_callback_errors(self):
+        done = threading.Event()
+        self.executor.submit(lambda: 1 / 0)
+        self.executor.submit(done.set)
+        self.assertTrue(done.wait(5))
+        self.assertTrue(wait_for(
+            lambda: self.executor.stats()['completed'] == 2))
+        self.assertEqual(self.executor.stats()['errors'], 1)
+
+
+class Test_call_later(unittest.TestCase):
+    def setUp(self):
+        self.executor = inline_executor()
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_order_and_cancel(self):
+        calls = []
+        done = threading.Event()
+        self.executor.call_later(0.1, lambda: calls.append(2))
+        cancelled = self.executor.call_later(0.05, lambda: calls.append(0))
+        self.executor.call_later(0.02, lambda: calls.append(1))
+        self.executor.call_later(0.15, done.set)
+        cancelled.cancel()
+
+        self.assertTrue(done.wait(5))
+        self.assertEqual(calls, [1, 2])
+
+    def test_single_thread(self):
+        threads = set()
+        done = threading.Event()
+        for x in range(20):
+            self.executor.call_later(
+                0.01, lambda: threads.add(threading.current_thread()))
+        self.executor.call_later(0.02, done.set)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(len(threads), 1)
+
+    def test_shutdown_runs_scheduled_calls(self):
+        done = threading.Event()
+        self.executor.call_later(0.05, done.set)
+        thread = self.executor.scheduler.thread
+        self.executor.shutdown()
+        self.assertTrue(done.wait(5))
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+    def test_cancelled_calls_are_compacted(self):
+        for x in range(1000):
+            self.executor.call_later(60, lambda: None).cancel()
+        self.assertTrue(len(self.executor.scheduler.heap) <= 64)
+
+
+if __name__ == '__main__':
+    unittest.main()
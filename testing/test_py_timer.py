@@ -0,0 +1,83 @@
+# Copyright 2015 - Sean Donovan
+# NetAssay Project
+
+# Unit tests for py_timer and its py_timer_manager.
+#
+# PYTHONPATH=<netassay-ryu> python test_py_timer.py
+
+import threading
+import time
+import unittest
+
+from base.lib.py_timer import py_timer as Timer
+from base.lib.py_timer import py_timer_manager
+
+
+class Test_py_timer(unittest.TestCase):
+    def setUp(self):
+        self.manager = py_timer_manager.get_instance()
+        self.fired = []
+        self.done = threading.Event()
+
+    def fire(self, name):
+        self.fired.append(name)
+        self.done.set()
+
+    def test_fire(self):
+        timer = Timer(0.2, self.fire, ['timer'])
+        self.assertFalse(timer.is_alive())
+        timer.start()
+        self.assertTrue(timer.is_alive())
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(self.fired, ['timer'])
+        self.assertFalse(timer.is_alive())
+
+    def test_kwargs(self):
+        timer = Timer(0, self.fire, kwargs={'name' : 'kwargs'})
+        timer.start()
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(self.fired, ['kwargs'])
+
+    def test_cancel(self):
+        cancelled = Timer(0.2, self.fire, ['cancelled'])
+        cancelled.start()
+        cancelled.cancel()
+        self.assertFalse(cancelled.is_alive())
+        # Cancelling twice is harmless.
+        cancelled.cancel()
+
+        Timer(0.3, self.fire, ['later']).start()
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(self.fired, ['later'])
+
+    def test_restart(self):
+        # Restarting a running timer reschedules it, rather than adding a
+        # second expiry.
+        timer = Timer(0.2, self.fire, ['restarted'])
+        timer.start()
+        start = time.time()
+        time.sleep(0.1)
+        timer.start()
+        self.assertTrue(self.done.wait(5))
+        # Less the manager's 50 ms of slack
+        self.assertTrue(time.time() - start >= 0.24)
+        time.sleep(0.2)
+        self.assertEqual(self.fired, ['restarted'])
+
+    def test_batches(self):
+        # Timers within the slack of each other expire in one wakeup.
+        batches = []
+        self.manager.set_bulk_callback(
+            lambda timers: batches.append(len(timers)) or self.done.set())
+        try:
+            for x in range(5):
+                Timer(0.2 + x * 0.001, self.fire, [x]).start()
+            self.assertTrue(self.done.wait(5))
+        finally:
+            self.manager.set_bulk_callback(None)
+        self.assertEqual(batches, [5])
+        self.assertEqual(self.fired, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
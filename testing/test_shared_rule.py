@@ -0,0 +1,79 @@
+# Copyright 2015 - Sean Donovan
+# NetAssay Project
+
+# Unit tests for NetAssaySharedRule, the ME rule shared by the NAMAs with the
+# same match.
+#
+# PYTHONPATH=<netassay-ryu> python test_shared_rule.py
+
+import unittest
+
+from base.mcm import NetAssaySharedRule
+
+MATCH = {'ipv4_src' : "10.0.0.1", 'eth_type' : 0x0800}
+
+
+class fake_me(object):
+    # Calls back with MATCH as soon as the rule is created, as the DNS ME
+    # does for what's already in its cache.
+    def __init__(self):
+        self.rules = []
+        self.removed = []
+        self.on_remove = None
+
+    def new_rule(self, rule, add_rule_cb, remove_rule_cb):
+        me_rule = (rule, add_rule_cb, remove_rule_cb)
+        self.rules.append(me_rule)
+        add_rule_cb(**MATCH)
+        return me_rule
+
+    def remove_rule(self, me_rule):
+        if self.on_remove is not None:
+            self.on_remove(me_rule)
+        self.rules.remove(me_rule)
+        self.removed.append(me_rule)
+
+
+class fake_nama(object):
+    def __init__(self):
+        self.matches = []
+
+    def add_rule(self, **kwargs):
+        self.matches.append(kwargs)
+
+    def remove_rule(self, **kwargs):
+        self.matches.remove(kwargs)
+
+
+class Test_NetAssaySharedRule(unittest.TestCase):
+    def setUp(self):
+        self.me = fake_me()
+        self.shared = NetAssaySharedRule(self.me, "example.com")
+
+    def test_subscribe_gets_seeded_matches(self):
+        first = fake_nama()
+        second = fake_nama()
+        self.shared.subscribe(first)
+        self.shared.subscribe(second)
+        self.assertEqual(first.matches, [MATCH])
+        self.assertEqual(second.matches, [MATCH])
+        self.assertEqual(len(self.me.rules), 1)
+
+        self.assertFalse(self.shared.unsubscribe(first))
+        self.assertEqual(self.me.removed, [])
+        self.assertTrue(self.shared.unsubscribe(second))
+        self.assertEqual(self.me.rules, [])
+
+    def test_remove_while_unsubscribing(self):
+        # An expiry that races with the last unsubscribe still finds its
+        # match, until the ME's rule is gone.
+        nama = fake_nama()
+        self.shared.subscribe(nama)
+        self.me.on_remove = lambda me_rule: me_rule[2](**MATCH)
+        self.assertTrue(self.shared.unsubscribe(nama))
+        self.assertEqual(self.shared.active, {})
+        self.assertEqual(len(self.me.removed), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -75,6 +75,7 @@
 #======================================================================
 
 
+import logging
 import struct
 
 from ryu.ofproto import ether
@@ -127,6 +128,18 @@ rrclass_to_str = {
 
 DNS_HW_TYPE_ETHERNET = 1 # ethernet hardware type
 
+LOG = logging.getLogger('ryu.lib.packet.dns')
+
+# Precompiled formats for the fixed size parts of a message. These are read
+# with unpack_from() at an offset, rather than from a slice of the buffer.
+_HEADER_STRUCT   = struct.Struct('!HBBHHHH')
+_QUESTION_STRUCT = struct.Struct('!HH')
+_RR_STRUCT       = struct.Struct('!HHIH')
+
+# A name can't be longer than 255 bytes, so a well-formed name never needs
+# this many compression pointers. Anything past it is a pointer loop.
+_MAX_POINTER_HOPS = 127
+
 class dns(packet_base.PacketBase):
     "DNS Packet struct"
 
@@ -166,9 +179,9 @@ class dns(packet_base.PacketBase):
       msg += ": "
       msg += str(e)
       if isinstance(e, Trunc):
-        self.msg(msg)
+        LOG.info(msg)
       else:
-        self.err(msg)
+        LOG.error(msg)
 
 #TODO: SPD - This is the serialize equivalent???
 #''' This is some of the ugliest code I've ever seen. Lots of things being defined
@@ -190,26 +203,25 @@ class dns(packet_base.PacketBase):
         if self.cd: bits1 |= 0x10
         bits1 |= (self.rcode & 0xf)
 
-        s = struct.pack("!HBBHHHH", self.id, bits0, bits1,
-                        len(self.questions), len(self.answers), 
-                        len(self.authorities), len(self.additional))
+        buf = bytearray(_HEADER_STRUCT.pack(self.id, bits0, bits1,
+                        len(self.questions), len(self.answers),
+                        len(self.authorities), len(self.additional)))
 
         name_map = {}
 
         for r in self.questions:
-          s = putName(s, r.name, name_map)
-          s += struct.pack("!HH", r.qtype, r.qclass)
-
-        rest = self.answers + self.authorities + self.additional
-        for r in rest:
-          s = putName(s, r.name, name_map)
-          s += struct.pack("!HHIH", r.qtype, r.qclass, r.ttl, 0)
-          fixup = len(s) - 2
-          s = putData(s, r, name_map)
-          fixlen = len(s) - fixup - 2
-          s = s[:fixup] + struct.pack('!H', fixlen) + s[fixup+2:]
+          writeName(buf, r.name, name_map)
+          buf += _QUESTION_STRUCT.pack(r.qtype, r.qclass)
 
-        return s
+        for section in (self.answers, self.authorities, self.additional):
+          for r in section:
+            writeName(buf, r.name, name_map)
+            buf += _RR_STRUCT.pack(r.qtype, r.qclass, r.ttl, 0)
+            fixup = len(buf) - 2
+            writeData(buf, r, name_map)
+            struct.pack_into('!H', buf, fixup, len(buf) - fixup - 2)
+
+        return str(buf)
 
 
 #TODO: SPD - Need to get rid of the self.raw, as it's a @classmethod in the ryu code
@@ -224,33 +236,16 @@ class dns(packet_base.PacketBase):
 #        print "len " + str(dlen)
         newDns = cls()
 
-        bits0 = 0
-        bits1 = 0
-        total_questions = 0
-        total_answers = 0
-        total_auth_rr = 0
-        total_add_rr = 0
-        (newDns.id, bits0,bits1, total_questions, total_answers,
-         total_auth_rr, total_add_rr)\
-             = struct.unpack('!HBBHHHH', buf[:12])
-
-        newDns.qr = True if (bits0 & 0x80) else False
-        newDns.opcode = (bits0 >> 4) & (0x07)
-        newDns.aa     = True if (bits0 & (0x04)) else False
-        newDns.tc     = True if (bits0 & (0x02)) else False
-        newDns.rd     = True if (bits0 & (0x01)) else False
-        newDns.ra     = True if (bits1 & 0x80) else False
-        newDns.z      = True if (bits1 & 0x40) else False
-        newDns.ad     = True if (bits1 & 0x20) else False
-        newDns.cd     = True if (bits1 & 0x10) else False
-        newDns.rcode  = bits1 & 0x0f
+        (total_questions, total_answers, total_auth_rr, total_add_rr) = \
+            newDns._parse_header(buf)
 
         query_head = 12
+        names = {}
 
         # questions
         for i in range(0,total_questions):
             try:
-                query_head = newDns.next_question(buf, query_head)
+                query_head = newDns.next_question(buf, query_head, names)
             except Exception, e:
                 newDns._exc(e, 'parsing questions')
                 return None
@@ -258,7 +253,8 @@ class dns(packet_base.PacketBase):
         # answers
         for i in range(0,total_answers):
             try:
-                query_head = newDns.next_rr(buf, query_head, newDns.answers)
+                query_head = newDns.next_rr(buf, query_head, newDns.answers,
+                                            names)
             except Exception, e:
                 newDns._exc(e, 'parsing answers')
                 return None
@@ -266,7 +262,8 @@ class dns(packet_base.PacketBase):
         # authoritative name servers
         for i in range(0,total_auth_rr):
             try:
-                query_head = newDns.next_rr(buf, query_head, newDns.authorities)
+                query_head = newDns.next_rr(buf, query_head, newDns.authorities,
+                                            names)
             except Exception, e:
                 newDns._exc(e, 'parsing authoritative name servers')
                 return None
@@ -274,7 +271,8 @@ class dns(packet_base.PacketBase):
         # additional resource records
         for i in range(0,total_add_rr):
             try:
-                query_head = newDns.next_rr(buf, query_head, newDns.additional)
+                query_head = newDns.next_rr(buf, query_head, newDns.additional,
+                                            names)
             except Exception, e:
                 newDns._exc(e, 'parsing additional resource records')
                 return None
@@ -282,6 +280,96 @@ class dns(packet_base.PacketBase):
         newDns.parsed = True
         return newDns
 
+    @classmethod
+    def lazy_parser(cls, buf, qtypes=None, sections=None,
+                    noerror_responses_only=False):
+        """
+        Like parser(), but the records in each section are lazy_question and
+        lazy_rr objects. These hold offsets into buf, and the name and rddata
+        are only decoded when they're first looked at. Nothing is sliced out
+        of the buffer while parsing: fixed fields are read in place with
+        struct.unpack_from() and names are skipped over rather than decoded.
+
+        The parse can be filtered:
+          qtypes   - if not None, only records (and questions) of these types
+                     are kept. Others are skipped over by their rdlength.
+          sections - if not None, only these of 'questions', 'answers',
+                     'authorities' and 'additional' are filled in. Parsing
+                     stops after the last of them.
+          noerror_responses_only - if True, parsing stops after the header
+                     unless the message is a response with a NOERROR rcode.
+        Sections that are filtered out are left empty.
+        """
+        if len(buf) < dns.MIN_LEN:
+            return None
+        if isinstance(buf, bytearray):
+            # A read-only buffer over it indexes and slices like a str, so
+            # the packet isn't copied.
+            buf = buffer(buf)
+        elif isinstance(buf, memoryview):
+            # Name decoding relies on str indexing, which a memoryview
+            # doesn't have, so it has to be copied.
+            buf = buf.tobytes()
+        elif not isinstance(buf, (str, buffer)):
+            buf = str(buf)
+
+        newDns = cls()
+        counts = newDns._parse_header(buf)
+        newDns.parsed = True
+        if noerror_responses_only and not (newDns.qr and newDns.rcode == 0):
+            return newDns
+
+        wire = _dns_wire(buf)
+        rr_sections = (('answers', newDns.answers),
+                       ('authorities', newDns.authorities),
+                       ('additional', newDns.additional))
+        if sections is None:
+            last = 3
+        else:
+            last = -1
+            for (x, name) in enumerate(('questions', 'answers',
+                                        'authorities', 'additional')):
+                if name in sections:
+                    last = x
+
+        index = 12
+        try:
+            if last >= 0:
+                keep = sections is None or 'questions' in sections
+                for i in xrange(counts[0]):
+                    index = newDns._lazy_next_question(wire, index, qtypes,
+                                                       keep)
+            for x in xrange(last):
+                (name, section) = rr_sections[x]
+                if sections is not None and name not in sections:
+                    section = None
+                for i in xrange(counts[x + 1]):
+                    index = newDns._lazy_next_rr(wire, index, section,
+                                                 qtypes)
+        except Exception, e:
+            newDns._exc(e, 'lazily parsing')
+            return None
+
+        return newDns
+
+    def _parse_header(self, buf):
+        ''' Fills in the header fields, returns the four section counts. '''
+        (self.id, bits0, bits1, total_questions, total_answers,
+         total_auth_rr, total_add_rr) = _HEADER_STRUCT.unpack_from(buf, 0)
+
+        self.qr = True if (bits0 & 0x80) else False
+        self.opcode = (bits0 >> 4) & (0x07)
+        self.aa     = True if (bits0 & (0x04)) else False
+        self.tc     = True if (bits0 & (0x02)) else False
+        self.rd     = True if (bits0 & (0x01)) else False
+        self.ra     = True if (bits1 & 0x80) else False
+        self.z      = True if (bits1 & 0x40) else False
+        self.ad     = True if (bits1 & 0x20) else False
+        self.cd     = True if (bits1 & 0x10) else False
+        self.rcode  = bits1 & 0x0f
+
+        return (total_questions, total_answers, total_auth_rr, total_add_rr)
+
     def _to_str(self):
         flags = "|"
 
@@ -326,55 +414,123 @@ class dns(packet_base.PacketBase):
     # them in the DNS class
 
     @classmethod
-    def _read_dns_name_from_index(cls, l, index, retlist):
-      try:
-        while True:
-            chunk_size = ord(l[index])
-
-            # check whether we have an internal pointer
-            if (chunk_size & 0xc0) == 0xc0:
-                # pull out offset from last 14 bits
-                offset = ((ord(l[index]) & 0x3) << 8 ) | ord(l[index+1])
-                cls._read_dns_name_from_index(l, offset, retlist)
-                index += 1
-                break
-            if chunk_size == 0:
-                break
-            index += 1
-            retlist.append(l[index : index + chunk_size])
-            index += chunk_size
-        return index
-      except IndexError:
-        raise Trunc("incomplete name")
+    def read_dns_name_from_index(cls, l, index, names=None):
+        """
+        Returns (index just past the name, name). Compression pointers are
+        followed iteratively, up to _MAX_POINTER_HOPS of them.
+
+        names is an optional per-packet cache of offset -> (name decoded from
+        that offset, index just past it). Every label decoded along the way
+        is added to it, and decoding stops at the first offset already in it,
+        so a suffix shared by many records is only decoded once.
+        """
+        if names is not None:
+            # Fast paths: the name was decoded from here before, or it's a
+            # lone pointer to a name that was. Most names in a response are
+            # one or the other.
+            cached = names.get(index)
+            if cached is not None:
+                return (cached[1], cached[0])
+            try:
+                chunk_size = ord(l[index])
+                if (chunk_size & 0xc0) == 0xc0:
+                    cached = names.get(((chunk_size & 0x3f) << 8) |
+                                       ord(l[index + 1]))
+                    if cached is not None:
+                        names[index] = (cached[0], index + 2)
+                        return (index + 2, cached[0])
+            except IndexError:
+                raise Trunc("incomplete name")
+
+        labels = []
+        marks = []      # (offset, label number, segment) of each label
+        ends = []       # index just past each segment of the name
+        tail = ''       # cached suffix the name ends with
+        hops = 0
+        try:
+            while True:
+                if names is not None and index in names:
+                    (tail, end) = names[index]
+                    ends.append(end)
+                    break
+                chunk_size = ord(l[index])
+
+                # check whether we have an internal pointer
+                if (chunk_size & 0xc0) == 0xc0:
+                    ends.append(index + 2)
+                    hops += 1
+                    if hops > _MAX_POINTER_HOPS:
+                        raise Trunc("compression pointer loop")
+                    # pull out offset from last 14 bits
+                    index = ((chunk_size & 0x3f) << 8) | ord(l[index + 1])
+                    continue
+                if chunk_size == 0:
+                    ends.append(index + 1)
+                    break
+                if index + 1 + chunk_size > len(l):
+                    raise IndexError
+                marks.append((index, len(labels), len(ends)))
+                labels.append(l[index + 1 : index + 1 + chunk_size])
+                index += chunk_size + 1
+        except IndexError:
+            raise Trunc("incomplete name")
+
+        if names is None:
+            if tail:
+                labels.append(tail)
+            return (ends[0], ".".join(labels))
+
+        # Build the name from the right, caching every suffix on the way.
+        name = tail
+        for (offset, label, segment) in reversed(marks):
+            if name:
+                name = labels[label] + '.' + name
+            else:
+                name = labels[label]
+            names[offset] = (name, ends[segment])
+        return (ends[0], name)
 
     @classmethod
-    def read_dns_name_from_index(cls, l, index):
-        retlist = []
-        next = cls._read_dns_name_from_index(l, index, retlist)
-        return (next + 1, ".".join(retlist))
-
-    def next_rr(self, l, index, rr_list):
+    def skip_dns_name_from_index(cls, l, index):
+        ''' Returns the index just past the name, without decoding it. '''
+        try:
+            while True:
+                chunk_size = ord(l[index])
+                if (chunk_size & 0xc0) == 0xc0:
+                    # A pointer ends the name
+                    return index + 2
+                if chunk_size == 0:
+                    return index + 1
+                index += chunk_size + 1
+        except IndexError:
+            raise Trunc("incomplete name")
+
+    def next_rr(self, l, index, rr_list, names=None):
         array_len = len(l)
 
         # verify whether name is offset within packet
         if index > array_len:
             raise Trunc("next_rr: name truncated")
 
-        index,name = self.read_dns_name_from_index(l, index)
+        index,name = self.read_dns_name_from_index(l, index, names)
 
         if index + 10 > array_len:
             raise Trunc("next_rr: truncated")
 
-        (qtype,qclass,ttl,rdlen) = struct.unpack('!HHIH', l[index:index+10])
+        (qtype,qclass,ttl,rdlen) = _RR_STRUCT.unpack_from(l, index)
         if index+10+rdlen > array_len:
             raise Trunc("next_rr: data truncated")
 
-        rddata = self.get_rddata(l, qtype, rdlen, index + 10)
+        rddata = self.get_rddata(l, qtype, rdlen, index + 10, names)
         rr_list.append(dns.rr(name, qtype, qclass,ttl,rdlen,rddata))
 
         return index + 10 + rdlen
 
-    def get_rddata(self, l, type, dlen, beg_index):
+    def get_rddata(self, l, type, dlen, beg_index, names=None):
+        return self.rddata_from_index(l, type, dlen, beg_index, names)
+
+    @classmethod
+    def rddata_from_index(cls, l, type, dlen, beg_index, names=None):
         if beg_index + dlen > len(l):
             raise Trunc('(dns) truncated rdata')
         # A
@@ -386,35 +542,81 @@ class dns(packet_base.PacketBase):
             return l[beg_index : beg_index + 4]
         # NS
         elif type == 2:
-            return self.read_dns_name_from_index(l, beg_index)[1]
+            return cls.read_dns_name_from_index(l, beg_index, names)[1]
         # PTR
         elif type == 12:
-            return  self.read_dns_name_from_index(l, beg_index)[1]
+            return  cls.read_dns_name_from_index(l, beg_index, names)[1]
         # CNAME
         elif type == 5:
-            return self.read_dns_name_from_index(l, beg_index)[1]
+            return cls.read_dns_name_from_index(l, beg_index, names)[1]
         # MX
         elif type == 15:
             #TODO: Save priority (don't just jump past it)
-            return self.read_dns_name_from_index(l, beg_index + 2)[1]
+            return cls.read_dns_name_from_index(l, beg_index + 2, names)[1]
         else:
             return l[beg_index : beg_index + dlen]
 
-    def next_question(self, l, index):
+    def next_question(self, l, index, names=None):
         array_len = len(l)
 
-        index,name = self.read_dns_name_from_index(l, index)
+        index,name = self.read_dns_name_from_index(l, index, names)
 
         if index + 4 > array_len:
             raise Trunc("next_question: truncated")
 
-        (qtype,qclass) = struct.unpack('!HH', l[index:index+4])
+        (qtype,qclass) = _QUESTION_STRUCT.unpack_from(l, index)
         self.questions.append(dns.question(name, qtype, qclass))
         return index + 4
 
+    def _lazy_next_question(self, wire, index, qtypes=None, keep=True):
+        name_index = index
+        index = self.skip_dns_name_from_index(wire.buf, index)
+        if index + 4 > len(wire.buf):
+            raise Trunc("next_question: truncated")
+
+        if keep:
+            (qtype,qclass) = _QUESTION_STRUCT.unpack_from(wire.buf, index)
+            if qtypes is None or qtype in qtypes:
+                self.questions.append(dns.lazy_question(wire, name_index,
+                                                        qtype, qclass))
+        return index + 4
+
+    def _lazy_next_rr(self, wire, index, rr_list, qtypes=None):
+        # If rr_list is None, or the type isn't in qtypes, the record is
+        # skipped. This runs for every record, so the name is skipped
+        # inline rather than with skip_dns_name_from_index().
+        buf = wire.buf
+        name_index = index
+        try:
+            while True:
+                chunk_size = ord(buf[index])
+                if (chunk_size & 0xc0) == 0xc0:
+                    index += 2
+                    break
+                if chunk_size == 0:
+                    index += 1
+                    break
+                index += chunk_size + 1
+        except IndexError:
+            raise Trunc("incomplete name")
+        array_len = len(buf)
+        if index + 10 > array_len:
+            raise Trunc("next_rr: truncated")
+
+        (qtype,qclass,ttl,rdlen) = _RR_STRUCT.unpack_from(buf, index)
+        index += 10
+        if index + rdlen > array_len:
+            raise Trunc("next_rr: data truncated")
+
+        if rr_list is not None and (qtypes is None or qtype in qtypes):
+            rr_list.append(dns.lazy_rr(wire, name_index, qtype, qclass, ttl,
+                                       rdlen, index))
+        return index + rdlen
+
     # Utility classes for questions and RRs
 
-    class question:
+    class question (object):
+        __slots__ = ['name', 'qtype', 'qclass']
 
         def __init__(self, name, qtype, qclass):
             self.name   = name
@@ -453,6 +655,8 @@ class dns(packet_base.PacketBase):
         TXT_TYPE   = 16
         AAAA_TYPE  = 28
 
+        __slots__ = ['name', 'qtype', 'qclass', 'ttl', 'rdlen', 'rddata']
+
         def __init__ (self, _name, _qtype, _qclass, _ttl, _rdlen, _rddata):
             self.name   = _name
             self.qtype  = _qtype
@@ -482,7 +686,88 @@ class dns(packet_base.PacketBase):
 
             return s
 
-# helpers for serialize: makeName, putName, putData
+    # Lazily decoded versions of question and rr, created by lazy_parser().
+    # The name and rddata are decoded from the packet the first time they're
+    # used, and kept from then on. The name and rddata properties hide the
+    # slots of the same name in question and rr, which go unused.
+
+    class lazy_question (question):
+        __slots__ = ['_wire', '_name_index', '_name']
+
+        def __init__(self, wire, name_index, qtype, qclass):
+            self._wire       = wire
+            self._name_index = name_index
+            self._name       = None
+            self.qtype       = qtype
+            self.qclass      = qclass
+
+        @property
+        def name(self):
+            if self._name is None:
+                self._name = self._wire.name(self._name_index)
+            return self._name
+
+    class lazy_rr (rr):
+        __slots__ = ['_wire', '_name_index', '_name', '_rddata_index',
+                     '_rddata']
+
+        def __init__ (self, wire, name_index, qtype, qclass, ttl, rdlen,
+                      rddata_index):
+            self._wire         = wire
+            self._name_index   = name_index
+            self._name         = None
+            self._rddata_index = rddata_index
+            self._rddata       = None
+            self.qtype         = qtype
+            self.qclass        = qclass
+            self.ttl           = ttl
+            self.rdlen         = rdlen
+
+        @property
+        def name(self):
+            if self._name is None:
+                self._name = self._wire.name(self._name_index)
+            return self._name
+
+        @property
+        def rddata(self):
+            if self._rddata is None:
+                self._rddata = self._wire.rddata(self.qtype, self.rdlen,
+                                                 self._rddata_index)
+            return self._rddata
+
+        def rddata_view(self):
+            ''' The raw rdata as a memoryview into the packet. No copy. '''
+            return memoryview(self._wire.buf)[self._rddata_index :
+                                              self._rddata_index + self.rdlen]
+
+
+class _dns_wire(object):
+    ''' The packet buffer shared by the lazy records of a single message,
+        along with its cache of decoded names. '''
+    __slots__ = ['buf', 'names']
+
+    def __init__(self, buf):
+        self.buf   = buf
+        self.names = {}
+
+    def name(self, index):
+        return dns.read_dns_name_from_index(self.buf, index, self.names)[1]
+
+    def rddata(self, qtype, rdlen, index):
+        return dns.rddata_from_index(self.buf, qtype, rdlen, index,
+                                     self.names)
+
+
+# helpers for serialize: makeName, writeName, writeData
+#
+# name_map maps each name suffix that can be pointed at to its offset in the
+# message. When a name is written out in full, every one of its suffixes is
+# added. When it ends in a pointer, only the full name is, as its shorter
+# suffixes aren't terminated there. The first offset written for a suffix is
+# kept. Offsets that don't fit in a 14 bit pointer aren't added.
+_MAX_POINTER_OFFSET = 0x3fff
+
 def makeName (labels, term):
     o = '' #TODO: unicode
     for l in labels.split('.'):
@@ -491,42 +776,58 @@ def makeName (labels, term):
     if term: o += '\x00'
     return o
 
-def putName (s, name, name_map):
-    pre = ''
-    post = name
-    while True:
-        at = s.find(makeName(post, True))
-        if at == -1:
-            if post in name_map:
-                at = name_map[post]
-        if at == -1:
-            post = post.split('.', 1)
-            if pre: pre += '.'
-            pre += post[0]
-            if len(post) == 1:
-                if len(pre) == 0:
-                    s += '\x00'
-                else:
-                    name_map[name] = len(s)
-                    s += makeName(pre, True)
-                break
-            post = post[1]
-        else:
-            if len(pre) > 0:
-                name_map[name] = len(s)
-                s += makeName(pre, False)
-            s += struct.pack("!H", at | 0xc000)
+def writeName (buf, name, name_map):
+    ''' Appends name to the bytearray buf, compressed against name_map. '''
+    if len(name) == 0:
+        buf.append(0)
+        return
+
+    # Find the longest suffix that has already been written. In the
+    # encoding, the label at character pos of name is at offset start + pos.
+    start = len(buf)
+    at = None
+    pos = 0
+    for label in name.split('.'):
+        at = name_map.get(name[pos:])
+        if at is not None:
             break
-    return s
+        pos += len(label) + 1
 
-def putData (s, r, name_map):
+    if at is None:
+        buf += makeName(name, True)
+        pos = 0
+        for label in name.split('.'):
+            if start + pos > _MAX_POINTER_OFFSET:
+                break
+            name_map[name[pos:]] = start + pos
+            pos += len(label) + 1
+    else:
+        if pos > 0:
+            buf += makeName(name[:pos - 1], False)
+            if start <= _MAX_POINTER_OFFSET:
+                name_map[name] = start
+        buf += struct.pack("!H", at | 0xc000)
+
+def writeData (buf, r, name_map):
     if r.qtype in (2,12,5,15):
-        return putName(s, r.rddata, name_map)
+        writeName(buf, r.rddata, name_map)
     elif r.qtype == 1:
 #        assert isinstance(r.rddata, IPAddr)
 #        return s + r.rddata.toRaw()
 #SPD        return s + addrconv.ipv4.text_to_bin(r.rddata)
 
-        return s + r.rddata
+        buf += r.rddata
     else:
-        return s + r.rddata
+        buf += r.rddata
+
+# putName and putData are the string-based versions of writeName and
+# writeData. Each call copies s, so build whole messages with serialize().
+def putName (s, name, name_map):
+    buf = bytearray(s)
+    writeName(buf, name, name_map)
+    return str(buf)
+
+def putData (s, r, name_map):
+    buf = bytearray(s)
+    writeData(buf, r, name_map)
+    return str(buf)
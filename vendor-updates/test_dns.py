@@ -132,6 +132,13 @@ class Test_dns(unittest.TestCase):
     
     def runTest(self):
         self.test_parser()
+        self.test_lazy_parser()
+        self.test_lazy_parser_truncated()
+        self.test_lazy_parser_buffers()
+        self.test_lazy_parser_filtered()
+        self.test_lazy_parser_noerror_responses_only()
+        self.test_name_cache()
+        self.test_name_pointer_loop()
         self.test_serialize()
         print "Successfully tested parser and serializer."
 
@@ -179,6 +186,113 @@ class Test_dns(unittest.TestCase):
             eq_(r.rdlen, s.rdlen)
             eq_(r.rddata, s.rddata)
 
+    def test_lazy_parser(self):
+        res = dns.lazy_parser(self.buf)
+
+        eq_(res.id, self.id)
+        eq_(res.qr, self.qr)
+        eq_(res.opcode, self.opcode)
+        eq_(res.rd, self.rd)
+        eq_(res.ra, self.ra)
+        eq_(res.rcode, self.rcode)
+
+        eq_(len(res.questions), len(self.questions))
+
+        for (r,s) in zip(res.questions, self.questions):
+            eq_(r.name, s.name)
+            eq_(r.qtype, s.qtype)
+            eq_(r.qclass, s.qclass)
+
+        eq_(len(res.answers), len(self.answers))
+        eq_(len(res.authorities), len(self.authorities))
+        eq_(len(res.additional), len(self.additional))
+
+        resrest = res.answers + res.authorities + res.additional
+        selfrest = self.answers + self.authorities + self.additional
+
+        for (r,s) in zip(resrest, selfrest):
+            eq_(r.name, s.name)
+            eq_(r.qtype, s.qtype)
+            eq_(r.qclass, s.qclass)
+            eq_(r.ttl, s.ttl)
+            eq_(r.rddata, s.rddata)
+
+        eq_(res.answers[0].rddata_view().tobytes(), self.answers[0].rddata)
+
+    def test_lazy_parser_truncated(self):
+        eq_(dns.lazy_parser(self.buf[:-2]), None)
+        eq_(dns.lazy_parser(self.buf[:dns.MIN_LEN - 1]), None)
+
+    def test_lazy_parser_buffers(self):
+        for buf in (bytearray(self.buf), memoryview(self.buf)):
+            res = dns.lazy_parser(buf)
+            eq_(res.answers[0].name, self.answers[0].name)
+            eq_(res.answers[0].rddata, self.answers[0].rddata)
+            eq_(res.answers[0].rddata_view().tobytes(),
+                self.answers[0].rddata)
+
+    def test_lazy_parser_filtered(self):
+        res = dns.lazy_parser(self.buf, qtypes=[dns.rr.A_TYPE],
+                              sections=['answers', 'additional'])
+        eq_(len(res.questions), 0)
+        eq_(len(res.answers), len(self.answers))
+        eq_(len(res.authorities), 0)
+        eq_(len(res.additional), len(self.additional))
+        for (r,s) in zip(res.answers + res.additional,
+                         self.answers + self.additional):
+            eq_(r.name, s.name)
+            eq_(r.rddata, s.rddata)
+
+        # NS records are all in the authorities
+        res = dns.lazy_parser(self.buf, qtypes=[dns.rr.NS_TYPE])
+        eq_(len(res.answers), 0)
+        eq_(len(res.authorities), len(self.authorities))
+        eq_(len(res.additional), 0)
+
+        # Parsing stops after the answers, even if the rest is truncated
+        res = dns.lazy_parser(self.buf[:-2], sections=['answers'])
+        eq_(len(res.answers), len(self.answers))
+
+    def test_lazy_parser_noerror_responses_only(self):
+        # self.buf is a query, so nothing past the header is parsed
+        res = dns.lazy_parser(self.buf, noerror_responses_only=True)
+        eq_(res.id, self.id)
+        eq_(len(res.questions) + len(res.answers), 0)
+
+        response = self.buf[:2] + chr(ord(self.buf[2]) | 0x80) + self.buf[3:]
+        res = dns.lazy_parser(response, noerror_responses_only=True)
+        eq_(res.qr, True)
+        eq_(len(res.answers), len(self.answers))
+
+        servfail = response[:3] + chr(ord(response[3]) | 2) + response[4:]
+        res = dns.lazy_parser(servfail, noerror_responses_only=True)
+        eq_(res.rcode, 2)
+        eq_(len(res.answers), 0)
+
+    def test_name_cache(self):
+        names = {}
+        (end, name) = dns.read_dns_name_from_index(self.buf, 12, names)
+        eq_(name, "seandonovan.net")
+        eq_(end, 12 + len(name) + 2)
+        eq_(names[12], (name, end))
+        eq_(names[12 + len("seandonovan") + 1], ("net", end))
+
+        # Decoding from the cache gives the same result
+        eq_(dns.read_dns_name_from_index(self.buf, 12, names), (end, name))
+
+        res = dns.parser(self.buf)
+        lazy = dns.lazy_parser(self.buf)
+        for (r,s) in zip(lazy.authorities, res.authorities):
+            eq_(r.rddata, s.rddata)
+
+    def test_name_pointer_loop(self):
+        # One question whose name is a pointer to itself
+        buf = struct.pack("!HBBHHHH", 1, 0, 0, 1, 0, 0, 0)
+        buf += "\xc0\x0c" + struct.pack("!HH", 1, 1)
+        eq_(dns.parser(buf), None)
+        res = dns.lazy_parser(buf)
+        self.assertRaises(Exception, getattr, res.questions[0], "name")
+
     def test_serialize(self):
         data = bytearray()
         prev = None